@@ -7,17 +7,37 @@ the CRIC and RUCIO databases. The idea for this module is that it will be faster
 users to get the information they need here than it would be to try to collect the
 information by going to the online portals for CRIC or RUCIO. The information collected
 can also be returned in a format easily used by other modules.
+
+The information retrieved from each source is cached on disk, by default in ~/.cache/lpc-scripts/, so that
+repeated lookups of the same site do not need to contact the online services. Cached information older than
+the time-to-live (--cache_ttl) is still used, but is refreshed in the background for the next lookup.
+The --refresh option forces the information to be retrieved from the sources again.
+
+For use without network access, a grid proxy, or CVMFS (e.g. on worker nodes or in tests) the information for
+many sites can be exported to a JSON snapshot file and read back later:
+
+python3 GetSiteInfo.py 'T*' --quiet --export_snapshot sites.json
+python3 GetSiteInfo.py T3_US_FNALLPC --snapshot sites.json
 """
 
 from __future__ import absolute_import
 import argparse
 from collections import namedtuple, defaultdict
+import concurrent.futures
+import copy
 from enum import Enum
+import fnmatch
+import functools
 import json
 import os
-import shlex
+import re
+import shutil
+import socket
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 import traceback
 from urllib import request
 
@@ -45,16 +65,295 @@ def is_number(num):
     except ValueError:
         return False
 
-def get_json_info(url):
+DEFAULT_TIMEOUT = 30
+
+# The errors raised when a source of site information cannot be reached or its information cannot be decoded.
+# TimeoutError and urllib.error.URLError are both subclasses of OSError.
+SOURCE_ERRORS = (OSError, ValueError)
+
+def get_json_info(url, timeout = DEFAULT_TIMEOUT):
     """Open the page and deserialize the json content for a given url.
     The loading of the information is somewhat equivalent to the command:
-    `curl -sS --capath /etc/grid-security/certificates/ <url>`
+    `curl -sS --capath /etc/grid-security/certificates/ --max-time <timeout> <url>`
 
     This style of loading information was copied from:
     https://github.com/dmwm/CMSRucio/blob/cbffac994c253746511af7d5d7cf954665bc5026/src/CRIC_test.py
     """
-    return json.load(request.urlopen(url))
+    with request.urlopen(url, timeout = timeout) as response:
+        return json.load(response)
+
+def get_cmssst_item(alias, timeout = DEFAULT_TIMEOUT):
+    """Return the entry for a given site alias from the CMSSST list of site endpoints, or None if there isn't one."""
+    result = get_json_info("http://cmssst.web.cern.ch/cmssst/site_info/site_endpoints.json", timeout)
+    try:
+        return next((item for item in result['data'] if item["site"] == alias), None)
+    except Exception as exc:
+        print("Unable to get the list of endpoints from http://cmssst.web.cern.ch")
+        print(result)
+        raise ValueError("Unexpected format for site_endpoints.json") from exc
+
+def get_siteconf_storage(alias, timeout = DEFAULT_TIMEOUT): # pylint: disable=unused-argument
+    """Return the first entry in the SITECONF storage.json file for a given site alias."""
+    with open(f'/cvmfs/cms.cern.ch/SITECONF/{alias}/storage.json', encoding = "utf-8") as file:
+        return json.load(file)[0]
+
+def run_concurrently(functions, timeout = DEFAULT_TIMEOUT, description = "information"):
+    """Call each of the functions in the dictionary 'functions' at the same time and wait at most 'timeout' seconds.
+    Return a dictionary with the same keys, mapping to either the value returned by the function or the exception it
+    raised. A function which does not finish in time is given a TimeoutError.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers = max(1, len(functions)))
+    futures = {key: executor.submit(function) for key, function in functions.items()}
+    concurrent.futures.wait(futures.values(), timeout = timeout)
+    executor.shutdown(wait = False)
+
+    results = {}
+    for key, future in futures.items():
+        if not future.done():
+            results[key] = TimeoutError(f"Retrieving the {key} {description} took longer than {timeout} seconds")
+        elif future.exception() is not None:
+            results[key] = future.exception()
+        else:
+            results[key] = future.result()
+    return results
+
+# The sources of site information. Each function is called with the site alias and a timeout in seconds.
+SOURCES = {
+    "cric_site": lambda alias, timeout: get_json_info(
+        'https://cms-cric.cern.ch/api/cms/site/query/list/?json&name=' + alias, timeout),
+    "cric_glidein": lambda alias, timeout: get_json_info(
+        'https://cms-cric.cern.ch/api/cms/glideinentry/query/list/?json&site=' + alias, timeout),
+    "cmssst": get_cmssst_item,
+    "siteconf": get_siteconf_storage,
+}
+
+# The sources containing the information for every site. Each function is called with a timeout in seconds.
+GLOBAL_SOURCES = {
+    "cric_site": lambda timeout: get_json_info('https://cms-cric.cern.ch/api/cms/site/query/list/?json', timeout),
+    "cric_glidein": lambda timeout: get_json_info('https://cms-cric.cern.ch/api/cms/glideinentry/query/list/?json', timeout),
+    "cmssst": lambda timeout: get_json_info("http://cmssst.web.cern.ch/cmssst/site_info/site_endpoints.json", timeout)['data'],
+}
+
+def index_global_sources(data):
+    """Split the information from the GLOBAL_SOURCES into dictionaries indexed by the site name.
+    The value stored for each site has the same format as the value returned by the matching function in SOURCES.
+    A source missing from 'data' gives an empty index.
+    """
+    index = {source: {} for source in GLOBAL_SOURCES}
+    for name, info in data.get("cric_site", {}).items():
+        index["cric_site"][name] = {name: info}
+    for name, entry in data.get("cric_glidein", {}).items():
+        index["cric_glidein"].setdefault(entry.get("site"), {})[name] = entry
+    for item in data.get("cmssst", []):
+        index["cmssst"].setdefault(item["site"], item)
+    return index
+
+def expand_aliases(patterns, names):
+    """Return the list of site aliases matching the 'patterns', in order and without duplicates.
+    A pattern containing the shell-style wildcards '*', '?', or '[' is matched against the known site 'names'.
+    Any other pattern is used as is.
+    """
+    aliases = []
+    for pattern in patterns:
+        if any(character in pattern for character in "*?["):
+            matches = fnmatch.filter(sorted(names), pattern)
+        else:
+            matches = [pattern]
+        aliases += [alias for alias in matches if alias not in aliases]
+    return aliases
+
+class SiteCache:
+    """An on-disk cache of the information retrieved from each source, keyed by the source and the site alias.
+    Each entry is stored as a separate JSON file along with the time it was retrieved.
+    Entries younger than 'ttl' seconds are used as is. Older entries are still returned, but a background thread
+    retrieves the information again and updates the cache (stale-while-revalidate). Entries older than
+    'ttl' + 'max_stale' seconds are retrieved again before returning. If 'refresh' is True the cache is only
+    written to, never read from.
+    """
+
+    default_directory = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "lpc-scripts")
 
+    def __init__(self, directory = default_directory, ttl = 86400, max_stale = 604800, refresh = False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._revalidating = {}
+
+    def path(self, source, alias):
+        """Return the path of the file storing the entry for a given source and site alias."""
+        safe_alias = "".join(c if c.isalnum() or c in "-_." else "_" for c in alias)
+        return os.path.join(self.directory, f"{source}_{safe_alias}.json")
+
+    def read(self, source, alias):
+        """Return the cached entry, a dictionary with the keys 'time' and 'data', or None if there is no valid entry."""
+        try:
+            with open(self.path(source, alias), encoding = "utf-8") as cache_file:
+                entry = json.load(cache_file)
+            if isinstance(entry, dict) and "time" in entry and "data" in entry:
+                return entry
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def write(self, source, alias, data):
+        """Store the data for a given source and site alias.
+        The file is written to a temporary location and then moved into place, so that readers never see a
+        partially written entry. Errors writing the cache are ignored.
+        """
+        try:
+            os.makedirs(self.directory, exist_ok = True)
+            with tempfile.NamedTemporaryFile("w", dir = self.directory, delete = False, encoding = "utf-8") as tmp:
+                json.dump({"time": time.time(), "data": data}, tmp)
+            os.replace(tmp.name, self.path(source, alias))
+        except OSError:
+            pass
+
+    def fetch(self, source, alias, retrieve):
+        """Retrieve the data for a given source and site alias and store it in the cache."""
+        data = retrieve()
+        self.write(source, alias, data)
+        return data
+
+    def _revalidate(self, source, alias, retrieve):
+        """Refresh a stale entry, ignoring any errors. This is the target of the background refresh threads."""
+        try:
+            self.fetch(source, alias, retrieve)
+        except Exception: # pylint: disable=broad-except
+            pass
+        finally:
+            with self._lock:
+                self._revalidating.pop((source, alias), None)
+
+    def get(self, source, alias, retrieve):
+        """Return the data for a given source and site alias, calling 'retrieve' to get it when needed.
+        The background refresh of a stale entry uses a daemon thread, so that a slow source never delays the exit
+        of the program. Call wait() to let the refreshes finish and update the cache.
+        """
+        entry = None if self.refresh else self.read(source, alias)
+        if entry is None:
+            return self.fetch(source, alias, retrieve)
+
+        age = time.time() - entry["time"]
+        if age > self.ttl + self.max_stale:
+            return self.fetch(source, alias, retrieve)
+        if age > self.ttl:
+            with self._lock:
+                if (source, alias) not in self._revalidating:
+                    thread = threading.Thread(target = self._revalidate, args = (source, alias, retrieve), daemon = True)
+                    self._revalidating[(source, alias)] = thread
+                    thread.start()
+        return entry["data"]
+
+    def wait(self):
+        """Wait for any background refreshes to finish."""
+        with self._lock:
+            threads = list(self._revalidating.values())
+        for thread in threads:
+            thread.join()
+
+SITE_CACHE = SiteCache()
+
+_endpoint_regex = re.compile(r"^(?:(?P<scheme>[a-z]+)://)?(?P<host>[^/:\s]+)(?::(?P<port>\d+))?")
+default_ports = {"root": 1094, "gsiftp": 2811, "srm": 8443, "davs": 443, "https": 443}
+
+def endpoint_host(endpoint):
+    """Return the protocol and host portion of an endpoint URL (e.g. 'root://cmseos.fnal.gov')."""
+    match = _endpoint_regex.match(endpoint)
+    return match.group(0) if match else endpoint
+
+def probe_endpoint(endpoint, timeout = 5):
+    """Return the number of seconds needed to open a TCP connection to an endpoint and, for XRootD endpoints, to stat
+    the top directory using xrdfs. Return None if the endpoint cannot be reached within 'timeout' seconds.
+    """
+    match = _endpoint_regex.match(endpoint)
+    if match is None:
+        return None
+    scheme = match.group("scheme") or "root"
+    host = match.group("host")
+    port = int(match.group("port") or default_ports.get(scheme, 1094))
+
+    start = time.monotonic()
+    try:
+        with socket.create_connection((host, port), timeout = timeout):
+            pass
+    except OSError:
+        return None
+    if scheme == "root" and shutil.which("xrdfs") is not None:
+        # A failed stat (e.g. no permission to read '/') still measures a round trip through the server,
+        # so only a timeout counts as a failure
+        try:
+            subprocess.run(["xrdfs", f"{host}:{port}", "stat", "/"], stdout = subprocess.DEVNULL,
+                           stderr = subprocess.DEVNULL, timeout = timeout, check = False)
+        except subprocess.TimeoutExpired:
+            return None
+    return time.monotonic() - start
+
+class EndpointRanking:
+    """Ranks the endpoints of a site by their measured latency.
+    The latency of each endpoint is measured by probe_endpoint, with all of the endpoints probed at the same time.
+    The measurements are kept in memory and in the SITE_CACHE directory for 'ttl' seconds. Endpoints which could not
+    be reached are ranked last. When the endpoints cannot be told apart, or the ranking is disabled, the longest
+    endpoint comes first, which was the only rule used before the ranking existed.
+    """
+
+    def __init__(self, ttl = 600, timeout = 5, enabled = True, probe = probe_endpoint):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.enabled = enabled
+        self.probe = probe
+        self._lock = threading.Lock()
+        self._latencies = {}
+
+    def cached_latency(self, endpoint):
+        """Return a tuple (found, latency) with the last measurement for an endpoint, if it is younger than the ttl."""
+        with self._lock:
+            measurement = self._latencies.get(endpoint)
+        if measurement is None:
+            entry = SITE_CACHE.read("latency", endpoint)
+            if entry is not None:
+                measurement = (entry["time"], entry["data"])
+                with self._lock:
+                    self._latencies[endpoint] = measurement
+        if measurement is None or time.time() - measurement[0] > self.ttl:
+            return False, None
+        return True, measurement[1]
+
+    def measure(self, endpoints):
+        """Probe the endpoints at the same time and return a dictionary mapping each of them to its latency."""
+        results = run_concurrently({endpoint: lambda endpoint = endpoint: self.probe(endpoint, self.timeout)
+                                    for endpoint in endpoints}, 2 * self.timeout + 1, "endpoint probe")
+        latencies = {}
+        for endpoint, result in results.items():
+            latencies[endpoint] = None if isinstance(result, Exception) else result
+            with self._lock:
+                self._latencies[endpoint] = (time.time(), latencies[endpoint])
+            SITE_CACHE.write("latency", endpoint, latencies[endpoint])
+        return latencies
+
+    def rank(self, endpoints, exclude = ()):
+        """Return the endpoints ordered from the best to the worst.
+        The endpoints whose host is in 'exclude' (e.g. those with an open circuit breaker) are left out, unless
+        that would leave out all of them.
+        """
+        excluded_hosts = {endpoint_host(endpoint) for endpoint in exclude}
+        candidates = sorted(endpoints, key = lambda endpoint: (-len(endpoint), endpoint))
+        candidates = [endpoint for endpoint in candidates if endpoint_host(endpoint) not in excluded_hosts] or candidates
+        if not self.enabled or len(candidates) < 2:
+            return candidates
+
+        latencies = {}
+        for endpoint in candidates:
+            found, latency = self.cached_latency(endpoint)
+            if found:
+                latencies[endpoint] = latency
+        missing = [endpoint for endpoint in candidates if endpoint not in latencies]
+        if missing:
+            latencies.update(self.measure(missing))
+        return sorted(candidates, key = lambda endpoint: (latencies[endpoint] is None, latencies[endpoint] or 0))
+
+ENDPOINT_RANKING = EndpointRanking()
 
 class EndpointType(Enum):
     """Enum class containing endpoint types for grid sites. Some of the values are aliases for
@@ -96,12 +395,55 @@ class Site:
         self.type = ""
         self.vo_name = ""
 
+    # The attributes stored in a snapshot, in addition to the endpoints
+    snapshot_attributes = ("alias", "facility", "fts", "glidein_name", "name", "local_path_to_store", "local_redirector",
+                           "pfn", "rse", "state", "status", "type", "vo_name")
+
     __do_not_cap = ["pfn"]
     __cap_rule = {"Fts":"FTS", "Glidein":"glidein", "Gsiftp":"gsiftp", "Rse":"RSE", "Vo":"VO"}
 
     def __repr__(self):
         return f"{self.__class__.__name__}({self.alias!r})"
 
+    def best_endpoint(self, endpoint_type = EndpointType.XROOTD, exclude = ()):
+        """Return the best endpoint of a given type, as ranked by ENDPOINT_RANKING, or None if there isn't one.
+        The endpoints whose host is in 'exclude' are only used if there is no other choice.
+        """
+        if endpoint_type not in self.endpoints or len(self.endpoints[endpoint_type]) == 0:
+            return None
+        return ENDPOINT_RANKING.rank(self.endpoints[endpoint_type], exclude)[0]
+
+    def fetch(self, source, timeout = DEFAULT_TIMEOUT):
+        """Return the information for this site from one of the SOURCES, using the SITE_CACHE when possible."""
+        return SITE_CACHE.get(source, self.alias, lambda: SOURCES[source](self.alias, timeout))
+
+    def prefetch(self, timeout = DEFAULT_TIMEOUT):
+        """Retrieve the information from all of the SOURCES at the same time.
+        Return a dictionary mapping each source to its information or, if retrieving it failed, the exception raised.
+        A source which does not finish within 'timeout' seconds is given a TimeoutError, so that a single slow
+        source cannot hold up the others.
+        """
+        return run_concurrently({source: lambda source = source: self.fetch(source, timeout) for source in SOURCES},
+                                timeout, f"information for {self.alias}")
+
+    def _source_data(self, source, prefetched = None, debug = False):
+        """Return the information from a source, either from the 'prefetched' dictionary or by retrieving it.
+        If the source cannot be reached (e.g. a network error or a TimeoutError, including one stored in the
+        'prefetched' dictionary) or its information cannot be decoded, a warning is printed and None is returned,
+        so that the information from the other sources can still be used. With 'debug' the error is raised instead.
+        """
+        try:
+            if prefetched is None or source not in prefetched:
+                return self.fetch(source)
+            if isinstance(prefetched[source], Exception):
+                raise prefetched[source]
+            return prefetched[source]
+        except SOURCE_ERRORS as exc:
+            if debug:
+                raise RuntimeError(traceback.format_exc()) from exc
+            print(f"\tWARNING::Unable to retrieve the {source} information for {self.alias}: {exc}")
+            return None
+
     def __str__(self):
         ret =  "Site Information:\n"
 
@@ -122,17 +464,18 @@ class Site:
                 ret += "\t" + description + ": " + str(getattr(self, member)) + "\n"
         return ret
 
-    def get_cric_info(self, debug = False, print_json = False):
+    def get_cric_info(self, debug = False, print_json = False, prefetched = None):
         """Get as much information as possible from the Computing Resource Information Catalog (CRIC).
         This catalog contains information about physical and CMS logical computing resources.
         the online web portal is at https://cms-cric.cern.ch/.
+        The information already retrieved by Site.prefetch can be passed using 'prefetched'.
         """
         if debug:
             print("GetSiteInfo::Site::get_cric_info()")
 
         # Alternate Links:
         #   'https://cms-cric.cern.ch/api/cms/facility/query/list/?json&name=US_Colorado'+site.alias[2:]
-        data = get_json_info('https://cms-cric.cern.ch/api/cms/site/query/list/?json&name=' + self.alias)
+        data = self._source_data("cric_site", prefetched, debug)
         try:
             if print_json:
                 print(data)
@@ -146,11 +489,11 @@ class Site:
             if debug:
                 raise RuntimeError(traceback.format_exc()) from exc
 
-        data = get_json_info('https://cms-cric.cern.ch/api/cms/glideinentry/query/list/?json&site=' + self.alias)
+        data = self._source_data("cric_glidein", prefetched, debug)
         try:
             if print_json:
                 print(data)
-            if len(data) > 0:
+            if data:
                 _, data = data.popitem()
                 self.glidein_name = data['name']
         except RuntimeError as rterr:
@@ -163,17 +506,17 @@ class Site:
         # Site information by tier
         #   https://cms-cric.cern.ch/api/cms/site/query/list/?json&tier_level=3
 
-    def get_cmssst_endpoint(self, debug = False, print_json = False):
+    def get_cmssst_endpoint(self, debug = False, print_json = False, prefetched = None):
         """Get as much site endpoint information as possible from CMSSST, the online web portal for which is
         located at https://cmssst.web.cern.ch/cmssst/site_info/site_endpoints.json.
+        The information already retrieved by Site.prefetch can be passed using 'prefetched'.
         """
         if debug:
             print("GetSiteInfo::Site::get_cmssst_endpoint()")
-        result = get_json_info("http://cmssst.web.cern.ch/cmssst/site_info/site_endpoints.json")
+        selected_item = self._source_data("cmssst", prefetched, debug)
         try:
             if print_json:
-                print(result)
-            selected_item = next((item for item in result['data'] if item["site"] == self.alias), None)
+                print(selected_item)
             if selected_item is not None:
                 prefix = ''
                 suffix = ''
@@ -186,48 +529,51 @@ class Site:
                 self.endpoints[EndpointType[selected_item['type'].replace('-','')]].add(prefix+selected_item['endpoint']+suffix)
         except Exception as exc:
             print("Unable to get the list of endpoints from http://cmssst.web.cern.ch")
-            print(result)
+            print(selected_item)
             if debug:
                 raise RuntimeError(traceback.format_exc()) from exc
 
-    def get_siteconf_info(self, debug = False, max_endpoint_values_per_type = 9999, print_json = False):
+    # pylint: disable-next=too-many-branches
+    def get_siteconf_info(self, debug = False, max_endpoint_values_per_type = 9999, print_json = False, prefetched = None):
         """Gather additional information from the storage.json files located at /cvmfs/cms.cern.ch/SITECONF.
         This feature requires that the /cvmfs/cms.cern.ch folder be mounted on the host. These files are also
         stored on GitLab at https://gitlab.cern.ch/SITECONF.
+        The information already retrieved by Site.prefetch can be passed using 'prefetched'.
         """
         if debug:
             print("GetSiteInfo::Site::get_siteconf_endpoints()")
+        data = self._source_data("siteconf", prefetched, debug)
+        if data is None:
+            return
         try:
-            with open(f'/cvmfs/cms.cern.ch/SITECONF/{self.alias}/storage.json', encoding = "utf-8") as file:
-                data = json.load(file)[0]
-                if print_json:
-                    print(data)
-
-                self.type = data["type"]
-                self.rse = data["rse"]
-                self.fts += data["fts"]
-
-                for protocol in data["protocols"]:
-                    if "prefix" not in protocol:
-                        continue
-
-                    protocol_name = "Unknown"
-                    if EndpointType.has_member(protocol["protocol"]):
-                        protocol_name = protocol["protocol"]
-
-                    if EndpointType[protocol_name] in self.endpoints and \
-                        len(self.endpoints[EndpointType[protocol_name]]) >= max_endpoint_values_per_type:
-                        shortest_endpoint = min(self.endpoints[EndpointType[protocol_name]], key=len)
-                        if len(shortest_endpoint) < len(protocol["prefix"]):
-                            self.endpoints[EndpointType[protocol_name]].remove(shortest_endpoint)
-                            self.endpoints[EndpointType[protocol_name]].add(protocol["prefix"])
-                    else:
+            if print_json:
+                print(data)
+
+            self.type = data["type"]
+            self.rse = data["rse"]
+            self.fts += data["fts"]
+
+            for protocol in data["protocols"]:
+                if "prefix" not in protocol:
+                    continue
+
+                protocol_name = "Unknown"
+                if EndpointType.has_member(protocol["protocol"]):
+                    protocol_name = protocol["protocol"]
+
+                if EndpointType[protocol_name] in self.endpoints and \
+                    len(self.endpoints[EndpointType[protocol_name]]) >= max_endpoint_values_per_type:
+                    shortest_endpoint = min(self.endpoints[EndpointType[protocol_name]], key=len)
+                    if len(shortest_endpoint) < len(protocol["prefix"]):
+                        self.endpoints[EndpointType[protocol_name]].remove(shortest_endpoint)
                         self.endpoints[EndpointType[protocol_name]].add(protocol["prefix"])
-                    if protocol_name == EndpointType.SRMv2.name and "gsiftp://" in protocol["prefix"] and \
-                        EndpointType.GSIFTP not in self.endpoints:
-                        self.endpoints[EndpointType.GSIFTP].add(protocol["prefix"])
-                    if EndpointType.GSIFTP in self.endpoints:
-                        self.pfn = max(self.endpoints[EndpointType.GSIFTP], key=len)
+                else:
+                    self.endpoints[EndpointType[protocol_name]].add(protocol["prefix"])
+                if protocol_name == EndpointType.SRMv2.name and "gsiftp://" in protocol["prefix"] and \
+                    EndpointType.GSIFTP not in self.endpoints:
+                    self.endpoints[EndpointType.GSIFTP].add(protocol["prefix"])
+                if EndpointType.GSIFTP in self.endpoints:
+                    self.pfn = max(self.endpoints[EndpointType.GSIFTP], key=len)
         except Exception as exc:
             print(f"Unable to get a list of endpoints from /cvmfs/cms.cern.ch/SITECONF/{self.alias}/storage.json")
             if debug:
@@ -243,6 +589,23 @@ class Site:
             if localDict[self.alias].xrootd_endpoint != '':
                 self.endpoints[EndpointType.XROOTD].add(localDict[self.alias].xrootd_endpoint)
 
+    def to_dict(self):
+        """Return the site information as a dictionary which can be serialized to JSON."""
+        data = {attribute: getattr(self, attribute) for attribute in self.snapshot_attributes}
+        data["endpoints"] = {endpoint_type.name: sorted(values) for endpoint_type, values in self.endpoints.items()}
+        return data
+
+    def update_from_dict(self, data):
+        """Set the site information from a dictionary created by Site.to_dict.
+        The values are copied, so that changing the site does not change the dictionary, which may be the
+        snapshot shared by every site read from the same file.
+        """
+        for attribute in self.snapshot_attributes:
+            if attribute in data:
+                setattr(self, attribute, copy.deepcopy(data[attribute]))
+        for name, values in data.get("endpoints", {}).items():
+            self.endpoints[EndpointType[name]].update(values)
+
     def print_shell_str(self, shell = None, env = False):
         """An alternate method for printing the site information. this method is capable of printing
         a subset of the information in a more compact, shell-friendly manner. It is also capable of
@@ -270,21 +633,121 @@ class Site:
                   "Use 'GetSiteInfo.py --help' to check the list of acceptable options.")
             raise RuntimeError(traceback.format_exc()) from exc
 
-    def get_info_from_all_sources(self, debug = False, max_endpoint_values_per_type = 9999, print_json = False):
-        """This function is a shortcut for gathering information from all available resources."""
+    def get_info_from_all_sources(self, debug = False, max_endpoint_values_per_type = 9999, print_json = False,
+                                  timeout = DEFAULT_TIMEOUT, prefetched = None):
+        """This function is a shortcut for gathering information from all available resources.
+        The sources are queried at the same time, but their information is added in a fixed order so that
+        the result does not depend on which source answers first.
+        """
+        if prefetched is None:
+            prefetched = self.prefetch(timeout)
 
         # Get information from CRIC
-        self.get_cric_info(debug, print_json)
+        self.get_cric_info(debug, print_json, prefetched)
 
         # Get information from cmssst
-        self.get_cmssst_endpoint(debug, print_json)
+        self.get_cmssst_endpoint(debug, print_json, prefetched)
 
         # Get more endpoints from SITECONF
-        self.get_siteconf_info(debug, max_endpoint_values_per_type, print_json)
+        self.get_siteconf_info(debug, max_endpoint_values_per_type, print_json, prefetched)
 
         # add the information stored in the dictionary defined at the top
         self.add_local_information()
 
+def save_snapshot(sites, path):
+    """Write the information for an iterable of Site objects to the JSON snapshot file at 'path'."""
+    snapshot = {"time": time.time(), "sites": {site.alias: site.to_dict() for site in sites}}
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile("w", dir = directory, delete = False, encoding = "utf-8") as tmp:
+        json.dump(snapshot, tmp, sort_keys = True, separators = (",", ":"))
+    os.replace(tmp.name, path)
+
+@functools.lru_cache(maxsize = None)
+def load_snapshot(path):
+    """Return a dictionary mapping each site alias to its information from the JSON snapshot file at 'path'.
+    Each file is only read once per process.
+    """
+    with open(path, encoding = "utf-8") as snapshot_file:
+        return json.load(snapshot_file)["sites"]
+
+def get_site_from_snapshot(path, site_alias = "", site = None):
+    """Return the Site with the information for 'site_alias', or for 'site' if given, from the snapshot at 'path'."""
+    if site is None:
+        site = Site(site_alias)
+    sites = load_snapshot(path)
+    if site.alias not in sites:
+        raise RuntimeError(f"The site {site.alias} is not in the snapshot {path}")
+    site.update_from_dict(sites[site.alias])
+    return site
+
+def proxy_path():
+    """Return the path to the grid proxy file, in the same way as voms-proxy-info."""
+    return os.environ.get("X509_USER_PROXY", f"/tmp/x509up_u{os.getuid()}")
+
+_proxy_expiry = {}
+
+def proxy_expiry(path = None):
+    """Return the time, in seconds since the epoch, at which the grid proxy expires, or None if there is no valid proxy.
+    The lifetime is found by running 'voms-proxy-info -timeleft' once for each version of the proxy file, as
+    identified by its path, modification time, and size. The result is remembered for the rest of the process and
+    stored in the SITE_CACHE directory, so that later processes do not need to run voms-proxy-info again until the
+    proxy is replaced.
+    """
+    path = path or proxy_path()
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key in _proxy_expiry:
+        return _proxy_expiry[key]
+
+    entry = SITE_CACHE.read("proxy", path)
+    if entry is not None and entry["data"].get("mtime_ns") == stat.st_mtime_ns and entry["data"].get("size") == stat.st_size:
+        expiry = entry["data"]["expiry"]
+    else:
+        try:
+            result = subprocess.run(["voms-proxy-info", "-file", path, "-timeleft"], stdout = subprocess.PIPE,
+                                    stderr = subprocess.DEVNULL, encoding = "utf-8", check = False)
+            time_left = int(result.stdout.strip()) if result.returncode == 0 else 0
+        except (OSError, ValueError):
+            time_left = 0
+        expiry = time.time() + time_left if time_left > 0 else None
+        SITE_CACHE.write("proxy", path, {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "expiry": expiry})
+    _proxy_expiry[key] = expiry
+    return expiry
+
+def proxy_time_left(path = None):
+    """Return the number of seconds until the grid proxy expires, or 0 if there is no valid proxy."""
+    expiry = proxy_expiry(path)
+    return max(0, expiry - time.time()) if expiry is not None else 0
+
+def check_proxy(min_time_left = 600, path = None):
+    """Make sure that there is a grid proxy valid for at least 'min_time_left' seconds, running voms-proxy-init if
+    there isn't one. Return the path to the proxy or raise a RuntimeError if there is still no valid proxy.
+    """
+    path = path or proxy_path()
+    if proxy_time_left(path) < min_time_left:
+        print("\tWARNING::You must have a valid proxy for this script to work.\n" \
+              "Running \"voms-proxy-init -voms cms\"...\n")
+        subprocess.call("voms-proxy-init -voms cms -valid 192:00",
+                        shell=True)
+        if proxy_time_left(path) < min_time_left:
+            raise RuntimeError("Sorry, but I still could not find your proxy.\n" \
+                               "Without a valid proxy, this program will fail spectacularly.\n" \
+                               "The program will now exit.")
+    return path
+
+def warn_if_proxy_expires(duration, path = None):
+    """Print a warning and return True if the grid proxy expires in less than 'duration' seconds."""
+    time_left = proxy_time_left(path)
+    if time_left >= duration:
+        return False
+    print(f"\tWARNING::The grid proxy expires in {time_left / 3600:.1f} hours, but the estimated time needed is "
+          f"{duration / 3600:.1f} hours.\n"
+          "\tConsider running \"voms-proxy-init -voms cms -valid 192:00\" first.")
+    return True
+
 def run_checks(quiet):
     """Does some basic sanity checks before proceeding with the rest of the module.
     This tries to head off problems that might occur later on.
@@ -309,62 +772,132 @@ def run_checks(quiet):
         raise RuntimeError(f"The directory {directory} is not mounted.")
 
     # check for a grid proxy
-    with open(os.devnull, 'wb') as devnull:
-        returncode = 0
-        with subprocess.Popen(shlex.split('voms-proxy-info -exists -valid 0:10'),
-                                   stdout=devnull,
-                                   stderr=subprocess.STDOUT) as process:
-            returncode = process.wait()
-        if returncode != 0 :
-            print("\tWARNING::You must have a valid proxy for this script to work.\n" \
-                  "Running \"voms-proxy-init -voms cms\"...\n")
-            subprocess.call("voms-proxy-init -voms cms -valid 192:00",
-                            shell=True)
-            with subprocess.Popen(shlex.split('voms-proxy-info -exists -valid 0:10'),
-                                  stdout=devnull,
-                                  stderr=subprocess.STDOUT) as process:
-                returncode = process.wait()
-            if returncode != 0:
-                raise RuntimeError("Sorry, but I still could not find your proxy.\n" \
-                                   "Without a valid proxy, this program will fail spectacularly.\n" \
-                                   "The program will now exit.")
-
-    return os.environ['X509_USER_PROXY']
-
-def get_site_info(site_alias = "",
+    return check_proxy()
+
+def get_site_info(site_alias = "", # pylint: disable=too-many-arguments
                   site = None,
                   debug = False,
                   env = False,
                   max_endpoint_values_per_type = 9999,
                   print_json = False,
                   quiet = False,
-                  shell = None):
+                  shell = None,
+                  refresh = False,
+                  cache_ttl = None,
+                  timeout = DEFAULT_TIMEOUT,
+                  snapshot = None):
     """Main module function which coordinates the various information finding tasks and decides how to print the
     information to STDOUT.
+    If 'refresh' is True the information is retrieved from the sources even if it is cached. The 'cache_ttl' sets
+    the number of seconds after which the cached information is considered stale. The 'timeout' is the maximum
+    number of seconds to wait for each source of information.
+    If the path to a 'snapshot' file is given the information is read from it instead and none of the checks are run.
     """
+    if snapshot:
+        site = get_site_from_snapshot(snapshot, site_alias, site)
+        if not quiet:
+            print_site(site, env, shell)
+        return site
+
     run_checks(quiet|(shell is not None))
 
+    SITE_CACHE.refresh = refresh
+    if cache_ttl is not None:
+        SITE_CACHE.ttl = cache_ttl
+
     if site is None:
         site = Site(site_alias)
 
-    site.get_info_from_all_sources(debug, max_endpoint_values_per_type, print_json)
+    site.get_info_from_all_sources(debug, max_endpoint_values_per_type, print_json, timeout)
 
     # print the site information to the console
     if not quiet:
-        if shell is not None and isinstance(shell, list):
-            site.print_shell_str(shell, env)
-        else:
-            print(str(site))
+        print_site(site, env, shell)
 
     return site
 
+def get_sites_info(aliases, # pylint: disable=too-many-arguments,too-many-locals
+                   debug = False,
+                   env = False,
+                   max_endpoint_values_per_type = 9999,
+                   print_json = False,
+                   quiet = False,
+                   shell = None,
+                   refresh = False,
+                   cache_ttl = None,
+                   timeout = DEFAULT_TIMEOUT,
+                   snapshot = None):
+    """Retrieve the information for many sites at once and return a dictionary mapping each alias to its Site.
+    The 'aliases' may contain shell-style wildcards, like 'T2_US_*', which are matched against the sites known to CRIC.
+    Instead of querying CRIC and CMSSST for each site, the lists for all of the sites are retrieved once and indexed
+    by the site name. The information for each site is also stored in the cache used by get_site_info.
+    The other arguments have the same meaning as for get_site_info.
+    """
+    if snapshot:
+        sites = {}
+        for alias in expand_aliases(aliases, load_snapshot(snapshot)):
+            sites[alias] = get_site_from_snapshot(snapshot, alias)
+            if not quiet:
+                print_site(sites[alias], env, shell)
+        return sites
+
+    run_checks(quiet|(shell is not None))
+
+    SITE_CACHE.refresh = refresh
+    if cache_ttl is not None:
+        SITE_CACHE.ttl = cache_ttl
+
+    def fetch_all(source):
+        return SITE_CACHE.get(source, "all", lambda: GLOBAL_SOURCES[source](timeout))
+
+    data = run_concurrently({source: lambda source = source: fetch_all(source) for source in GLOBAL_SOURCES},
+                            timeout, "information for all sites")
+    failed = {}
+    for source, value in data.items():
+        if isinstance(value, SOURCE_ERRORS):
+            print(f"\tWARNING::Unable to retrieve the {source} information for all sites: {value}")
+            failed[source] = value
+        elif isinstance(value, Exception):
+            raise value
+    index = index_global_sources({source: value for source, value in data.items() if source not in failed})
+
+    sites = {}
+    for alias in expand_aliases(aliases, set(index["cric_site"]) | set(localDict)):
+        site = Site(alias)
+        prefetched = {"cric_site": index["cric_site"].get(alias, {}),
+                      "cric_glidein": index["cric_glidein"].get(alias, {}),
+                      "cmssst": index["cmssst"].get(alias)}
+        for source, value in prefetched.items():
+            if source not in failed:
+                SITE_CACHE.write(source, alias, value)
+        prefetched.update(failed)
+        try:
+            prefetched["siteconf"] = site.fetch("siteconf", timeout)
+        except Exception as exc: # pylint: disable=broad-except
+            prefetched["siteconf"] = exc
+
+        site.get_info_from_all_sources(debug, max_endpoint_values_per_type, print_json, timeout, prefetched)
+        if not quiet:
+            print_site(site, env, shell)
+        sites[alias] = site
+
+    return sites
+
+def print_site(site, env = False, shell = None):
+    """Print the site information to the console, either in full or only the items listed in 'shell'."""
+    if shell is not None and isinstance(shell, list):
+        site.print_shell_str(shell, env)
+    else:
+        print(str(site))
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="""Access CRIC and PhEDEx to retrieve a sites information.""",
                                      epilog="""When the --shell option comes before the positional argument you need
                                      to add '--' (no quotes) before the positional argument.\n\n
                                      And those are the options available. Deal with it.""")
-    parser.add_argument("site_alias",
-                        help="The alias of the server whose information you want to retrieve")
+    parser.add_argument("site_alias", nargs = "+",
+                        help="The aliases of the servers whose information you want to retrieve. The aliases may contain " \
+                        "shell-style wildcards, like 'T2_US_*', which need to be quoted")
     parser.add_argument("-d","--debug", action = "store_true",
                         help = "Shows some extra information in order to debug this program (default = %(default)s)")
     parser.add_argument("-e","--env", action = "store_true",
@@ -381,6 +914,19 @@ if __name__ == '__main__':
                         choices = ['alias','endpoints','facility','fts','glidein_name','name','local_path_to_store',
                                  'local_redirector','pfn','rse','state','status','type','vo_name'],
                         help = "Print selected information in a shell friendly manner (default = %(default)s)")
+    parser.add_argument("-r","--refresh", action = "store_true",
+                        help = "Retrieve the information from the sources instead of the cache in " \
+                        f"{SiteCache.default_directory} (default = %(default)s)")
+    parser.add_argument("--cache_ttl", type = float, default = SITE_CACHE.ttl,
+                        help = "The number of seconds after which the cached information is refreshed (default = %(default)s)")
+    parser.add_argument("-t","--timeout", type = float, default = DEFAULT_TIMEOUT,
+                        help = "The maximum number of seconds to wait for each source of information (default = %(default)s)")
+    parser.add_argument("--snapshot", default = None,
+                        help = "Read the site information from this JSON snapshot file instead of the online sources. " \
+                        "No proxy, network, or CVMFS access is needed (default = %(default)s)")
+    parser.add_argument("--export_snapshot", metavar = "PATH", default = None,
+                        help = "Retrieve the information for all of the requested sites and write it to this JSON " \
+                        "snapshot file (default = %(default)s)")
     parser.add_argument('--version', action = 'version', version = '%(prog)s v2.0 (Franklin)')
 
     args = parser.parse_args()
@@ -390,4 +936,12 @@ if __name__ == '__main__':
         print('Argument List:', str(sys.argv))
         print("Argument ", args)
 
-    get_site_info(**vars(args))
+    arguments = vars(args)
+    site_aliases = arguments.pop("site_alias")
+    export_snapshot = arguments.pop("export_snapshot")
+    if export_snapshot:
+        save_snapshot(get_sites_info(site_aliases, **arguments).values(), export_snapshot)
+    elif len(site_aliases) == 1 and not any(character in site_aliases[0] for character in "*?["):
+        get_site_info(site_alias = site_aliases[0], **arguments)
+    else:
+        get_sites_info(site_aliases, **arguments)
@@ -16,23 +16,127 @@ RecursiveFileList.get_dir_list("<absolute path>")
 
 The 'map_dir' will return a dictionary while the other two functions will return lists.
 
+For large directory trees the generator functions 'iter_files', 'iter_dirs', and 'walk' can be used
+instead. They yield the paths one at a time, so the memory usage does not grow with the size of the tree:
+
+for file_path in RecursiveFileList.iter_files("<absolute path>"):
+    ...
+
+On network filesystems (NFS, the EOS FUSE mount, /uscms_data) listing a directory is dominated by latency.
+In that case several directories can be listed at the same time by passing a number of worker threads.
+The lists returned in this mode are sorted, so that the output does not depend on the order in which the
+listings complete:
+
+RecursiveFileList.get_file_list("<absolute path>", workers = 8)
+RecursiveFileList.get_dir_list("<absolute path>", workers = 8)
+
 Created by: John Hakala, 03/28/2017
 Modified by: Alexx Perloff, 10/01/2021
 """
 
 from __future__ import absolute_import
-from os import path, listdir
+from os import path, scandir
+import queue
+import threading
+
+def _scan(directory):
+    """Return the file and directory entries of 'directory' in the order they are listed.
+    The entries come from os.scandir, which knows the type of most entries without an additional stat call.
+    The listing is read completely before returning, so that no file descriptors are held open during recursion.
+    """
+    with scandir(directory) as iterator:
+        return [entry for entry in iterator if entry.is_file() or entry.is_dir()]
+
+def _iter_tree(directory):
+    """Yield the file and directory entries below 'directory', depth first, in the order they are listed."""
+    for entry in _scan(directory):
+        yield entry
+        if entry.is_dir():
+            yield from _iter_tree(entry.path)
+
+def iter_files(dir_name):
+    """Yield the paths of the files below the base path 'dir_name', one at a time."""
+    for entry in _iter_tree(dir_name):
+        if not entry.is_dir():
+            yield entry.path
+
+def iter_dirs(dir_name):
+    """Yield the paths of the directories below the base path 'dir_name', one at a time."""
+    for entry in _iter_tree(dir_name):
+        if entry.is_dir():
+            yield entry.path
+
+def walk(top):
+    """Yield a (dirpath, dirnames, filenames) tuple for 'top' and for each directory below it, top-down,
+    in the same way as os.walk.
+    """
+    dirnames = []
+    filenames = []
+    for entry in _scan(top):
+        if entry.is_dir():
+            dirnames.append(entry.name)
+        else:
+            filenames.append(entry.name)
+    yield top, dirnames, filenames
+    for dirname in dirnames:
+        yield from walk(path.join(top, dirname))
+
+def parallel_scan(dir_name, workers = 8):
+    """Return a tuple of sorted lists (files, directories) with the paths below the base path 'dir_name'.
+    The directories are listed by a pool of 'workers' threads which share a queue of directories still to be listed.
+    The first error encountered while listing a directory is raised once all of the workers have finished.
+    """
+    work = queue.Queue()
+    lock = threading.Lock()
+    files = []
+    dirs = []
+    errors = []
+
+    def worker():
+        while True:
+            directory = work.get()
+            if directory is None:
+                work.task_done()
+                return
+            try:
+                entries = _scan(directory)
+            except OSError as err:
+                with lock:
+                    errors.append(err)
+            else:
+                subdirs = [entry.path for entry in entries if entry.is_dir()]
+                with lock:
+                    dirs.extend(subdirs)
+                    files.extend(entry.path for entry in entries if not entry.is_dir())
+                for subdir in subdirs:
+                    work.put(subdir)
+            finally:
+                work.task_done()
+
+    threads = [threading.Thread(target = worker, daemon = True) for _ in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+    work.put(dir_name)
+    work.join()
+    for _ in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return sorted(files), sorted(dirs)
 
 def map_dir(prefix, directory):
     """Return a dictionary of all of the files and folders below 'directory'."""
     this_dir = path.join(prefix, directory)
     child_map = {}
     contents = []
-    for child in listdir(this_dir):
-        if path.isfile(path.join(this_dir, child)):
-            contents.append(child)
-        elif path.isdir(path.join(this_dir, child)):
-            contents.append(map_dir(this_dir, child))
+    for child in _scan(this_dir):
+        if child.is_dir():
+            contents.append(map_dir(this_dir, child.name))
+        else:
+            contents.append(child.name)
     child_map[directory] = contents
     return child_map
 
@@ -59,19 +163,23 @@ def make_dir_list(prefix, dir_map):
                     dir_list.append(path.join(path.join(prefix, key), sub_dir))
     return dir_list
 
-def get_file_list(dir_name):
+def get_file_list(dir_name, workers = 1):
     """Returns a list of file paths below the base path 'dir_name'.
-    This function provides one level of indirection for making the dir_map
-    needed by make_file_list.
+    This function is a thin wrapper around the iter_files generator.
+    If 'workers' is larger than one the tree is scanned using parallel_scan and the list is sorted.
     """
-    return make_file_list(dir_name, map_dir(dir_name, dir_name))
+    if workers > 1:
+        return parallel_scan(dir_name, workers)[0]
+    return list(iter_files(dir_name))
 
-def get_dir_list(dir_name):
+def get_dir_list(dir_name, workers = 1):
     """Returns a list of directory paths below the base path 'dir_name'.
-    This function provides one level of indirection for making the dir_map
-    needed by make_dir_list.
+    This function is a thin wrapper around the iter_dirs generator.
+    If 'workers' is larger than one the tree is scanned using parallel_scan and the list is sorted.
     """
-    return make_dir_list(dir_name, map_dir(dir_name, dir_name))
+    if workers > 1:
+        return parallel_scan(dir_name, workers)[1]
+    return list(iter_dirs(dir_name))
 
 if __name__ == "__main__":
     from sys import argv
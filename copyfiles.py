@@ -10,21 +10,41 @@ module is intended to replace 'xrdcp -r'. That said, it has a lot more features,
 improvement over 'xrdcp', like the ability to use 'gsiftp' information for the endpoints.
 """
 
+# pylint: disable=too-many-lines
 from __future__ import absolute_import
 import argparse
+import calendar
+from collections import defaultdict, namedtuple
+import concurrent.futures
+import contextlib
 import fnmatch
+import functools
+import json
 import os
-import shlex
+import random
+import re
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+import zlib
 import GetSiteInfo
+try:
+    from XRootD import client as xrootd_client # pylint: disable=import-error
+    from XRootD.client import flags as xrootd_flags # pylint: disable=import-error
+except ImportError:
+    xrootd_client = None
+    xrootd_flags = None
 
 class Command:
     """This is the base class used for building up the copy/ls/mkdir commands."""
-    def __init__(self, *, start_site = None, end_site = None, verbose = False, additional_arguments = "", override_path = ""):
+    def __init__(self, *, start_site = None, end_site = None, verbose = False, additional_arguments = "", override_path = "",
+                 force = False):
         self.start_site = start_site
         self.end_site = end_site
         self.verbose = verbose
+        self.force = force
         self.additional_arguments = additional_arguments
         self.override_path = override_path
         self.command_pieces = []
@@ -74,9 +94,9 @@ class GfalCommand(Command):
         if site.alias == 'local':
             return "file:////"
         elif GetSiteInfo.EndpointType.GSIFTP in site.endpoints:
-            return max(site.endpoints[GetSiteInfo.EndpointType.GSIFTP], key=len) + "/store/user/" + site.username + "/"
+            return best_endpoint(site, GetSiteInfo.EndpointType.GSIFTP) + "/store/user/" + site.username + "/"
         elif GetSiteInfo.EndpointType.XROOTD in site.endpoints:
-            return max(site.endpoints[GetSiteInfo.EndpointType.XROOTD], key=len) + "/store/user/" + site.username + "/"
+            return best_endpoint(site) + "/store/user/" + site.username + "/"
         else:
             print(site)
             raise RuntimeError(f"The site {site.alias} must be 'local' or have either a gsiftp or xrootd endpoint.")
@@ -88,6 +108,8 @@ class GfalCommand(Command):
             self.command_pieces.append("-vvv")
         if self.recursive:
             self.command_pieces.append("-r")
+        if self.force:
+            self.command_pieces.append("-f")
         if self.dry_run:
             self.command_pieces.append("--dry-run")
         if self.additional_arguments != "":
@@ -101,12 +123,13 @@ class GfalCommand(Command):
 
 class XRootDCommand(Command):
     """Creates and stores a GFAL based command"""
-    def __init__(self, *, action, subaction = "", quiet = False, **kwargs):
+    def __init__(self, *, action, subaction = "", quiet = False, streams = None, **kwargs):
         super().__init__(**kwargs)
         self.base_command = "xrd"
         self.action = action
         self.subaction = subaction
         self.quiet = quiet
+        self.streams = streams
         self.start_site_prefix = self.get_site_prefix(self.start_site) if self.start_site is not None else ""
         self.end_site_prefix = self.get_site_prefix(self.end_site) if self.end_site is not None else ""
         self.build_command()
@@ -119,12 +142,12 @@ class XRootDCommand(Command):
             return ""
         elif GetSiteInfo.EndpointType.XROOTD in site.endpoints:
             if self.subaction != "":
-                xrootd_endpoint = max(site.endpoints[GetSiteInfo.EndpointType.XROOTD], key=len)
+                xrootd_endpoint = best_endpoint(site)
                 split = xrootd_endpoint.find("/", len("root://")) + 1
                 return xrootd_endpoint[:split] + " " + self.subaction + " " + \
                        xrootd_endpoint[split:] + "/store/user/" + site.username + "/"
             else:
-                return max(site.endpoints[GetSiteInfo.EndpointType.XROOTD], key=len) + "/store/user/" + site.username + "/"
+                return best_endpoint(site) + "/store/user/" + site.username + "/"
         else:
             print(site)
             raise RuntimeError(f"The site {site.alias} must be 'local' or have an xrootd endpoint.")
@@ -136,6 +159,10 @@ class XRootDCommand(Command):
             self.command_pieces.append("-v")
         if self.quiet:
             self.command_pieces.append("-s")
+        if self.force:
+            self.command_pieces.append("-f")
+        if self.streams is not None:
+            self.command_pieces.append("--streams " + str(self.streams))
         if self.additional_arguments != "":
             self.command_pieces.append(self.additional_arguments)
         self.command_pieces.append((self.start_site_prefix +
@@ -145,6 +172,50 @@ class XRootDCommand(Command):
                                     (self.override_path if self.override_path != "" else self.end_site.path) +
                                     "") if self.end_site is not None else "")
 
+class CopyTask(namedtuple('CopyTask', 'source destination command size force path', defaults = (None, False, None))):
+    """Namedtuple used to store a single planned file transfer. The size of the source file is optional.
+    If 'force' is True an existing destination file is overwritten. The optional 'path' is the destination path
+    relative to the user area of the end site (or the local path), which does not depend on the endpoint used.
+    """
+    __slots__ = ()
+    def __str__(self):
+        return self.command
+
+    def split(self):
+        """Return the list of single file CopyTasks contained in this task."""
+        return [self]
+
+class BatchCopyTask(namedtuple('BatchCopyTask', 'sources destinations command sizes force paths', defaults = (False, None))):
+    """Namedtuple used to store a group of planned file transfers which share a destination directory.
+    The command only contains the executable and its arguments, as the sources are passed using '--infiles'.
+    If 'force' is True the existing destination files are overwritten.
+    """
+    __slots__ = ()
+    def __str__(self):
+        return f"{self.command} --infiles <{len(self.sources)} files> {self.destination}"
+
+    @property
+    def source(self):
+        """The directory containing the source files."""
+        return os.path.dirname(self.sources[0]) + "/"
+
+    @property
+    def destination(self):
+        """The destination directory for all of the files."""
+        return os.path.dirname(self.destinations[0]) + "/"
+
+    def split(self):
+        """Return the list of single file CopyTasks contained in this task."""
+        paths = self.paths or (None,) * len(self.sources)
+        return [CopyTask(source, destination, f"{self.command} {source} {destination}", size, self.force, path) \
+                for source, destination, size, path in zip(self.sources, self.destinations, self.sizes, paths)]
+
+class TransferPlan:
+    """The destination directories to create and the transfers to run, which are collected while walking the source tree."""
+    def __init__(self):
+        self.directories = []
+        self.tasks = []
+
 class Error(EnvironmentError):
     """EnvironmentError is the base class for errors that come from outside of Python (the operating system,
     file system, etc.). It is the parent class for IOError and OSError exceptions.
@@ -169,6 +240,817 @@ class Location(GetSiteInfo.Site):
         print("\tusername:", self.username)
         print("\tPath:", self.path)
 
+class ListingEntry(namedtuple('ListingEntry', 'name is_dir size mtime')):
+    """Namedtuple used to store the information about a single entry of a remote directory listing.
+    The mtime is the modification time in seconds since the epoch, or None if it is not known.
+    """
+    __slots__ = ()
+    def __str__(self):
+        mtime = time.strftime(_listing_time_format, time.gmtime(self.mtime)) if self.mtime is not None else "-"
+        return f"{'d' if self.is_dir else '-'} {self.size} {mtime} {self.name}"
+
+# 'xrdfs ls -l' prints '<flags> [<owner> <group>] <size> <date> <time> <path>' or '<flags> [<owner> <group>] <date> <time>
+# <size> <path>', depending on the version of XRootD, while 'gfal-ls -l' uses the 'ls -l' layout
+# '<mode> <links> <uid> <gid> <size> <month> <day> <hh:mm|year> <name>'
+_xrdfs_listing_regex = re.compile(r"^(?P<flags>[-a-z]{4,10})\s+(?:\S+\s+\S+\s+)?(?:(?P<size>\d+)\s+)?"
+                                  r"(?P<date>\d{4}-\d{2}-\d{2})\s+(?P<time>\d{2}:\d{2}:\d{2})\s+"
+                                  r"(?:(?P<size_after>\d+)\s+)?(?P<path>\S.*?)\s*$")
+_gfal_listing_regex = re.compile(r"^(?P<flags>[-a-z][-rwxsStT]{9}[.+@]?)\s+\d+\s+\S+\s+\S+\s+(?P<size>\d+)\s+"
+                                 r"(?P<month>[A-Z][a-z]{2})\s+(?P<day>\d{1,2})\s+(?:(?P<clock>\d{1,2}:\d{2})|(?P<year>\d{4}))\s+"
+                                 r"(?P<path>\S.*?)\s*$")
+
+_listing_time_format = "%Y-%m-%d %H:%M:%S"
+
+def _xrdfs_mtime(text):
+    """Convert the UTC time printed by 'xrdfs ls -l' and 'xrdfs stat' into seconds since the epoch, or None if it
+    cannot be parsed.
+    """
+    try:
+        return calendar.timegm(time.strptime(text.strip(), _listing_time_format))
+    except ValueError:
+        return None
+
+def _gfal_mtime(match):
+    """Convert the local time of a 'gfal-ls -l' line into seconds since the epoch, or None if it cannot be parsed.
+    When the year is not printed the most recent date which is not in the future is assumed, as for 'ls -l'.
+    """
+    now = time.time()
+    year = int(match.group("year") or time.localtime(now).tm_year)
+    clock = match.group("clock") or "00:00"
+    try:
+        mtime = time.mktime(time.strptime(f"{year} {match.group('month')} {match.group('day')} {clock}", "%Y %b %d %H:%M"))
+        if match.group("year") is None and mtime > now + 86400:
+            mtime = time.mktime(time.strptime(f"{year - 1} {match.group('month')} {match.group('day')} {clock}", "%Y %b %d %H:%M"))
+    except ValueError:
+        return None
+    return mtime
+
+def parse_listing(output):
+    """Parse the output of 'xrdfs ls -l' or 'gfal-ls -l' into a dictionary of ListingEntry objects keyed by the entry name.
+    The output is read in a single pass and every line which is not part of the listing (i.e. an error message) is skipped.
+    """
+    entries = {}
+    for line in output.splitlines():
+        match = _xrdfs_listing_regex.match(line)
+        if match is not None:
+            size = match.group("size") or match.group("size_after") or "0"
+            mtime = _xrdfs_mtime(match.group("date") + " " + match.group("time"))
+        else:
+            match = _gfal_listing_regex.match(line)
+            if match is None:
+                continue
+            size = match.group("size")
+            mtime = _gfal_mtime(match)
+        name = match.group("path").rstrip("/").rsplit("/", 1)[-1]
+        if name not in ("", ".", ".."):
+            entries[name] = ListingEntry(name, match.group("flags").startswith("d"), int(size), mtime)
+    return entries
+
+@functools.lru_cache(maxsize = 64)
+def _compile_samples(samples):
+    """Compile a tuple of unique sample patterns into a single regular expression."""
+    return re.compile("|".join(fnmatch.translate("*" + sample + "*") for sample in samples))
+
+def sample_regex(sample):
+    """Return one compiled regular expression which matches a name containing any of the glob-style 'sample' patterns.
+    Repeated patterns are only used once and an empty list of patterns matches every name.
+    """
+    return _compile_samples(tuple(dict.fromkeys(sample or ["*"])))
+
+def run_shell_command(command):
+    """Run a command in a shell and return its exit code and combined stdout/stderr as a string."""
+    with subprocess.Popen(command,
+                          shell = True,
+                          stdout = subprocess.PIPE,
+                          stderr = subprocess.STDOUT) as process:
+        output = process.communicate()[0]
+    return process.returncode, output.decode('utf-8', errors = 'replace')
+
+class CircuitOpenError(EnvironmentError):
+    """Raised instead of contacting an endpoint whose circuit breaker is open."""
+
+class CircuitBreaker:
+    """Keeps track of the consecutive failures for a single endpoint.
+    After failure_threshold consecutive failures the circuit opens and the endpoint is not contacted for
+    reset_timeout seconds. After that a single trial call is allowed through, which either closes the circuit
+    again or re-opens it for another reset_timeout seconds.
+    """
+    def __init__(self, failure_threshold = 5, reset_timeout = 60.0, clock = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """Return True if the endpoint should not be contacted right now."""
+        with self._lock:
+            return self.opened_at is not None and self.clock() - self.opened_at < self.reset_timeout
+
+    def allow(self):
+        """Return True if a call to the endpoint may proceed. This lets a single trial call through once the
+        reset timeout of an open circuit has expired.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.clock() - self.opened_at >= self.reset_timeout:
+                self.opened_at = self.clock()
+                return True
+            return False
+
+    def record_success(self):
+        """Close the circuit."""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        """Count a failure, opening the circuit once the threshold is reached."""
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+class RetryPolicy:
+    """Retries the remote operations which fail for transient reasons, using a jittered exponential backoff.
+    The errors are classified using the XRootD (kXR) error codes and some well known messages from xrootd and gfal.
+    Errors which cannot succeed on a retry (i.e. a missing file or a permission problem) are returned straight away.
+    A CircuitBreaker is kept for each endpoint so that an endpoint which is down is not contacted over and over.
+    """
+    fatal_codes = {3000, 3001, 3002, 3006, 3009, 3010, 3011, 3013, 3015, 3016, 3018, 3021, 3025, 3030}
+    retryable_codes = {3003, 3005, 3007, 3008, 3012, 3014, 3019, 3020, 3024, 3034}
+    fatal_messages = ("No such file or directory", "Permission denied", "File exists", "Not a directory",
+                      "Is a directory", "command not found", "Invalid argument")
+    retryable_messages = ("Operation expired", "Connection refused", "Connection reset", "Connection timed out",
+                          "Socket timeout", "Socket error", "Stream error", "Broken pipe", "timed out",
+                          "Resource temporarily unavailable", "Communication error", "Overloaded", "ETIMEDOUT",
+                          "ECONNREFUSED", "ECONNRESET", "EAGAIN")
+    _code_regex = re.compile(r"\[(\d{4})\]")
+
+    # pylint: disable-next=too-many-arguments
+    def __init__(self, max_attempts = 3, base_delay = 2.0, max_delay = 60.0, failure_threshold = 5, reset_timeout = 60.0,
+                 sleep = time.sleep):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.sleep = sleep
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint):
+        """Return the CircuitBreaker for an endpoint, creating it the first time the endpoint is used."""
+        with self._lock:
+            if endpoint not in self._breakers:
+                self._breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[endpoint]
+
+    def open_endpoints(self):
+        """Return the set of endpoints whose circuit is currently open."""
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {endpoint for endpoint, breaker in breakers.items() if breaker.is_open()}
+
+    def is_retryable(self, returncode, output):
+        """Return True if a failed operation might succeed when tried again."""
+        if returncode in (126, 127):
+            return False
+        codes = {int(code) for code in self._code_regex.findall(output)}
+        if codes & self.retryable_codes or any(message.lower() in output.lower() for message in self.retryable_messages):
+            return True
+        if codes & self.fatal_codes or any(message.lower() in output.lower() for message in self.fatal_messages):
+            return False
+        return True
+
+    def backoff(self, attempt):
+        """Return the time to wait before the next attempt, which doubles with each attempt up to max_delay.
+        Half of the delay is randomized to avoid many workers retrying at the same moment.
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def call(self, endpoints, operation):
+        """Run 'operation', which returns a tuple starting with (exit code, output), until it succeeds,
+        fails with a non-retryable error, or runs out of attempts. The last result is returned.
+        A CircuitOpenError is raised if any of the endpoints has an open circuit.
+        """
+        breakers = [self.breaker(endpoint) for endpoint in endpoints]
+        result = None
+        for attempt in range(1, self.max_attempts + 1):
+            if not all(breaker.allow() for breaker in breakers):
+                raise CircuitOpenError(f"Not contacting {', '.join(endpoints)} because too many consecutive operations failed")
+            result = operation()
+            if result[0] == 0 or not self.is_retryable(result[0], result[1]):
+                for breaker in breakers:
+                    breaker.record_success()
+                return result
+            for breaker in breakers:
+                breaker.record_failure()
+            if attempt < self.max_attempts:
+                self.sleep(self.backoff(attempt))
+        return result
+
+# The site and endpoint type of each endpoint chosen by best_endpoint, which reroute_task uses to find the next
+# endpoint of the same site when the circuit breaker of an endpoint in an already planned task opens
+ROUTED_ENDPOINTS = {}
+
+def best_endpoint(site, endpoint_type = GetSiteInfo.EndpointType.XROOTD):
+    """Return the fastest endpoint of a given type for a site, skipping the endpoints with an open circuit breaker,
+    so that the transfers fail over to the next endpoint.
+    """
+    endpoint = site.best_endpoint(endpoint_type, exclude = get_backend().retry_policy.open_endpoints())
+    if endpoint is not None:
+        ROUTED_ENDPOINTS[endpoint] = (site, endpoint_type)
+    return endpoint
+
+def reroute_task(task):
+    """Return the task with each endpoint whose circuit breaker is open replaced by the best remaining endpoint
+    of the same site. The commands are built when the transfers are planned, so this lets the tasks planned
+    before a circuit opened fail over to another endpoint. The task is returned unchanged if there is none.
+    """
+    open_endpoints = get_backend().retry_policy.open_endpoints()
+    replacements = {}
+    for endpoint, (site, endpoint_type) in list(ROUTED_ENDPOINTS.items()):
+        if GetSiteInfo.endpoint_host(endpoint) in open_endpoints and endpoint in task.command:
+            replacement = best_endpoint(site, endpoint_type)
+            if GetSiteInfo.endpoint_host(replacement) not in open_endpoints:
+                replacements[endpoint] = replacement
+    if len(replacements) == 0:
+        return task
+
+    regex = re.compile("|".join(re.escape(endpoint) for endpoint in sorted(replacements, key = len, reverse = True)))
+    def replace(value):
+        if isinstance(value, tuple):
+            return tuple(replace(item) for item in value)
+        if isinstance(value, str):
+            return regex.sub(lambda match: replacements[match.group(0)], value)
+        return value
+    return task._replace(**{field : replace(getattr(task, field)) for field in task._fields})
+
+def site_endpoint(site):
+    """Return the name used to identify the endpoint of a site for the retries and circuit breakers.
+    This is the protocol and host of the endpoint, the same name used for the endpoints found in a command.
+    """
+    if GetSiteInfo.EndpointType.XROOTD in site.endpoints:
+        return GetSiteInfo.endpoint_host(best_endpoint(site))
+    return site.alias
+
+_url_host_regex = re.compile(r"\b[a-z]+://[^/\s]+")
+
+def command_endpoints(*locations):
+    """Return the sorted list of the remote endpoints (protocol and host) mentioned in the given locations or commands."""
+    return sorted({match for location in locations for match in _url_host_regex.findall(location)})
+
+def percentile(values, percent):
+    """Return the 'percent' percentile of a list of values using the nearest-rank method, or 0 for an empty list."""
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(1, min(len(ordered), int(-(-percent * len(ordered) // 100)))) - 1]
+
+class TransferStats:
+    """Collects the time spent in each phase of a run and in each remote operation (listing, stat, mkdir, checksum,
+    copy), along with the number of bytes copied, and summarizes them in a report. The operations may be recorded
+    from several threads at the same time.
+    """
+
+    def __init__(self, clock = time.monotonic):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far and restart the clock for the run."""
+        with self._lock:
+            self.start = self.clock()
+            self.phases = {}
+            self.operations = defaultdict(list)
+            self.endpoints = defaultdict(lambda: {"transfers": 0, "failed": 0, "bytes": 0, "seconds": 0.0})
+            self.failures = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """A context manager adding the time spent inside of it to the phase 'name'."""
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add_phase(name, self.clock() - start)
+
+    def add_phase(self, name, seconds):
+        """Add a number of seconds to the phase 'name'."""
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def record(self, operation, seconds, endpoints = (), nbytes = 0, ok = True, files = 1, failures = ()): # pylint: disable=too-many-arguments
+        """Record one operation, which took 'seconds' and moved 'nbytes' bytes, for each of the 'endpoints' involved.
+        For copies 'files' is the number of files in the task and 'failures' the list of (source, destination, reason)
+        tuples for the files which could not be copied.
+        """
+        with self._lock:
+            self.operations[operation].append((seconds, nbytes, ok, files))
+            self.failures.extend(failures)
+            if operation == "copy":
+                for endpoint in endpoints:
+                    totals = self.endpoints[endpoint]
+                    totals["transfers"] += files
+                    totals["failed"] += len(failures)
+                    totals["bytes"] += nbytes
+                    totals["seconds"] += seconds
+
+    def report(self):
+        """Return a dictionary, which can be serialized to JSON, summarizing the run."""
+        with self._lock:
+            wall = self.clock() - self.start
+            operations = {}
+            for operation, records in sorted(self.operations.items()):
+                durations = [record[0] for record in records]
+                operations[operation] = {
+                    "count": len(records),
+                    "failed": sum(1 for record in records if not record[2]),
+                    "files": sum(record[3] for record in records),
+                    "bytes": sum(record[1] for record in records),
+                    "total_seconds": sum(durations),
+                    "mean_seconds": sum(durations) / len(durations),
+                    "p50_seconds": percentile(durations, 50),
+                    "p90_seconds": percentile(durations, 90),
+                    "p99_seconds": percentile(durations, 99),
+                    "max_seconds": max(durations),
+                }
+            endpoints = {endpoint: dict(totals, mb_per_s = totals["bytes"] / 1e6 / totals["seconds"] if totals["seconds"] else 0.0)
+                         for endpoint, totals in sorted(self.endpoints.items())}
+            copies = operations.get("copy", {})
+            copy_seconds = self.phases.get("transfers", wall)
+            return {
+                "wall_seconds": wall,
+                "phases": dict(self.phases),
+                "operations": operations,
+                "endpoints": endpoints,
+                "totals": {
+                    "files": copies.get("files", 0),
+                    "failed": len(self.failures),
+                    "bytes": copies.get("bytes", 0),
+                    "mb_per_s": copies.get("bytes", 0) / 1e6 / copy_seconds if copy_seconds else 0.0,
+                },
+                "failures": [{"source": source, "destination": destination, "reason": reason}
+                             for source, destination, reason in sorted(self.failures)],
+            }
+
+    def write_report(self, path):
+        """Write the report to a JSON file."""
+        with open(path, "w", encoding = "utf-8") as report_file:
+            json.dump(self.report(), report_file, indent = 2, sort_keys = True)
+            report_file.write("\n")
+
+STATS = TransferStats()
+
+def format_duration(seconds):
+    """Format a number of seconds as H:MM:SS."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+def format_progress(done, total, done_bytes, total_bytes, elapsed):
+    """Return a short description of the progress of the transfers, including the rate and the estimated time left.
+    The estimate is based on the number of bytes when the file sizes are known and on the number of tasks otherwise.
+    """
+    rate = done_bytes / 1e6 / elapsed if elapsed > 0 else 0.0
+    if total_bytes > 0 and done_bytes > 0:
+        remaining = elapsed * (total_bytes - done_bytes) / done_bytes
+    elif done > 0:
+        remaining = elapsed * (total - done) / done
+    else:
+        remaining = 0.0
+    return (f"{done_bytes / 1e6:.1f}/{total_bytes / 1e6:.1f} MB, {rate:.1f} MB/s, "
+            f"elapsed {format_duration(elapsed)}, ETA {format_duration(remaining)}")
+
+class Backend:
+    """Base class for the objects which carry out the remote operations (ls/stat/mkdir/copy) used by copyfiles.
+    The remote paths are given relative to the user area of the site (/store/user/<username>/), just like the
+    override_path of a Command. The derived classes implement a single attempt of each operation, while this
+    class runs every operation through the RetryPolicy.
+    """
+    name = "base"
+
+    def __init__(self, retry_policy = None):
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+
+    def timed_call(self, operation, endpoints, function):
+        """Run 'function' through the RetryPolicy and record how long it took, including the retries, in STATS."""
+        start = STATS.clock()
+        result = None
+        try:
+            result = self.retry_policy.call(endpoints, function)
+        finally:
+            STATS.record(operation, STATS.clock() - start, endpoints, ok = result is not None and result[0] == 0)
+        return result
+
+    def listdir(self, site, path):
+        """Return a dictionary of ListingEntry objects keyed by name or None if the path cannot be listed."""
+        returncode, _, entries = self.timed_call("listing", [site_endpoint(site)], lambda: self._listdir(site, path))
+        return entries if returncode == 0 else None
+
+    def stat(self, site, path):
+        """Return a ListingEntry for the path or None if the path does not exist."""
+        returncode, _, entry = self.timed_call("stat", [site_endpoint(site)], lambda: self._stat(site, path))
+        return entry if returncode == 0 else None
+
+    def mkdir(self, site, path):
+        """Create the remote directory, including any missing parents, and return (exit code, output)."""
+        return self.timed_call("mkdir", [site_endpoint(site)], lambda: self._mkdir(site, path))
+
+    def checksum(self, site, path):
+        """Return the adler32 checksum of a remote file as a hex string or None if it cannot be retrieved."""
+        returncode, _, value = self.timed_call("checksum", [site_endpoint(site)], lambda: self._checksum(site, path))
+        return value if returncode == 0 else None
+
+    def copy(self, task):
+        """Run a single CopyTask and return (exit code, output)."""
+        return self.retry_policy.call(command_endpoints(task.source, task.destination), lambda: self._copy(task))
+
+    def copy_batch(self, task):
+        """Run a BatchCopyTask and return (exit code, output). The output contains an '[ERROR]' line, which
+        includes the source, for each of the files which could not be copied. When only some of the files fail,
+        only those files are retried.
+        """
+        policy = self.retry_policy
+        breakers = [policy.breaker(endpoint) for endpoint in command_endpoints(task.source, task.destination)]
+        remaining = task
+        returncode, output, failures = 0, "", []
+        # the files which failed for good in an earlier attempt are not part of the later attempts, but still failed
+        fatal_failures, failed_returncode = [], 0
+        for attempt in range(1, policy.max_attempts + 1):
+            if not all(breaker.allow() for breaker in breakers):
+                raise CircuitOpenError(f"Not contacting the endpoints for {task.destination} because too many consecutive "
+                                       f"operations failed")
+            returncode, output = self._copy_batch(remaining)
+            failures = parse_batch_failures(remaining, returncode, output)
+            failed_returncode = returncode or failed_returncode
+            retry_sources = {failure[0] for failure in failures if policy.is_retryable(returncode, failure[2])}
+            for breaker in breakers:
+                if len(retry_sources) == 0:
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+            if len(retry_sources) == 0 or attempt == policy.max_attempts:
+                break
+            fatal_failures += [failure for failure in failures if failure[0] not in retry_sources]
+            keep = [i for i, source in enumerate(remaining.sources) if source in retry_sources]
+            remaining = BatchCopyTask(tuple(remaining.sources[i] for i in keep),
+                                      tuple(remaining.destinations[i] for i in keep),
+                                      remaining.command,
+                                      tuple(remaining.sizes[i] for i in keep))
+            policy.sleep(policy.backoff(attempt))
+        # report every file which finally failed on its own line, so the failures can be matched to the whole batch
+        failures = fatal_failures + failures
+        if len(failures) > 0:
+            output = "\n".join(f"[ERROR] {source}: {reason}" for source, _, reason in failures)
+            returncode = returncode or failed_returncode or 1
+        return returncode, output
+
+    def _listdir(self, site, path):
+        """Make a single attempt at listing a directory and return (exit code, output, entries)."""
+        raise NotImplementedError
+
+    def _stat(self, site, path):
+        """Make a single attempt at a stat and return (exit code, output, entry)."""
+        raise NotImplementedError
+
+    def _mkdir(self, site, path):
+        """Make a single attempt at making a directory and return (exit code, output)."""
+        raise NotImplementedError
+
+    def _checksum(self, site, path):
+        """Make a single attempt at retrieving a checksum and return (exit code, output, checksum)."""
+        raise NotImplementedError
+
+    def _copy(self, task):
+        """Make a single attempt at a CopyTask and return (exit code, output)."""
+        raise NotImplementedError
+
+    def _copy_batch(self, task):
+        """Make a single attempt at a BatchCopyTask and return (exit code, output)."""
+        raise NotImplementedError
+
+class ShellBackend(Backend):
+    """Backend which runs every operation as an xrdfs/xrdcp/gfal command in a subshell."""
+    name = "shell"
+
+    def _listdir(self, site, path):
+        ls_command = XRootDCommand(action = "fs",
+                                   subaction = "ls -l",
+                                   start_site = site,
+                                   override_path = path)
+        returncode, output = run_shell_command(ls_command.get_full_command())
+        return returncode, output, (parse_listing(output) if returncode == 0 else None)
+
+    def _stat(self, site, path):
+        stat_command = XRootDCommand(action = "fs",
+                                     subaction = "stat",
+                                     start_site = site,
+                                     override_path = path)
+        returncode, output = run_shell_command(stat_command.get_full_command())
+        if returncode != 0:
+            return returncode, output, None
+        info = dict(line.split(":", 1) for line in output.splitlines() if ":" in line)
+        size = info.get("Size", "0").strip()
+        return returncode, output, ListingEntry(os.path.basename(os.path.normpath("/" + path)),
+                                                "IsDir" in info.get("Flags", ""),
+                                                int(size) if size.isdigit() else 0,
+                                                _xrdfs_mtime(info.get("MTime", "")))
+
+    def _checksum(self, site, path):
+        checksum_command = XRootDCommand(action = "fs",
+                                         subaction = "query checksum",
+                                         start_site = site,
+                                         override_path = path)
+        returncode, output = run_shell_command(checksum_command.get_full_command())
+        pieces = output.split()
+        return returncode, output, (pieces[-1].lower() if returncode == 0 and len(pieces) > 0 else None)
+
+    def _mkdir(self, site, path):
+        mkdir_command = XRootDCommand(action = "fs",
+                                      subaction = "mkdir -p",
+                                      end_site = site,
+                                      override_path = path)
+        return run_shell_command(mkdir_command.get_full_command())
+
+    def _copy(self, task):
+        return run_shell_command(task.command)
+
+    def _copy_batch(self, task):
+        with tempfile.NamedTemporaryFile("w", prefix = "copyfiles_", suffix = ".txt") as infiles:
+            infiles.write("\n".join(task.sources) + "\n")
+            infiles.flush()
+            return run_shell_command(f"{task.command} --infiles {infiles.name} {task.destination}")
+
+class XRootDBackend(Backend):
+    """Backend which uses the XRootD python bindings rather than forking a shell for every operation.
+    One XRootD.client.FileSystem object is kept per endpoint, so the authenticated connection is reused
+    for all of the ls/stat/mkdir calls. The copies are done with XRootD.client.CopyProcess, which shares
+    the same connections within the process. The factories can be replaced in order to use a stand-in
+    for the XRootD client.
+    """
+    name = "xrootd"
+
+    # the XrdCl flags, with their values as fallbacks for when the bindings cannot be imported
+    stat_is_dir = xrootd_flags.StatInfoFlags.IS_DIR if xrootd_flags is not None else 2
+    dirlist_stat = xrootd_flags.DirListFlags.STAT if xrootd_flags is not None else 1
+    mkdir_makepath = xrootd_flags.MkDirFlags.MAKEPATH if xrootd_flags is not None else 1
+    query_checksum = xrootd_flags.QueryCode.CHECKSUM if xrootd_flags is not None else 3
+
+    def __init__(self, filesystem_factory = None, copy_process_factory = None, retry_policy = None):
+        super().__init__(retry_policy)
+        if (filesystem_factory is None or copy_process_factory is None) and xrootd_client is None:
+            raise RuntimeError("The XRootD python bindings are not available.")
+        self.filesystem_factory = filesystem_factory if filesystem_factory is not None else xrootd_client.FileSystem
+        self.copy_process_factory = copy_process_factory if copy_process_factory is not None else xrootd_client.CopyProcess
+        self._filesystems = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def locate(site, path):
+        """Split the location of a remote path into the endpoint URL and the absolute path on that endpoint."""
+        endpoint = best_endpoint(site)
+        split = endpoint.find("/", len("root://")) + 1
+        return endpoint[:split], os.path.normpath("/" + endpoint[split:] + "/store/user/" + site.username + "/" + path)
+
+    def filesystem(self, endpoint):
+        """Return the FileSystem object for an endpoint, creating it the first time the endpoint is used."""
+        with self._lock:
+            if endpoint not in self._filesystems:
+                self._filesystems[endpoint] = self.filesystem_factory(endpoint)
+            return self._filesystems[endpoint]
+
+    def _entry(self, name, statinfo):
+        """Convert an XRootD StatInfo object into a ListingEntry."""
+        return ListingEntry(name, bool(statinfo.flags & self.stat_is_dir), statinfo.size, statinfo.modtime)
+
+    def _listdir(self, site, path):
+        endpoint, remote_path = self.locate(site, path)
+        status, listing = self.filesystem(endpoint).dirlist(remote_path, self.dirlist_stat)
+        if not status.ok:
+            return 1, status.message, None
+        return 0, "", {item.name : self._entry(item.name, item.statinfo) for item in listing}
+
+    def _stat(self, site, path):
+        endpoint, remote_path = self.locate(site, path)
+        status, statinfo = self.filesystem(endpoint).stat(remote_path)
+        if not status.ok:
+            return 1, status.message, None
+        return 0, "", self._entry(os.path.basename(remote_path), statinfo)
+
+    def _checksum(self, site, path):
+        endpoint, remote_path = self.locate(site, path)
+        status, response = self.filesystem(endpoint).query(self.query_checksum, remote_path)
+        if not status.ok:
+            return 1, status.message, None
+        pieces = response.decode('utf-8').strip('\x00 \n').split()
+        return 0, "", (pieces[-1].lower() if len(pieces) > 0 else None)
+
+    def _mkdir(self, site, path):
+        endpoint, remote_path = self.locate(site, path)
+        status, _ = self.filesystem(endpoint).mkdir(remote_path, self.mkdir_makepath)
+        return (0 if status.ok else 1), status.message
+
+    def _copy(self, task):
+        process = self.copy_process_factory()
+        process.add_job(task.source, task.destination, force = task.force)
+        status = process.prepare()
+        if status.ok:
+            status, results = process.run()
+            status = next((result["status"] for result in results if not result["status"].ok), status)
+        return (0 if status.ok else 1), status.message
+
+    def _copy_batch(self, task):
+        process = self.copy_process_factory()
+        for source, destination in zip(task.sources, task.destinations):
+            process.add_job(source, destination, force = task.force)
+        status = process.prepare()
+        if not status.ok:
+            return 1, f"[ERROR] {status.message}"
+        status, results = process.run()
+        failed = [f"[ERROR] {source}: {result['status'].message}" \
+                  for source, result in zip(task.sources, results) if not result["status"].ok]
+        return (0 if status.ok and len(failed) == 0 else 1), "\n".join(failed)
+
+BACKENDS = {ShellBackend.name : ShellBackend, XRootDBackend.name : XRootDBackend}
+_backend = ShellBackend()
+
+def get_backend():
+    """Return the backend currently used for the remote operations."""
+    return _backend
+
+def set_backend(name = "auto", protocol = "xrootd", additional_arguments = "", retry_policy = None, xrdcp_options = False):
+    """Choose the backend used for the remote operations.
+    The 'auto' option selects the XRootD python bindings when they can be imported, the xrootd protocol is
+    being used, and no additional command line arguments need to be passed to xrdcp. Otherwise the shell backend
+    is used. 'xrdcp_options' is True when one of the xrdcp options the bindings do not support (i.e. --streams,
+    -v, or -s) was requested, which also selects the shell backend.
+    """
+    global _backend # pylint: disable=global-statement
+    if name == "auto":
+        name = XRootDBackend.name if xrootd_client is not None and protocol == "xrootd" and additional_arguments == "" \
+               and not xrdcp_options else ShellBackend.name
+    elif name == XRootDBackend.name and xrdcp_options:
+        raise RuntimeError("ERROR::set_backend() The xrootd backend does not support the --streams, --verbose, or --quiet options.")
+    _backend = BACKENDS[name](retry_policy = retry_policy)
+    return _backend
+
+class ListingCache:
+    """Per-run cache of remote directory listings, keyed by (site, path).
+    Each remote directory is listed at most once (i.e. using 'xrdfs ls -l'), which returns the type and size of
+    every entry. The is-dir and exists queries are then answered from the listing of the parent directory,
+    so that the number of remote calls scales with the number of directories rather than the number of files.
+    """
+    def __init__(self):
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(site, path):
+        """Return the key used to store the listing for a path at a given site."""
+        return (site.alias, getattr(site, "username", ""), os.path.normpath("/" + path))
+
+    def clear(self):
+        """Forget all of the stored listings."""
+        with self._lock:
+            self._listings.clear()
+
+    def invalidate(self, site, path):
+        """Forget the stored listings for a path and for its parent directory."""
+        key = self._key(site, path)
+        with self._lock:
+            self._listings.pop(key, None)
+            self._listings.pop(key[:2] + (os.path.dirname(key[2]),), None)
+
+    def store(self, site, path, entries):
+        """Keep a listing of the remote directory 'path' which was obtained by other means (i.e. 'gfal-ls -l')."""
+        with self._lock:
+            self._listings[self._key(site, path)] = entries
+
+    def listdir(self, site, path):
+        """Return a dictionary of ListingEntry objects for the remote directory 'path', keyed by name.
+        None is returned if the path could not be listed (i.e. it does not exist or is not a directory).
+        """
+        key = self._key(site, path)
+        with self._lock:
+            if key in self._listings:
+                return self._listings[key]
+
+        entries = get_backend().listdir(site, path)
+
+        with self._lock:
+            self._listings[key] = entries
+        return entries
+
+    def get_entry(self, site, path):
+        """Return the ListingEntry for 'path' using the listing of its parent directory.
+        None is returned if the entry does not exist. If the parent directory cannot be listed (i.e. it is
+        the top of the user area or the user lacks the permissions) the path is listed directly instead.
+        """
+        key = self._key(site, path)
+        with self._lock:
+            if self._listings.get(key) is not None:
+                return ListingEntry(os.path.basename(key[2]), True, 0, None)
+        parent, name = os.path.split(key[2])
+        entries = self.listdir(site, parent) if name != "" else None
+        if entries is not None:
+            return entries.get(name)
+        if self.listdir(site, path) is not None:
+            return ListingEntry(name, True, 0, None)
+        return get_backend().stat(site, path)
+
+    def is_dir(self, site, path):
+        """Return True if the remote path is a directory and False otherwise."""
+        entry = self.get_entry(site, path)
+        return entry is not None and entry.is_dir
+
+    def exists(self, site, path):
+        """Return True if the remote path exists and False otherwise."""
+        return self.get_entry(site, path) is not None
+
+LISTING_CACHE = ListingCache()
+
+class TransferJournal:
+    """Append-only record, in JSON lines format, of the transfers made by copyfiles.
+    Every file passes through the states 'planned', 'in-flight', and then either 'done' or 'failed'. Each line
+    is flushed to disk as soon as it is written, so that an interrupted run can be resumed by retrying only the
+    files which were not finished. The file also serves as an audit log of the transfers.
+    """
+    states = ("planned", "in-flight", "done", "failed")
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # make sure that new records do not get appended to a partially written line
+        self._needs_newline = False
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as journal:
+                journal.seek(-1, os.SEEK_END)
+                self._needs_newline = journal.read(1) != b"\n"
+
+    def record(self, state, task, reason = ""):
+        """Append one line for each of the files in a CopyTask or BatchCopyTask."""
+        if state not in self.states:
+            raise ValueError(f"Unknown transfer state {state}")
+        lines = "".join(json.dumps({"time" : time.strftime("%Y-%m-%d %H:%M:%S"),
+                                    "state" : state,
+                                    "source" : file_task.source,
+                                    "destination" : file_task.destination,
+                                    "path" : file_task.path,
+                                    "command" : file_task.command,
+                                    "size" : file_task.size,
+                                    "force" : file_task.force,
+                                    "reason" : reason}) + "\n" for file_task in task.split())
+        with self._lock:
+            with open(self.path, "a", encoding = "utf-8") as journal:
+                if self._needs_newline:
+                    journal.write("\n")
+                    self._needs_newline = False
+                journal.write(lines)
+                journal.flush()
+                os.fsync(journal.fileno())
+
+    def load(self):
+        """Return a dictionary, keyed by destination, containing the latest record for each file.
+        A partially written final line, which is what remains if the program is killed, is ignored.
+        """
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, encoding = "utf-8") as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record["destination"]] = record
+        return records
+
+    def unfinished_tasks(self, verify = None):
+        """Return the CopyTasks for the files which were not successfully copied according to the journal.
+        The files which were in flight when the journal stopped are passed to the 'verify' function, which
+        should return True if the destination file is complete. Those files are marked done rather than copied again.
+        The other in-flight files may have been partially written, so they are copied again with the overwrite forced.
+        """
+        tasks = []
+        for record in self.load().values():
+            task = CopyTask(record["source"], record["destination"], record["command"], record.get("size"),
+                            record.get("force", False), record.get("path"))
+            if record["state"] == "done":
+                continue
+            if record["state"] == "in-flight":
+                if verify is not None and verify(task):
+                    self.record("done", task, "verified on resume")
+                    continue
+                task = force_task(task)
+            tasks.append(task)
+        return tasks
+
 def run_checks(recursive, depth, start_path, end_path, both_local):
     """Does some basic sanity checks before proceeding with the rest of the module.
     This tries to head off problems that might occur later on.
@@ -186,25 +1068,13 @@ def run_checks(recursive, depth, start_path, end_path, both_local):
 
     # Check for a voms-proxy if a remote protocol will be involved
     if not both_local:
-        with open(os.devnull, 'wb') as devnull:
-            returncode = 0
-            with subprocess.Popen(shlex.split('voms-proxy-info -exists -valid 0:10'),
-                                  stdout=devnull,
-                                  stderr=subprocess.STDOUT) as process:
-                returncode = process.wait()
-            if returncode != 0:
-                print("\tWARNING::You must have a valid proxy for this script to work.\n"
-                      "Running \"voms-proxy-init -voms cms\"...\n")
-                subprocess.call("voms-proxy-init -voms cms -valid 192:00", shell=True)
-                with subprocess.Popen(shlex.split('voms-proxy-info -exists -valid 0:10'),
-                                      stdout=devnull,
-                                      stderr=subprocess.STDOUT) as process:
-                    returncode = process.wait()
-                if returncode != 0 :
-                    print("\tERROR::Sorry, but I still could not find your proxy.\n"
-                          "Without a valid proxy, this program will fail spectacularly.\n"
-                          "The program will now exit.")
-                    sys.exit(1)
+        try:
+            GetSiteInfo.check_proxy()
+        except RuntimeError:
+            print("\tERROR::Sorry, but I still could not find your proxy.\n"
+                  "Without a valid proxy, this program will fail spectacularly.\n"
+                  "The program will now exit.")
+            sys.exit(1)
 
     if start_path=="./":
         print("\trun_checks::start_path chosen as the current working directory ("+str(os.environ['PWD'])+")")
@@ -230,14 +1100,17 @@ def init_commands(start_site, end_site, arguments = argparse.Namespace()):
                               start_site = start_site,
                               end_site = end_site,
                               verbose = arguments.verbose,
-                              additional_arguments = arguments.additional_arguments)
+                              additional_arguments = arguments.additional_arguments,
+                              force = arguments.sync)
     elif arguments.protocol == "xrootd":
         command = XRootDCommand(action = "cp",
                                 quiet = arguments.quiet,
+                                streams = arguments.streams,
                                 start_site = start_site,
                                 end_site = end_site,
                                 verbose = arguments.verbose,
-                                additional_arguments = arguments.additional_arguments)
+                                additional_arguments = arguments.additional_arguments,
+                                force = arguments.sync)
     else:
         raise RuntimeError("copyfiles::init_commands() could not figure out how to format the copy command.")
 
@@ -252,15 +1125,24 @@ def init_commands(start_site, end_site, arguments = argparse.Namespace()):
 
     return (copy_command, start_location, end_location)
 
-def make_directory(end_site, path, protocol, debug = False):
+def make_directory(end_site, path, protocol, debug = False): # pylint: disable=too-many-branches
     """This function will create a directory on a remote file system (the endpoint) assuming it is missing."""
     if end_site.alias == 'local' :
         if not os.path.exists(path):
             os.makedirs(path)
         return os.path.exists(path)
+    elif end_site.path in (path, path[1:]):
+        if debug:
+            print("make_directory:")
+            print("\tstatus: bypass")
+            print("\tend_site.path:", end_site.path)
+            print("\tdirectory:", path)
+            print("\tprotocol:", protocol)
+        return True
     else:
-        ls_command = None
         mkdir_command = None
+        returncode = 0
+        output = ""
         if protocol == "gfal":
             ls_command = GfalCommand(action = "ls",
                                      verbose = True,
@@ -269,46 +1151,32 @@ def make_directory(end_site, path, protocol, debug = False):
             mkdir_command = GfalCommand(action = "mkdir",
                                         end_site = end_site,
                                         override_path = path)
+            with subprocess.Popen(ls_command.get_full_command(),
+                                  shell = True,
+                                  stdout = subprocess.PIPE,
+                                  stderr = subprocess.STDOUT) as process:
+                output = process.communicate()[0]
+                returncode = process.returncode
         elif protocol == "xrootd":
-            ls_command = XRootDCommand(action = "fs",
-                                       subaction = "ls",
-                                       end_site = end_site,
-                                       override_path = path)
-            mkdir_command = XRootDCommand(action = "fs",
-                                          subaction = "mkdir",
-                                          end_site = end_site,
-                                          override_path = path)
+            # the existence check is answered by the listing of the parent directory
+            entry = LISTING_CACHE.get_entry(end_site, path)
+            returncode = 1 if entry is None else 0
+            output = str(entry)
         else:
             raise ValueError(f"Unknown protocol {protocol}")
-        returncode = 0
-        output = ""
-        with subprocess.Popen(ls_command.get_full_command(),
-                              shell = True,
-                              stdout = subprocess.PIPE,
-                              stderr = subprocess.STDOUT) as process:
-            output = process.communicate()[0]
-            returncode = process.returncode
-
-        if end_site.path in (path, path[1:]):
+
+        if returncode != 0:
+            if mkdir_command is not None:
+                run_shell_command(mkdir_command.get_full_command())
+            else:
+                get_backend().mkdir(end_site, path)
+            LISTING_CACHE.invalidate(end_site, path)
             if debug:
                 print("make_directory:")
-                print("\tstatus: bypass")
-                print("\tend_site.path:", end_site.path)
+                print("\tstatus: success")
                 print("\tdirectory:", path)
                 print("\tprotocol:", protocol)
             return True
-        elif returncode != 0:
-            with subprocess.Popen(mkdir_command.get_full_command(),
-                                  shell = True,
-                                  stdout = subprocess.PIPE,
-                                  stderr = subprocess.STDOUT) as process:
-                output = process.communicate()[0]
-                if debug:
-                    print("make_directory:")
-                    print("\tstatus: success")
-                    print("\tdirectory:", path)
-                    print("\tprotocol:", protocol)
-                return True
         else:
             print("make_directory:")
             print("\tThere was a problem making the directory", path)
@@ -316,67 +1184,60 @@ def make_directory(end_site, path, protocol, debug = False):
             print(output)
             return False
 
-def get_list_of_files(protocol, start_site, sample, path, debug = False):
-    """This function will return a list of file from the start site."""
-    files_unfiltered = []
-
+def list_entries(protocol, start_site, path, debug = False):
+    """Return the contents of a local or remote directory as a dictionary of ListingEntry objects keyed by name.
+    If the path is a single file, the dictionary only contains the entry for that file.
+    """
     # Handle the local case
     if start_site.alias == 'local':
         # Handle the local single file case
         if os.path.isfile(path):
-            return [os.path.basename(path)]
-        # Handle the local mmulti-file case
-        else:
-            files_unfiltered = os.listdir(path)
-        if debug:
-            print("get_list_of_files:")
-            print("\tList of files (unfiltered):", files_unfiltered)
-    elif not remote_is_dir(start_site, path):
-        files_unfiltered = [path]
-    else:
-        ls_command = None
-        if protocol == "gfal":
-            ls_command = GfalCommand(action = "ls",
-                                     start_site = start_site,
-                                     override_path = path)
-        elif protocol == "xrootd":
-            ls_command = XRootDCommand(action = "fs",
-                                       subaction = "ls",
-                                       start_site = start_site,
-                                       override_path = path)
-        else:
-            raise ValueError(f"Unknown protocol {protocol}")
-        cmd = ls_command.get_full_command()
-        if debug:
-            print("get_list_of_files:")
-            print("\tCommand: ", cmd)
-
-        # pylint: disable=consider-using-with
-        output, _ = subprocess.Popen(cmd, shell = True, stdout = subprocess.PIPE).communicate()
-        files_unfiltered = output.decode('utf-8').splitlines()
-        files_unfiltered = [x.strip(' ') for x in files_unfiltered]
-        files_unfiltered = [x.strip('\n') for x in files_unfiltered]
-    files_unfiltered = [x.replace("//", "/") for x in files_unfiltered]
-    files_unfiltered = [x.split(' ', 1)[0] if x.split(' ', 1)[0].isdigit() else x for x in files_unfiltered]
-    if protocol == 'xrootd':
-        files_unfiltered = [x.replace(x[:x.rfind("/") + 1], "") for x in files_unfiltered]
-    files_unfiltered = [x for x in files_unfiltered if x != '']
-    files_unfiltered = [x for x in files_unfiltered if x != path.replace("//", "/")]
-    files_unfiltered = [x for x in files_unfiltered if x != path[path.find(start_site.path) + len(start_site.path):]]
-    files_unfiltered = [x.split("/")[-1] if x[-1] != "/" else x.split("/")[-2] + "/" for x in files_unfiltered]
-    files = []
-    for thesample in sample:
-        files += fnmatch.filter(files_unfiltered, '*' + thesample + '*')
-    return files
+            info = os.stat(path)
+            name = os.path.basename(path)
+            return {name : ListingEntry(name, False, info.st_size, info.st_mtime)}
+        # Handle the local multi-file case
+        entries = local_listing(path)
+        if entries is None:
+            raise Error(f"Unable to list the local directory {path}")
+        return entries
+    if not remote_is_dir(start_site, path):
+        name = os.path.basename(os.path.normpath("/" + path))
+        return {name : LISTING_CACHE.get_entry(start_site, path) or ListingEntry(name, False, 0, None)}
+    if protocol == "xrootd":
+        return LISTING_CACHE.listdir(start_site, path) or {}
+    if protocol != "gfal":
+        raise ValueError(f"Unknown protocol {protocol}")
+
+    ls_command = GfalCommand(action = "ls",
+                             additional_arguments = "-l",
+                             start_site = start_site,
+                             override_path = path)
+    cmd = ls_command.get_full_command()
+    if debug:
+        print("list_entries:")
+        print("\tCommand: ", cmd)
+    returncode, output = run_shell_command(cmd)
+    entries = parse_listing(output)
+    if returncode == 0:
+        # the listing also answers the later is-dir and exists queries for this directory
+        LISTING_CACHE.store(start_site, path, entries)
+    return entries
+
+def get_list_of_files(protocol, start_site, sample, path, debug = False):
+    """This function will return a list of file from the start site."""
+    entries = list_entries(protocol, start_site, path, debug)
+    if debug:
+        print("get_list_of_files:")
+        print("\tList of files (unfiltered):", list(entries))
+    return filter_list_of_files(sample, entries)
 
 def filter_list_of_files(sample, files_unfiltered):
-    """This function filters the list of files based on a patter, which allows for wildcards."""
-    files = []
-    if len(sample) == 0:
-        sample = ["*"]
-    for thesample in sample:
-        files += fnmatch.filter(files_unfiltered, '*' + thesample + '*')
-    return files
+    """This function filters the list of files based on a patter, which allows for wildcards.
+    Every name is checked once against a single regular expression built from all of the patterns, so a name
+    matching several patterns is only returned once.
+    """
+    matches = sample_regex(sample).match
+    return [file for file in dict.fromkeys(files_unfiltered) if matches(file)]
 
 def ignore_patterns(patterns):
     """Function that can be used as copytree() ignore parameter.
@@ -397,7 +1258,10 @@ def ignore_patterns(patterns):
 
 def do_diff(files, protocol, end_site, sample, dst, debug):
     """Return a list of files which are located at the start site, but not the end site."""
-    if end_site.alias == 'local' and os.environ.get('HOSTNAME',"not found").find("fnal.gov") > 0 :
+    if not (os.path.isdir(dst) if end_site.alias == 'local' else remote_is_dir(end_site, dst)):
+        # the destination directory has not been made yet, so every file is missing
+        files1 = []
+    elif end_site.alias == 'local' and os.environ.get('HOSTNAME',"not found").find("fnal.gov") > 0 :
         files1 = os.listdir(dst)
     else:
         files1 = get_list_of_files(protocol, end_site, sample, dst, debug)
@@ -406,29 +1270,297 @@ def do_diff(files, protocol, end_site, sample, dst, debug):
     print("Adding an additional " + str(len(files_diff)) + " files/folders")
     return files_diff
 
+def local_listing(path):
+    """Return a dictionary of ListingEntry objects for a local directory, keyed by name, or None if the path
+    cannot be listed. The modification times use the same UTC format as the XRootD listings.
+    """
+    try:
+        with os.scandir(path) as iterator:
+            entries = {}
+            for entry in iterator:
+                try:
+                    info = entry.stat()
+                except OSError:
+                    # a dangling symbolic link is still listed, as it would be by os.listdir
+                    info = entry.stat(follow_symlinks = False)
+                entries[entry.name] = ListingEntry(entry.name, entry.is_dir(), info.st_size, info.st_mtime)
+            return entries
+    except OSError:
+        return None
+
+def list_directory(site, path):
+    """Return the listing of a local or remote directory as a dictionary of ListingEntry objects keyed by name."""
+    return local_listing(path) if site.alias == 'local' else LISTING_CACHE.listdir(site, path)
+
+def file_checksum(site, path):
+    """Return the adler32 checksum of a local or remote file as an eight character hex string.
+    The local checksum is computed in the same way as 'xrdadler32', but without starting a new process.
+    """
+    if site.alias != 'local':
+        return get_backend().checksum(site, path)
+    value = 1
+    try:
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                value = zlib.adler32(chunk, value)
+    except OSError:
+        return None
+    return f"{value & 0xffffffff:08x}"
+
+def do_sync(files, start_site, src, end_site, dst, checksum = False, debug = False):
+    """Return the files and folders from 'files' which need to be copied in order to bring dst up to date with src.
+    Both directories are listed once. A file is copied if it is missing at the destination, if the sizes differ,
+    if the source is newer than the destination, or, optionally, if the adler32 checksums differ. The modification
+    times are compared as seconds since the epoch, since the listings of xrdfs, gfal, and the local filesystem print
+    them differently, and are ignored when either one is not known. Folders are always returned so that their
+    contents can be compared.
+    """
+    src_entries = list_directory(start_site, src) or {}
+    dst_entries = list_directory(end_site, dst) or {}
+    files_sync = []
+    for file in files:
+        src_entry = src_entries.get(file)
+        dst_entry = dst_entries.get(file)
+        if src_entry is None or dst_entry is None or src_entry.is_dir or dst_entry.is_dir:
+            files_sync.append(file)
+        elif src_entry.size != dst_entry.size or (None not in (src_entry.mtime, dst_entry.mtime) and src_entry.mtime > dst_entry.mtime):
+            files_sync.append(file)
+        elif checksum and file_checksum(start_site, os.path.join(src, file)) != file_checksum(end_site, os.path.join(dst, file)):
+            files_sync.append(file)
+        elif debug:
+            print(f"do_sync: skipping the unchanged file {os.path.join(src, file)}")
+    print(f"Synchronizing {len([f for f in files_sync if f not in src_entries or not src_entries[f].is_dir])} "
+          f"of {len(files)} files/folders")
+    return files_sync
+
 def remote_is_dir(site, srcname):
-    """Return True if the remote path is a directory and False otherwise."""
-    returncode = 0
-    #cmd = "xrdfs root://" + site.xrootd_endpoint + "/ stat -q IsDir " + srcname
-    isdir_command = XRootDCommand(action = "fs",
-                                  subaction = "stat -q IsDir",
-                                  start_site = site,
-                                  override_path = srcname)
-
-    with subprocess.Popen(isdir_command.get_full_command(),
-                          shell = True,
-                          stdout = subprocess.PIPE,
-                          stderr = subprocess.STDOUT) as process:
-        _ = process.communicate()[0]
-        returncode = process.returncode
+    """Return True if the remote path is a directory and False otherwise.
+    The answer comes from the per-run listing cache, so the remote directory is only contacted once.
+    """
+    return LISTING_CACHE.is_dir(site, srcname)
+
+def warn_if_proxy_expires(tasks, rate):
+    """Warn if the grid proxy is likely to expire before the planned transfers finish.
+    The time needed is estimated from the number of bytes to copy and the expected transfer 'rate' in MB/s.
+    Returns True if a warning was printed.
+    """
+    planned_bytes = sum(single.size or 0 for task in tasks for single in task.split())
+    if rate <= 0 or planned_bytes == 0:
+        return False
+    return GetSiteInfo.warn_if_proxy_expires(planned_bytes / (rate * 1e6))
+
+def make_directories(end_site, directories, jobs = 1, dry_run = False, debug = False):
+    """Create all of the planned destination directories in a single pass, before any of the files are copied.
+    Only the deepest directories need to be created, as the missing parents are created along the way ('mkdir -p').
+    The remote directories are created by a pool of at most 'jobs' workers and without checking whether they already
+    exist. Returns a list of (directory, directory, reason) tuples for the directories which could not be created.
+    """
+    normalized = sorted({os.path.normpath(directory) for directory in directories})
+    parents = {os.path.dirname(directory) for directory in normalized}
+    leaves = [directory for directory in normalized if directory not in parents]
+
+    if debug or dry_run:
+        print("make_directories:")
+        print("\tnumber of planned directories:", len(normalized))
+        print("\tdirectories to create:", leaves)
+    if dry_run:
+        return []
+
+    def make_one(directory):
+        if end_site.alias == 'local':
+            try:
+                os.makedirs(directory, exist_ok = True)
+                return 0, ""
+            except OSError as why:
+                return 1, str(why)
+        return get_backend().mkdir(end_site, directory)
+
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, jobs)) as executor:
+        for directory, (returncode, output) in zip(leaves, executor.map(make_one, leaves)):
+            if end_site.alias != 'local':
+                LISTING_CACHE.invalidate(end_site, directory)
+            if returncode != 0:
+                errors.append((directory, directory, f"unable to make the directory: {output.strip()}"))
+    return errors
+
+def batch_tasks(tasks, copy_command, batch_size):
+    """Group the CopyTasks for the files of a single directory into BatchCopyTasks of at most batch_size files,
+    so that each group is transferred by a single xrdcp invocation. The tasks are returned unchanged when
+    batching is disabled (batch_size <= 1) or when there is only a single file to copy.
+    """
+    if batch_size <= 1 or len(tasks) <= 1:
+        return tasks
+    return [BatchCopyTask(tuple(task.source for task in tasks[i:i + batch_size]),
+                          tuple(task.destination for task in tasks[i:i + batch_size]),
+                          copy_command,
+                          tuple(task.size for task in tasks[i:i + batch_size]),
+                          any(task.force for task in tasks[i:i + batch_size]),
+                          tuple(task.path for task in tasks[i:i + batch_size])) for i in range(0, len(tasks), batch_size)]
+
+def parse_batch_failures(task, returncode, output):
+    """Return the (source, destination, reason) tuples for the files of a BatchCopyTask which were not copied.
+    The '[ERROR]' and '[FATAL]' lines of the output are matched to the sources they mention. If the batch failed
+    but none of the sources were mentioned, all of the files in the batch are considered to have failed.
+    """
+    if returncode == 0:
+        return []
+    error_lines = [line.strip() for line in output.splitlines() if "[ERROR]" in line or "[FATAL]" in line]
+    failures = []
+    for source, destination in zip(task.sources, task.destinations):
+        # the path must end at a word boundary, so that the errors for /src/file10 are not charged to /src/file1
+        source_regex = re.compile(re.escape(source) + r"(?=[\s:),]|$)")
+        reason = next((line for line in error_lines if source_regex.search(line)), None)
+        if reason is not None:
+            failures.append((source, destination, reason))
+    if len(failures) == 0:
+        failures = [(source, destination, f"exit code {returncode}: {output.strip()}") \
+                    for source, destination in zip(task.sources, task.destinations)]
+    return failures
+
+def force_task(task):
+    """Return a CopyTask which overwrites its destination, adding '-f' to the xrdcp or gfal-copy command."""
+    if "-f" in task.command.split():
+        return task._replace(force = True)
+    pieces = task.command.split(" ", 1)
+    return task._replace(command = " ".join([pieces[0], "-f"] + pieces[1:]), force = True)
+
+def failover_copy(task):
+    """Copy a CopyTask or BatchCopyTask with the current backend and return (rerouted task, exit code, output).
+    The task is rerouted before each attempt, so when the circuit breaker of one of its endpoints opens the copy
+    continues through the next endpoint of the same site. The CircuitOpenError is raised if there is none left.
+    """
+    while True:
+        routed = reroute_task(task)
+        try:
+            if isinstance(routed, BatchCopyTask):
+                return (routed,) + tuple(get_backend().copy_batch(routed))
+            return (routed,) + tuple(get_backend().copy(routed))
+        except CircuitOpenError:
+            if reroute_task(routed) == routed:
+                raise
+
+def run_task(task):
+    """Run a CopyTask or BatchCopyTask with the current backend and record the time taken and bytes copied in STATS.
+    Returns the list of (source, destination, reason) tuples for the failed files along with the command output.
+    """
+    start = STATS.clock()
+    failures, output, routed = [], "", task
+    try:
+        routed, returncode, output = failover_copy(task)
+        if isinstance(task, BatchCopyTask):
+            original = dict(zip(routed.sources, zip(task.sources, task.destinations)))
+            failures = [original[failure[0]] + failure[2:] for failure in parse_batch_failures(routed, returncode, output)]
+        elif returncode != 0:
+            failures = [(task.source, task.destination, f"exit code {returncode}: {output.strip()}")]
+    except EnvironmentError as why:
+        failures = [(task.source, task.destination, str(why))]
+        raise
+    finally:
+        files = task.split()
+        failed = {failure[1] for failure in failures}
+        STATS.record("copy", STATS.clock() - start, command_endpoints(routed.source, routed.destination),
+                     nbytes = sum(single.size or 0 for single in files if single.destination not in failed),
+                     ok = len(failures) == 0, files = len(files), failures = failures)
+    return failures, output
+
+def run_transfers(tasks, jobs = 1, dry_run = False, debug = False, journal = None, progress = False): # pylint: disable=too-many-arguments,too-many-locals
+    """Execute the planned transfer tasks using a bounded pool of at most 'jobs' concurrent copy processes.
+    Returns a list of (source, destination, reason) tuples, one for each failed file, which is the same
+    format aggregated by the Error exception. The state of each file is recorded in the journal, if one is given.
+    If 'progress' is True the number of bytes copied, the rate, and the estimated time left are printed for each task.
+    """
+    if dry_run or len(tasks) == 0:
+        return []
 
-    return returncode == 0
+    if debug:
+        print("run_transfers:")
+        print("\tnumber of tasks:", len(tasks))
+        print("\tjobs:", jobs)
+
+    def run_journaled_task(task):
+        if journal is not None:
+            journal.record("in-flight", task)
+        try:
+            failures, output = run_task(task)
+        except EnvironmentError as why:
+            if journal is not None:
+                for file_task in task.split():
+                    journal.record("failed", file_task, str(why))
+            raise
+        if journal is not None:
+            failed = {failure[1] : failure[2] for failure in failures}
+            for file_task in task.split():
+                if file_task.destination in failed:
+                    journal.record("failed", file_task, failed[file_task.destination])
+                else:
+                    journal.record("done", file_task)
+        return failures, output
+
+    errors = []
+    total_bytes = sum(single.size or 0 for task in tasks for single in task.split())
+    done_bytes = 0
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, jobs)) as executor:
+        futures = {executor.submit(run_journaled_task, task) : task for task in tasks}
+        for ifuture, future in enumerate(concurrent.futures.as_completed(futures)):
+            task = futures[future]
+            done_bytes += sum(single.size or 0 for single in task.split())
+            try:
+                failures, output = future.result()
+            except EnvironmentError as why:
+                errors.extend((file_task.source, file_task.destination, str(why)) for file_task in task.split())
+                continue
+            status = f"[{ifuture + 1}/{len(tasks)}] {'Finished' if len(failures) == 0 else 'FAILED'} {task.destination}"
+            if progress:
+                status += " (" + format_progress(ifuture + 1, len(tasks), done_bytes, total_bytes, time.monotonic() - start) + ")"
+            print(status)
+            if output.strip() != "" and (debug or len(failures) > 0):
+                print(output)
+            errors.extend(failures)
+    return sorted(errors)
+
+def destination_entry(end_site, task):
+    """Return the ListingEntry for the destination of a CopyTask or None if the destination does not exist.
+    The journaled relative path is used when there is one, since the endpoint in the destination URL may not be
+    the one which would be chosen now.
+    """
+    if task.path is not None:
+        path = task.path
+    elif end_site.alias == 'local':
+        path = task.destination
+    else:
+        prefix = XRootDCommand(action = "cp", end_site = end_site).end_site_prefix
+        path = task.destination[len(prefix):] if task.destination.startswith(prefix) else task.destination
+    if end_site.alias == 'local':
+        return (local_listing(os.path.dirname(path)) or {}).get(os.path.basename(path))
+    return LISTING_CACHE.get_entry(end_site, path)
+
+def resume_transfers(end_site, journal, arguments = argparse.Namespace()):
+    """Retry the transfers which were not finished according to the journal, without walking the source tree again.
+    The files which were in flight are considered done if the destination file has the expected size.
+    """
+    def verify(task):
+        entry = destination_entry(end_site, task)
+        return entry is not None and task.size is not None and entry.size == task.size
+
+    tasks = journal.unfinished_tasks(verify)
+    print(f"Resuming {len(tasks)} unfinished transfers from the journal {journal.path}")
+    with STATS.phase("transfers"):
+        errors = run_transfers(tasks, arguments.jobs, arguments.dry_run, arguments.debug, journal, arguments.progress)
+    if errors:
+        raise Error(errors)
 
 # pylint: disable=too-many-locals
 # pylint: disable=too-many-branches
 # pylint: disable=too-many-statements
-def copytree(start_site, src, end_site, dst, current_depth, symlinks = False, ignore = None, arguments = argparse.Namespace()):
-    """Recursively copy a directory (src) to another location (dst)"""
+def copytree(start_site, src, end_site, dst, current_depth, symlinks = False, ignore = None, arguments = argparse.Namespace(),
+             plan = None, journal = None):
+    """Recursively copy a directory (src) to another location (dst).
+    The tree is walked once to plan all of the destination directories and transfers, which are collected in 'plan'.
+    When called at the top level (plan is None) the destination directories are then created in a single pass, the
+    planned transfers are recorded in the journal, if one is given, and are run by a pool of arguments.jobs workers.
+    """
     if arguments.debug:
         print("copytree:")
         print("\tsrc:", src)
@@ -440,18 +1572,26 @@ def copytree(start_site, src, end_site, dst, current_depth, symlinks = False, ig
     if current_depth >= arguments.depth:
         return
 
-    if not arguments.dry_run:
-        made_dir = make_directory(end_site, dst, arguments.protocol, arguments.debug)
-        if not made_dir:
-            raise RuntimeError("ERROR::copytree::Unable to make the destination directory.")
+    top_level = plan is None
+    if top_level:
+        plan = TransferPlan()
+        planning_start = STATS.clock()
 
-    files = get_list_of_files(arguments.protocol, start_site, arguments.sample, src, arguments.debug)
+    # the destination directories are created after the walk, but when synchronizing an existing one is simply reused
+    if not (arguments.sync and end_site.alias != 'local' and remote_is_dir(end_site, dst)):
+        plan.directories.append(dst)
+
+    # the sizes are journaled so that a resumed transfer can check whether a destination file is complete
+    src_entries = list_entries(arguments.protocol, start_site, src, arguments.debug)
+    files = filter_list_of_files(arguments.sample, src_entries)
 
     if arguments.debug:
         print("copytree:")
         print("\tList of files:", files)
 
-    if arguments.diff:
+    if arguments.sync:
+        files = do_sync(files, start_site, src, end_site, dst, arguments.checksum, arguments.debug)
+    elif arguments.diff:
         files = do_diff(files, arguments.protocol, end_site, arguments.sample, dst, arguments.debug)
 
     if ignore is not None:
@@ -459,7 +1599,14 @@ def copytree(start_site, src, end_site, dst, current_depth, symlinks = False, ig
     else:
         ignored_names = set()
 
+    # the copy command and locations are the same for every file in this directory
+    copy_command, start_location, end_location = init_commands(start_site, end_site, arguments)
+    srel = os.path.relpath(src, src[:src.find(start_site.path) + len(start_site.path)]) + "/"
+    if srel == "./":
+        srel = ""
+
     errors = []
+    file_tasks = []
     for file in files:
         if file in ignored_names:
             continue
@@ -486,24 +1633,23 @@ def copytree(start_site, src, end_site, dst, current_depth, symlinks = False, ig
                          current_depth + 1,
                          symlinks,
                          ignore,
-                         arguments)
+                         arguments,
+                         plan)
             else:
-                srel = os.path.relpath(src, src[:src.find(start_site.path) + len(start_site.path)]) + "/"
-                if srel == "./":
-                    srel = ""
-                copy_command, start_location, end_location = init_commands(start_site, end_site, arguments)
                 print("Copying file " + file + " from " + srel)
+                path = dstname
                 if start_site.alias != 'local' and start_site.alias != 'local' and not remote_is_dir(start_site, src):
-                    command = copy_command + " " + start_location + " " + end_location
+                    source, destination, path = start_location, end_location, dst
                 elif start_site.alias != 'local':
-                    command = copy_command + " " + start_location + srel + file + " " + end_location + srel + file
+                    source, destination = start_location + srel + file, end_location + srel + file
                 elif os.path.isfile(start_location):
-                    command = copy_command + " " + start_location + " " + end_location + srel + file
+                    source, destination = start_location, end_location + srel + file
                 else:
-                    command = copy_command + " " + start_location + srel + file + " " + end_location + srel + file
+                    source, destination = start_location + srel + file, end_location + srel + file
+                command = copy_command + " " + source + " " + destination
                 print("\tcopy command:", command)
-                if not arguments.dry_run:
-                    os.system(command)
+                file_tasks.append(CopyTask(source, destination, command, src_entries[file].size if file in src_entries else None,
+                                           arguments.sync, path))
                 print("")
 
         # catch the Error from the recursive copytree so that we can
@@ -512,6 +1658,20 @@ def copytree(start_site, src, end_site, dst, current_depth, symlinks = False, ig
             errors.extend(err.args[0])
         except EnvironmentError as why:
             errors.append((srcname, dstname, str(why)))
+
+    plan.tasks.extend(batch_tasks(file_tasks, copy_command, arguments.batch_size))
+
+    if top_level:
+        STATS.add_phase("planning", STATS.clock() - planning_start)
+        warn_if_proxy_expires(plan.tasks, arguments.expected_rate)
+        with STATS.phase("mkdir"):
+            errors.extend(make_directories(end_site, plan.directories, arguments.jobs, arguments.dry_run, arguments.debug))
+        if journal is not None and not arguments.dry_run:
+            for task in plan.tasks:
+                journal.record("planned", task)
+        with STATS.phase("transfers"):
+            errors.extend(run_transfers(plan.tasks, arguments.jobs, arguments.dry_run, arguments.debug, journal,
+                                        arguments.progress))
     if errors:
         raise Error(errors)
 
@@ -542,20 +1702,35 @@ def built_in_recursion(start_site, end_site, arguments):
         if not made_dir:
             raise RuntimeError("ERROR::built_in_recursion::Unable to make the destination directory.")
 
-    # Run the command and check the output codes
-    with subprocess.Popen(command, shell = True, stdout = subprocess.PIPE, stderr = subprocess.STDOUT) as process:
-        output = process.communicate()[0]
-        print(command)
-        print(output)
-        if process.returncode == 0:
-            return True
-        else:
-            raise RuntimeError("ERROR::built_in_recursion() Something went wrong with the copy command.")
+    # Run the command, retrying transient failures, and check the output codes
+    returncode, output = get_backend().retry_policy.call(command_endpoints(command), lambda: run_shell_command(command))
+    print(command)
+    print(output)
+    if returncode == 0:
+        return True
+    else:
+        raise RuntimeError("ERROR::built_in_recursion() Something went wrong with the copy command.")
 
 def main(arguments = argparse.Namespace()):
-    """The main function coordinating the overal logic of which protocols to use, how to get the site/server
+    """The main function, which runs the copy and then writes the --report, if one was requested.
+    The report is also written when the copy fails, so that the failures can be inspected.
+    """
+    STATS.reset()
+    try:
+        run_copy(arguments)
+    finally:
+        if arguments.report:
+            STATS.write_report(arguments.report)
+
+def run_copy(arguments = argparse.Namespace()):
+    """The function coordinating the overal logic of which protocols to use, how to get the site/server
     information, and which copy command to use.
     """
+    LISTING_CACHE.clear()
+    GetSiteInfo.ENDPOINT_RANKING.enabled = not arguments.no_probe
+    set_backend(arguments.backend, arguments.protocol, arguments.additional_arguments,
+                RetryPolicy(max_attempts = arguments.retries, base_delay = arguments.retry_delay),
+                xrdcp_options = arguments.streams is not None or arguments.verbose or arguments.quiet)
     arguments.both_local = bool(arguments.start_server=='local' and arguments.end_server=='local')
     arguments.recursive, arguments.depth, arguments.start_path, arguments.end_path = run_checks(arguments.recursive,
                                                                                                 arguments.depth,
@@ -564,12 +1739,15 @@ def main(arguments = argparse.Namespace()):
                                                                                                 arguments.both_local)
 
     #get the site information
-    start_site = Location(arguments.start_server, arguments.start_user, arguments.start_path)
-    if start_site.alias != 'local':
-        GetSiteInfo.get_site_info(site = start_site, debug = arguments.debug, quiet = True, print_json = False)
-    end_site = Location(arguments.end_server, arguments.end_user, arguments.end_path)
-    if end_site.alias != 'local':
-        GetSiteInfo.get_site_info(site = end_site, debug = arguments.debug, quiet = True)
+    with STATS.phase("site_info"):
+        start_site = Location(arguments.start_server, arguments.start_user, arguments.start_path)
+        if start_site.alias != 'local':
+            GetSiteInfo.get_site_info(site = start_site, debug = arguments.debug, quiet = True, print_json = False,
+                                      refresh = arguments.refresh, snapshot = arguments.snapshot)
+        end_site = Location(arguments.end_server, arguments.end_user, arguments.end_path)
+        if end_site.alias != 'local':
+            GetSiteInfo.get_site_info(site = end_site, debug = arguments.debug, quiet = True, refresh = arguments.refresh,
+                                      snapshot = arguments.snapshot)
 
     #local to local copies can use POSIX commands
     if start_site.alias == 'local' and end_site.alias == 'local':
@@ -584,7 +1762,11 @@ def main(arguments = argparse.Namespace()):
         else:
             command = copy_command + " " + start_location + " " + end_location
         print(command)
-        os.system(command)
+        with STATS.phase("transfers"):
+            returncode, output = get_backend().timed_call("copy", command_endpoints(command), lambda: run_shell_command(command))
+        print(output)
+        if returncode != 0:
+            raise RuntimeError(f"ERROR::main() The gfal copy command failed with exit code {returncode}.")
         return
 
     #Needed for the xrootd protocol because of the lack of a recursive functionality
@@ -607,6 +1789,10 @@ def main(arguments = argparse.Namespace()):
             print("\ttop_dst:", top_dst)
             print("\tdepth:", str(arguments.depth))
             print("\tdry_run:", arguments.dry_run)
+        journal = TransferJournal(arguments.journal) if arguments.journal != "" else None
+        if arguments.resume and journal is not None and os.path.exists(journal.path):
+            resume_transfers(end_site, journal, arguments)
+            return
         copytree(start_site = start_site,
                  src = top_src,
                  end_site = end_site,
@@ -614,7 +1800,8 @@ def main(arguments = argparse.Namespace()):
                  current_depth = 0,
                  symlinks = False,
                  ignore = ignore_patterns(arguments.ignore),
-                 arguments = arguments)
+                 arguments = arguments,
+                 journal = journal)
 
 if __name__ == '__main__':
     #program name available through the %(prog)s command
@@ -686,6 +1873,11 @@ And those are the options available. Deal with it.""")
     parser.add_argument("-a","--additional_arguments", type = str, default = "",
                         help = "Any additional arguments for the protocol that are not implemented " \
                                "here (default = %(default)s).")
+    parser.add_argument("-b","--backend", choices = ["auto"] + list(BACKENDS), default = "auto",
+                        help = "How to run the xrootd ls/stat/mkdir/copy operations. The 'xrootd' backend uses the XRootD " \
+                               "python bindings and reuses one connection per endpoint, while the 'shell' backend runs the " \
+                               "xrdfs/xrdcp commands. The 'auto' option picks the bindings when they are importable and no " \
+                               "additional arguments, --streams, --verbose, or --quiet are given (default = %(default)s).")
     parser.add_argument("-d","--debug", action = "store_true",
                         help = "Shows some extra information in order to debug this program (default = %(default)s).")
     parser.add_argument("--depth", type = int, default = 1,
@@ -699,23 +1891,68 @@ And those are the options available. Deal with it.""")
                                 copy the missing files (default = %(default)s).
                                 Only works for two local directories. 
                                 This is not implemented for the local to local or gfal transfers.""")
+    parser.add_argument("--sync", action = "store_true",
+                        help = "Only copy the files which are missing from the destination, have a different size, or are " \
+                               "newer at the source, reusing the existing destination folders. Takes precedence over " \
+                               "--diff and is only implemented for the xrootd protocol (default = %(default)s).")
+    parser.add_argument("--checksum", action = "store_true",
+                        help = "When used with --sync, also compare the adler32 checksums of files which have the same " \
+                               "size and modification time (default = %(default)s).")
     parser.add_argument("--dry_run", action = "store_true",
                         help = "Do not perform any action, just print what would be done (default = %(default)s).")
+    parser.add_argument("--expected_rate", type = float, default = 50.0,
+                        help = "The expected aggregate transfer rate in MB/s. It is used to warn if the grid proxy will expire " \
+                               "before the planned transfers are finished. Use 0 to disable the warning (default = %(default)s).")
     parser.add_argument("--from_file", type = str, default = "",
                         help = "Specify the files to copy. Only implemented for gfal (default = %(default)s).")
+    parser.add_argument("-j","--jobs", type = int, default = 1,
+                        help = "The maximum number of xrdcp processes to run concurrently when copying a " \
+                               "directory tree with the xrootd protocol (default = %(default)s).")
+    parser.add_argument("--batch_size", type = int, default = 0,
+                        help = "Copy the files of each directory in groups of this many files, using a single xrdcp " \
+                               "invocation per group. A value of 0 or 1 copies one file per command (default = %(default)s).")
     parser.add_argument("-i","--ignore", nargs = '+', type = str, default = (),
                         help = "Patterns of files/folders to ignore (default = %(default)s).")
+    parser.add_argument("--journal", type = str, default = "",
+                        help = "Record the planned, in-flight, done, and failed transfers in this JSON lines file. Only " \
+                               "implemented for the xrootd protocol (default = %(default)s).")
+    parser.add_argument("--no_probe", action = "store_true",
+                        help = "Do not measure the latency of the endpoints of a site to choose the fastest one. The longest " \
+                               "endpoint is used instead (default = %(default)s).")
     parser.add_argument("-p", "--protocol", choices = ["gfal","xrootd"], default = "xrootd",
                         help = "Gives the user the option on what protocol to use to transfer the " \
                                "files (default = %(default)s).")
     group.add_argument("-q", "--quiet", default = False, action = "store_true",
                        help = "Decrease output verbosity to minimal amount (default = %(default)s).")
+    parser.add_argument("--progress", action = "store_true",
+                        help = "Print the amount of data copied, the transfer rate, and the estimated time left after " \
+                               "each transfer (default = %(default)s).")
     parser.add_argument("-r", "--recursive", default = False, action = "store_true",
                         help = "Recursively copies directories and files (default = %(default)s).")
+    parser.add_argument("--refresh", action = "store_true",
+                        help = "Retrieve the site information from CRIC, CMSSST, and SITECONF instead of using the cached " \
+                               "values (default = %(default)s).")
+    parser.add_argument("--report", type = str, default = "",
+                        help = "Write a JSON report with the time spent in each phase and operation, the percentiles of " \
+                               "the operation times, the MB/s per endpoint, and the failed files to this file " \
+                               "(default = %(default)s).")
+    parser.add_argument("--resume", action = "store_true",
+                        help = "Retry only the unfinished transfers recorded in the --journal file instead of walking the " \
+                               "source tree again. Files which were in flight are verified by size (default = %(default)s).")
+    parser.add_argument("--retries", type = int, default = 3,
+                        help = "The maximum number of attempts for each remote operation which fails with a transient " \
+                               "error (default = %(default)s).")
+    parser.add_argument("--retry_delay", type = float, default = 2.0,
+                        help = "The initial delay, in seconds, before retrying a failed remote operation. The delay doubles " \
+                               "with each attempt (default = %(default)s).")
     parser.add_argument("-s", "--sample", nargs = '+', default = ["*"],
                         help = "Shared portion of the name of the files to be copied (default = %(default)s).")
-    parser.add_argument("-str","--streams", default = "15",
-                        help = "The number of transfer streams (default = %(default)s).")
+    parser.add_argument("--snapshot", default = None,
+                        help = "Read the site information from this JSON snapshot file, created using " \
+                               "'GetSiteInfo.py --export_snapshot', instead of the online sources (default = %(default)s).")
+    parser.add_argument("-str","--streams", type = int, default = None,
+                        help = "The number of parallel streams used by xrdcp for each transfer. When not given, no --streams " \
+                               "option is passed and xrdcp uses its own default (default = %(default)s).")
     parser.add_argument("-su", "--start_user", default = os.environ['USER'],
                         help = "The username of the person transfering the files (default = %(default)s).")
     parser.add_argument("-eu", "--end_user", default = os.environ['USER'],
@@ -726,6 +1963,8 @@ And those are the options available. Deal with it.""")
                        help = "Increase output verbosity of gfal-copy or xrdcp commands (default = %(default)s).")
     parser.add_argument('--version', action = 'version', version = '%(prog)s 2.0b')
     args = parser.parse_args()
+    if args.resume and args.journal == "":
+        parser.error("--resume needs the --journal file to resume from")
 
     if args.debug:
         print('Number of arguments:', len(sys.argv), 'arguments.')
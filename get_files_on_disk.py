@@ -2,8 +2,11 @@
 
 """Returns a list of files from a dataset including only files that are hosted on disk."""
 
-import os,sys,getpass,warnings,glob,shlex,subprocess,argparse # pylint: disable=multiple-imports
-from collections import defaultdict
+import os,sys,getpass,warnings,glob,re,argparse,threading,time,json,tempfile,functools,fnmatch # pylint: disable=multiple-imports
+from urllib.parse import quote
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # prevent this script from ever being used in a batch job
 # to avoid DDOS of Rucio
@@ -11,120 +14,539 @@ if "_CONDOR_SCRATCH_DIR" in os.environ:
     print("Error: this script cannot be used in batch jobs")
     sys.exit(1)
 
+@functools.lru_cache(maxsize=None)
 def getOS():
-    """Gets OS version from shell (other methods return host OS when in container)"""
-    cmd = r"sed -nr 's/[^0-9]*([0-9]+).*/\1/p' /etc/redhat-release"
-    osv = subprocess.check_output(shlex.split(cmd), encoding="utf-8").rstrip()
-    return osv
+    """Gets OS version from /etc/redhat-release (other methods return host OS when in container)"""
+    with open("/etc/redhat-release", 'r') as release: # pylint: disable=unspecified-encoding
+        return re.search(r"[0-9]+", release.read()).group(0)
+
+@functools.lru_cache(maxsize=None)
+def getRucioPath():
+    """Finds the Rucio installation on cvmfs for this OS version"""
+    rucio_path = f'/cvmfs/cms.cern.ch/rucio/x86_64/rhel{getOS()}/py3/current'
+    full_rucio_path = glob.glob(rucio_path+'/lib/python*.*')[0]
+    return rucio_path, full_rucio_path+'/site-packages/'
 
 def getRucio(user):
-    """Adds Rucio libraries to python path with requisite environment variables"""
-    osv = getOS()
-    rucio_path = f'/cvmfs/cms.cern.ch/rucio/x86_64/rhel{osv}/py3/current'
+    """Adds Rucio libraries to python path with requisite environment variables, returning the added path"""
+    rucio_path, site_packages = getRucioPath()
     os.environ['RUCIO_HOME'] = rucio_path
     os.environ['RUCIO_ACCOUNT'] = user
-    full_rucio_path = glob.glob(rucio_path+'/lib/python*.*')[0]
-    sys.path.insert(0,full_rucio_path+'/site-packages/')
+    sys.path.insert(0,site_packages)
+    return site_packages
 
-def getHosted(dataset, user, allow=None, block=None):
-    """Gets list of files on disk for a dataset, and list of sites along with how many files each site has"""
-    if allow is not None and block is not None:
-        raise RuntimeError("Cannot specify both allow list and block list, pick one")
+# upper limit on concurrent requests, to avoid overloading Rucio
+max_workers = 8
 
-    getRucio(user)
+# local cache location, shared with the other lpc-scripts
+local_cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "lpc-scripts")
 
-    warnings.filterwarnings("ignore", message=".*cryptography.*")
-    from rucio.client.client import Client # pylint: disable=import-error,import-outside-toplevel
-    client = Client()
+# cached file lists for premixed pileup samples, synced to cvmfs
+pileup_dir = "/cvmfs/cms.cern.ch/offcomp-prod/premixPUlist/"
+pileup_map = os.path.join(pileup_dir, "pileup_mapping.txt")
+pileup_index = os.path.join(local_cache_dir, "pileup_mapping.json")
+_pileup_maps = {}
 
-    # loop over blocks to avoid timeout error from too-large response
-    all_blocks = list(client.list_content(scope='cms',name=dataset))
-    # batch some blocks together for fewer requests
-    # not fully optimized, but n=10 tested to be ~15% faster than n=1
-    nblocks = 10
-    block_groups = [all_blocks[i:i+nblocks] for i in range(0, len(all_blocks), nblocks)]
+def writeJson(path, data):
+    """Writes data to a JSON file via a temporary file, so readers never see a partial file; errors are ignored"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), delete=False, encoding="utf-8") as tmp:
+            json.dump(data, tmp)
+        os.replace(tmp.name, path)
+    except OSError:
+        pass
+
+class GroupSize:
+    """Number of blocks to request at once, adapted from the observed response times:
+    grows additively while requests finish within the target time, halves when a request is slow or fails"""
+    def __init__(self, size=10, minimum=1, maximum=100, step=5, target=20.0):
+        self.size = size
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.target = target
+        self.lock = threading.Lock()
+
+    def update(self, elapsed):
+        """Adjusts the size after a request (elapsed=None for a failed request) and returns the new size"""
+        with self.lock:
+            if elapsed is not None and elapsed <= self.target:
+                self.size = min(self.maximum, self.size + self.step)
+            else:
+                self.size = max(self.minimum, self.size // 2)
+            return self.size
+
+def fetchReplicas(rep_client, blocks):
+    """Streams the replicas of a group of blocks, returning the state of each file at each site and the elapsed time"""
+    start = time.monotonic()
+    files = {}
+    for rep in rep_client.list_replicas([{'scope': 'cms', 'name': name} for name in blocks]):
+        files[rep['name']] = dict(rep['states'])
+    return files, time.monotonic()-start
+
+class RucioSession:
+    """Rucio setup shared by all of the queries in a run.
+    The environment is set up and the client classes are imported the first time a client is needed.
+    The number of requests in flight at once, across all threads, is limited to the number of workers;
+    each request borrows a client (they are not thread-safe) from a pool holding at most one per worker,
+    so the clients are created once and reused for all of the requests of all datasets."""
+    def __init__(self, user, workers=4):
+        self.user = user
+        self.workers = max(1, min(workers, max_workers))
+        self.slots = threading.BoundedSemaphore(self.workers)
+        self.path = None
+        self.classes = None
+        self.lock = threading.Lock()
+        self.idle = defaultdict(list)
+
+    def setup(self):
+        """Sets up the Rucio environment and imports the client classes, once"""
+        with self.lock:
+            if self.classes is None:
+                self.path = getRucio(self.user)
+                warnings.filterwarnings("ignore", message=".*cryptography.*")
+                from rucio.client.client import Client # pylint: disable=import-error,import-outside-toplevel
+                from rucio.client.replicaclient import ReplicaClient # pylint: disable=import-error,import-outside-toplevel
+                self.classes = {'client': Client, 'rep_client': ReplicaClient}
+            return self.classes
+
+    @contextmanager
+    def get(self, kind):
+        """Borrows a client of the given kind ('client' or 'rep_client') for one request, waiting for a free worker slot"""
+        with self.slots:
+            with self.lock:
+                client = self.idle[kind].pop() if self.idle[kind] else None
+            if client is None:
+                client = self.setup()[kind]()
+            try:
+                yield client
+            finally:
+                with self.lock:
+                    self.idle[kind].append(client)
 
-    from rucio.client.replicaclient import ReplicaClient # pylint: disable=import-error,import-outside-toplevel
-    rep_client = ReplicaClient()
+    def close(self):
+        """Removes the Rucio libraries from the python path"""
+        with self.lock:
+            if self.path in sys.path:
+                sys.path.remove(self.path)
+            self.path = None
 
-    filelist = set()
+def fetchGroups(blocks, session, retries=3, verbose=False):
+    """Gets the replica states for a list of blocks from Rucio, with several requests in flight at once.
+    Returns a list of groups, one per successful request, each a dict with the requested blocks, the time, and the file states"""
+    def getReplicas(block_group):
+        with session.get('rep_client') as rep_client:
+            return fetchReplicas(rep_client, block_group)
+
+    # batch some blocks together for fewer requests, with the batch size adapted to the response time
+    # (n=10 tested to be ~15% faster than n=1, so start from there)
+    group_size = GroupSize(size=10)
+    all_blocks = deque(blocks)
+    workers = session.workers
+    groups = []
+    failures = defaultdict(int)
+    retry_groups = deque()
+    nrequests = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while all_blocks or retry_groups or running:
+            # keep at most one request per worker in flight
+            while (all_blocks or retry_groups) and len(running) < workers:
+                if retry_groups:
+                    block_group = retry_groups.popleft()
+                else:
+                    block_group = [all_blocks.popleft() for _ in range(min(group_size.size, len(all_blocks)))]
+                running[executor.submit(getReplicas, block_group)] = block_group
+                nrequests += 1
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                block_group = running.pop(future)
+                try:
+                    files, elapsed = future.result()
+                except Exception as err:
+                    # retry the blocks in two halves, so a block which keeps failing is eventually requested alone
+                    group_size.update(None)
+                    for name in block_group:
+                        failures[name] += 1
+                        if failures[name] > retries:
+                            raise RuntimeError(f"Could not get replicas for block {name}") from err
+                    if verbose:
+                        print(f"Replica request for {len(block_group)} blocks failed ({err}), retrying")
+                    half = (len(block_group)+1)//2
+                    retry_groups.extend(group for group in (block_group[:half], block_group[half:]) if group)
+                    continue
+                group_size.update(elapsed)
+                groups.append({'blocks': block_group, 'time': time.time(), 'files': files})
+
+    if verbose:
+        print(f"Queried {len(blocks)} blocks with {nrequests} requests ({workers} concurrent, final group size {group_size.size})")
+    return groups
+
+def filterReplicas(groups, allow=None, block=None, mapping=False):
+    """Gets the files on disk, and the number of files on disk at each site, from the replica states
+    (skipping tape sites and applying the allow or block list).
+    If mapping is True, the files are returned as a dict of file: list of sites hosting it on disk"""
+    filemap = defaultdict(list)
     sitelist = defaultdict(int)
     def sitecond(site):
         return ("_Tape" not in site) and (allow is None or site in allow) and (block is None or site not in block)
-    for block_group in block_groups:
-        reps = list(rep_client.list_replicas([{'scope': 'cms', 'name': block['name']} for block in block_group]))
-        for rep in reps:
-            for site,state in rep['states'].items():
+    for group in groups:
+        for name,states in group['files'].items():
+            for site,state in states.items():
                 if state=='AVAILABLE' and sitecond(site):
-                    filelist.add(rep['name'])
+                    filemap[name].append(site)
                     sitelist[site] += 1
+    return (dict(filemap) if mapping else set(filemap)), sitelist
+
+class ReplicaCache:
+    """Local cache of the replica states for each dataset, stored as one JSON file per dataset.
+    The replica states are stored in groups of blocks, as they were requested from Rucio, each with the time of the request.
+    Groups older than ttl seconds, and groups containing blocks which are no longer in the dataset, are requested again;
+    blocks which were added to the dataset are requested for the first time. If the list of blocks and all of the groups
+    are younger than ttl seconds, Rucio is not contacted at all."""
+    default_directory = os.path.join(local_cache_dir, "replicas")
+
+    def __init__(self, directory=default_directory, ttl=86400):
+        self.directory = directory
+        self.ttl = ttl
+
+    def path(self, dataset):
+        """Gets the path of the file storing the replica states for a dataset"""
+        return os.path.join(self.directory, quote(dataset.strip('/'), safe='')+'.json')
+
+    def read(self, dataset):
+        """Gets the cached entry for a dataset (a dict with the time the blocks were listed and the groups), or None"""
+        try:
+            with open(self.path(dataset), encoding="utf-8") as cfile:
+                entry = json.load(cfile)
+            if isinstance(entry, dict) and entry.get('dataset')==dataset and 'time' in entry and 'groups' in entry:
+                return entry
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def write(self, dataset, groups):
+        """Stores the replica states for a dataset"""
+        writeJson(self.path(dataset), {'dataset': dataset, 'time': time.time(), 'groups': groups})
+
+    def isFresh(self, timestamp):
+        """Checks if something obtained at the given time can still be used"""
+        return time.time()-timestamp < self.ttl
+
+def getHosted(dataset, user, allow=None, block=None, workers=4, retries=3, verbose=False, cache=None, session=None, mapping=False):
+    """Gets list of files on disk for a dataset, and list of sites along with how many files each site has
+    (using and updating the replica states in the cache, if one is given, and the Rucio session, if one is given).
+    If mapping is True, the list of files is a dict of file: list of sites hosting it on disk"""
+    if allow is not None and block is not None:
+        raise RuntimeError("Cannot specify both allow list and block list, pick one")
+
+    entry = cache.read(dataset) if cache is not None else None
+    if entry is not None and cache.isFresh(entry['time']) and all(cache.isFresh(group['time']) for group in entry['groups']):
+        if verbose:
+            print(f"Loading from replica cache: {cache.path(dataset)}")
+        return filterReplicas(entry['groups'], allow=allow, block=block, mapping=mapping)
+
+    if session is None:
+        session = RucioSession(user, workers)
+        try:
+            return getHosted(dataset, user, allow=allow, block=block, retries=retries, verbose=verbose, cache=cache, session=session,
+                             mapping=mapping)
+        finally:
+            session.close()
+
+    # loop over blocks to avoid timeout error from too-large response
+    with session.get('client') as client:
+        all_blocks = [blk['name'] for blk in client.list_content(scope='cms',name=dataset)]
+
+    # only request the blocks which are not (or no longer) in the cache
+    groups = []
+    if entry is not None:
+        current = set(all_blocks)
+        groups = [group for group in entry['groups'] if cache.isFresh(group['time']) and current.issuperset(group['blocks'])]
+    cached = {name for group in groups for name in group['blocks']}
+    missing = [name for name in all_blocks if name not in cached]
+    if verbose and entry is not None:
+        print(f"Updating {len(missing)} of {len(all_blocks)} blocks in replica cache: {cache.path(dataset)}")
+    groups.extend(fetchGroups(missing, session, retries=retries, verbose=verbose))
+    if cache is not None:
+        cache.write(dataset, groups)
+
+    return filterReplicas(groups, allow=allow, block=block, mapping=mapping)
+
+def getFileLists(datasets, user, allow=None, block=None, workers=4, retries=3, verbose=False, cache=None, mapping=False):
+    """Gets list of files on disk and list of sites for each of several datasets, as a dict of dataset: (filelist, sitelist).
+    The datasets are queried concurrently, sharing one Rucio session (so the setup is only done once).
+    If mapping is True, each list of files is a dict of file: list of sites hosting it on disk"""
+    datasets = list(dict.fromkeys(datasets))
+    session = RucioSession(user, workers)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(session.workers, len(datasets)))) as executor:
+            futures = {dataset: executor.submit(getHosted, dataset, user, allow=allow, block=block, retries=retries, verbose=verbose,
+                                                cache=cache, session=session, mapping=mapping) for dataset in datasets}
+            return {dataset: future.result() for dataset,future in futures.items()}
+    finally:
+        session.close()
+
+# used for files whose sites have no known xrootd endpoint
+global_redirector = "root://cms-xrd-global.cern.ch/"
+
+def siteAlias(site):
+    """Gets the site name (e.g. T1_US_FNAL) from a Rucio RSE name (e.g. T1_US_FNAL_Disk)"""
+    return '_'.join(site.split('_')[:3])
+
+def getSiteEndpoints(sites, latency=False):
+    """Gets the best xrootd endpoint for each site (None if there is none) from GetSiteInfo,
+    and, if requested, the measured latency to each endpoint (None if it cannot be reached)"""
+    import GetSiteInfo # pylint: disable=import-outside-toplevel
+    info = GetSiteInfo.get_sites_info(sorted({siteAlias(site) for site in sites}), quiet=True)
+    endpoints = {site: info[siteAlias(site)].best_endpoint() if siteAlias(site) in info else None for site in sites}
+    latencies = {}
+    if latency:
+        ranking = GetSiteInfo.ENDPOINT_RANKING
+        unknown = set()
+        for site,endpoint in endpoints.items():
+            if endpoint is not None:
+                found, value = ranking.cached_latency(endpoint)
+                if found:
+                    latencies[site] = value
+                else:
+                    unknown.add(endpoint)
+        measured = ranking.measure(sorted(unknown)) if unknown else {}
+        latencies.update({site: measured[endpoint] for site,endpoint in endpoints.items() if endpoint in measured})
+    return endpoints, latencies
+
+def rankSites(sites, prefer=None, latencies=None):
+    """Orders sites from best to worst: first by the position of the first matching pattern in prefer (unmatched sites last),
+    then by latency (unreachable or unmeasured sites last), then by name"""
+    prefer = prefer or []
+    latencies = latencies or {}
+    def key(site):
+        preference = next((i for i,pattern in enumerate(prefer) if fnmatch.fnmatch(site, pattern)), len(prefer))
+        return (preference, latencies.get(site) is None, latencies.get(site) or 0, site)
+    return sorted(sites, key=key)
 
-    sys.path.pop(0)
-    return filelist, sitelist
+def chooseSites(filemap, prefer=None, latencies=None, balanced=False):
+    """Chooses one site to read each file from, given a dict of file: sites.
+    Either the best ranked site for every file, or (balanced) the files are spread over the sites hosting them:
+    the files with the fewest replicas are assigned first, each to its site with the fewest files so far (ties go to the better ranked site)"""
+    ranked = {name: rankSites(sites, prefer, latencies) for name,sites in filemap.items()}
+    if not balanced:
+        return {name: sites[0] for name,sites in ranked.items()}
+    load = defaultdict(int)
+    choice = {}
+    for name in sorted(ranked, key=lambda name: (len(ranked[name]), name)):
+        site = min(ranked[name], key=lambda site, sites=ranked[name]: (load[site], sites.index(site)))
+        load[site] += 1
+        choice[name] = site
+    return choice
+
+def makePfns(choice, endpoints):
+    """Gets the xrootd PFN for each file from the endpoint of its chosen site (or the global redirector)"""
+    return {name: (endpoints.get(site) or global_redirector).rstrip('/')+'/'+name for name,site in choice.items()}
+
+def readPileupMap(map_path):
+    """Parses the mapping from pileup dataset to cached file list"""
+    cache_map = {}
+    with open(map_path, 'r') as mapfile: # pylint: disable=unspecified-encoding
+        for line in mapfile:
+            linesplit = line.split()
+            if len(linesplit)==2:
+                cache_map[linesplit[0]] = linesplit[1]
+    return cache_map
+
+def getPileupMap(map_path=None, index_path=None):
+    """Gets the mapping from pileup dataset to cached file list.
+    The parsed mapping is kept in memory and in a local index file, both reused until the mapping file changes"""
+    map_path = map_path or pileup_map
+    index_path = index_path or pileup_index
+    try:
+        info = os.stat(map_path)
+    except OSError:
+        return {}
+    key = [map_path, info.st_mtime_ns, info.st_size]
+    if _pileup_maps.get(map_path, (None,))[0]!=key:
+        cache_map = None
+        try:
+            with open(index_path, encoding="utf-8") as ifile:
+                index = json.load(ifile)
+            if index['key']==key:
+                cache_map = index['map']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        if cache_map is None:
+            cache_map = readPileupMap(map_path)
+            writeJson(index_path, {'key': key, 'map': cache_map})
+        _pileup_maps[map_path] = (key, cache_map)
+    return _pileup_maps[map_path][1]
+
+def getCacheFile(dataset, verbose=False):
+    """Gets the path of the cached file list from cvmfs for a pileup sample, or None if there is no (non-empty) list"""
+    cache_map = getPileupMap()
+    if dataset not in cache_map:
+        return None
+    cache_file_path = os.path.join(pileup_dir, cache_map[dataset])
+    if os.path.getsize(cache_file_path)==0:
+        return None
+    if verbose:
+        print(f"Loading from cache: {cache_file_path}")
+    return cache_file_path
 
 def getCache(dataset, verbose=False):
     """Gets cached file lists from cvmfs for pileup samples"""
-    filelist = None
-    cache_dir = "/cvmfs/cms.cern.ch/offcomp-prod/premixPUlist/"
-    cache_map_file = "pileup_mapping.txt"
-    cache_map_path = os.path.join(cache_dir, cache_map_file)
-    if os.path.isfile(cache_map_path):
-        cache_map = {}
-        with open(cache_map_path, 'r') as mapfile: # pylint: disable=unspecified-encoding
-            for line in mapfile:
-                line = line.rstrip()
-                linesplit = line.split()
-                if len(linesplit)==2:
-                    cache_map[linesplit[0]] = linesplit[1]
-
-        if dataset in cache_map:
-            cache_file = cache_map[dataset]
-            cache_file_path = os.path.join(cache_dir, cache_file)
-            if verbose:
-                print(f"Loading from cache: {cache_file_path}")
-            with open(cache_file_path, 'r') as cfile: # pylint: disable=unspecified-encoding
-                filelist = [line.rstrip() for line in cfile]
+    cache_file_path = getCacheFile(dataset, verbose)
+    if cache_file_path is None:
+        return None
+    with open(cache_file_path, 'r') as cfile: # pylint: disable=unspecified-encoding
+        return [line.rstrip() for line in cfile]
+
+def copyFileList(path, file, chunk_size=1<<20):
+    """Streams a file list to the output in chunks, rather than reading it into memory"""
+    last = ''
+    with open(path, 'r') as cfile: # pylint: disable=unspecified-encoding
+        for chunk in iter(lambda: cfile.read(chunk_size), ''):
+            file.write(chunk)
+            last = chunk
+    if last and not last.endswith('\n'):
+        file.write('\n')
 
-    return filelist
+def outputName(dataset):
+    """Gets the name of the output file for a dataset in an output directory"""
+    return dataset.strip('/').replace('/','__')+'.txt'
 
-def main(dataset, user, outfile=None, verbose=False, allow=None, block=None, cache=True):
-    """Prints file list and site list"""
-    filelist = None
-    sitelist = None
+def writeFileList(file, filelist=None, cache_file=None):
+    """Writes a file list, either from a list or streamed from a cached file list"""
+    if cache_file is not None:
+        copyFileList(cache_file, file)
+    else:
+        print("\n".join(filelist), file=file)
+
+def writeOutput(datasets, results, cache_files, outfile=None, outdir=None, jsonfile=None, replicas=None): # pylint: disable=too-many-arguments
+    """Writes the file lists from Rucio (results) or cvmfs (cache_files) to stdout or outfile, to one file per dataset in outdir,
+    or (with the site lists, and the ranked sites for each file if given in replicas) to a combined JSON file"""
+    if jsonfile is not None:
+        output = {}
+        for dataset in datasets:
+            if dataset in cache_files:
+                output[dataset] = {'files': getCache(dataset), 'sites': None}
+            else:
+                filelist, sitelist = results[dataset]
+                output[dataset] = {'files': sorted(filelist), 'sites': dict(sitelist)}
+                if replicas is not None:
+                    output[dataset]['replicas'] = replicas[dataset]
+        with open(jsonfile, 'w', encoding="utf-8") as file:
+            json.dump(output, file, indent=2)
+    elif outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+        for dataset in datasets:
+            with open(os.path.join(outdir, outputName(dataset)), 'w') as file: # pylint: disable=unspecified-encoding
+                writeFileList(file, results.get(dataset, (None,))[0], cache_files.get(dataset))
+    else:
+        file = open(outfile,'w') if outfile is not None else sys.stdout # pylint: disable=consider-using-with,unspecified-encoding
+        for dataset in datasets:
+            writeFileList(file, results.get(dataset, (None,))[0], cache_files.get(dataset))
+        if outfile is not None: file.close() # pylint: disable=multiple-statements
+
+def rankReplicas(results, pfn='best', prefer=None, latency=False, verbose=False):
+    """Replaces the file: sites mapping for each dataset in results with a list of PFNs, one per file, using the best ranked site
+    (pfn='best') or spreading the files over the sites (pfn='balanced'); returns the ranked sites for each file of each dataset"""
+    sites = {site for _,sitelist in results.values() for site in sitelist}
+    endpoints, latencies = getSiteEndpoints(sites, latency=latency)
+    if verbose and latency:
+        print("Site latencies:")
+        print("\n".join(f'{site}: {latencies.get(site)}' for site in rankSites(sites, latencies=latencies)))
+    replicas = {}
+    for dataset,(filemap,sitelist) in results.items():
+        choice = chooseSites(filemap, prefer=prefer, latencies=latencies, balanced=pfn=='balanced')
+        pfns = makePfns(choice, endpoints)
+        results[dataset] = ([pfns[name] for name in sorted(pfns)], sitelist)
+        replicas[dataset] = {name: rankSites(filemap[name], prefer, latencies) for name in sorted(filemap)}
+        if verbose:
+            chosen = defaultdict(int)
+            for site in choice.values():
+                chosen[site] += 1
+            print(f"Files read from each site for {dataset}:")
+            print("\n".join(f'{k}: {v}' for k,v in sorted(chosen.items())))
+    return replicas
+
+def main(datasets, user, outfile=None, verbose=False, allow=None, block=None, cache=True, workers=4, cache_ttl=86400, # pylint: disable=too-many-arguments
+         outdir=None, jsonfile=None, pfn=None, prefer=None, latency=False):
+    """Prints file list and site list for one or more datasets
+    (to stdout or outfile, to one file per dataset in outdir, or to a combined JSON file).
+    With pfn ('best' or 'balanced'), the file lists contain xrootd PFNs at the chosen sites, ranked by the site patterns in prefer
+    and, if latency is True, by the measured latency"""
+    if isinstance(datasets, str):
+        datasets = [datasets]
+    datasets = list(dict.fromkeys(datasets))
+    cache_files = {}
+    if pfn is None and (prefer or latency):
+        pfn = 'best'
 
     if cache:
-        if not allow and not block:
-            filelist = getCache(dataset, verbose)
-        # cache does not consider allow or block lists, so disable if they are requested
+        # cvmfs cache does not know which sites host each file, so it cannot give PFNs
+        if pfn is not None:
+            if verbose:
+                print("Disabling cvmfs cache because PFNs are requested")
+        elif not allow and not block:
+            for dataset in datasets:
+                cache_file = getCacheFile(dataset, verbose)
+                if cache_file is not None:
+                    cache_files[dataset] = cache_file
+        # cvmfs cache does not consider allow or block lists, so disable if they are requested
+        # (the local replica cache does, so it is still used)
         else:
             if verbose:
-                print("Disabling cache because allow and/or block lists are specified")
+                print("Disabling cvmfs cache because allow and/or block lists are specified")
 
-    if not filelist:
-        filelist, sitelist = getHosted(dataset, user, allow=allow, block=block)
+    # the datasets without a cvmfs file list are queried together
+    replica_cache = ReplicaCache(ttl=cache_ttl) if cache else None
+    results = getFileLists([dataset for dataset in datasets if dataset not in cache_files], user, allow=allow, block=block, workers=workers,
+                           verbose=verbose, cache=replica_cache, mapping=pfn is not None)
+    replicas = rankReplicas(results, pfn=pfn, prefer=prefer, latency=latency, verbose=verbose) if pfn is not None else None
 
-    if verbose and sitelist:
-        print("Site list:")
-        print("\n".join(f'{k}: {v}' for k,v in sitelist.items()))
+    if verbose:
+        for dataset,(_,sitelist) in results.items():
+            if sitelist:
+                print(f"Site list for {dataset}:" if len(datasets)>1 else "Site list:")
+                print("\n".join(f'{k}: {v}' for k,v in sitelist.items()))
 
-    file = open(outfile,'w') if outfile is not None else sys.stdout # pylint: disable=consider-using-with,unspecified-encoding
-    print("\n".join(filelist), file=file)
-    if outfile is not None: file.close() # pylint: disable=multiple-statements
+    writeOutput(datasets, results, cache_files, outfile=outfile, outdir=outdir, jsonfile=jsonfile, replicas=replicas)
 
 if __name__=="__main__":
     default_user = getpass.getuser()
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-        description="Find all available files (those hosted on disk) for a given dataset"
+        description="Find all available files (those hosted on disk) for one or more datasets"
     )
     site_args = parser.add_mutually_exclusive_group(required=False)
     site_args.add_argument("-a","--allow",type=str,default=None,nargs='*',help="allow only these sites")
     site_args.add_argument("-b","--block",type=str,default=None,nargs='*',help="block these sites")
-    parser.add_argument("-o","--outfile",type=str,default=None,help="write to this file instead of stdout")
+    out_args = parser.add_mutually_exclusive_group(required=False)
+    out_args.add_argument("-o","--outfile",type=str,default=None,help="write to this file instead of stdout")
+    out_args.add_argument("-d","--outdir",type=str,default=None,help="write one file per dataset to this directory instead of stdout")
+    out_args.add_argument("--json",type=str,default=None,help="write the file and site lists for all datasets to this JSON file instead of stdout")
+    parser.add_argument("-i","--infile",type=str,default=None,help="read datasets to query from this file (one per line)")
     parser.add_argument("-u","--user",type=str,default=default_user,help="username for rucio")
     parser.add_argument("-v","--verbose",default=False,action="store_true",help="print extra information (site list)")
-    parser.add_argument("--no-cache",default=False,action="store_true",help="do not use cached file lists from cvmfs")
-    parser.add_argument("dataset",type=str,help="dataset to query")
+    parser.add_argument("-j","--jobs",type=int,default=4,help=f"number of concurrent Rucio requests (at most {max_workers})")
+    parser.add_argument("--no-cache",default=False,action="store_true",help="do not use cached file lists from cvmfs or the local replica cache")
+    parser.add_argument("--cache-ttl",type=int,default=86400,help="seconds before replica states in the local cache are requested again")
+    parser.add_argument("--refresh",default=False,action="store_true",help="request all replica states again and update the local cache")
+    parser.add_argument("-p","--pfn",type=str,default=None,nargs='?',const='best',choices=['best','balanced'],
+                        help="write xrootd PFNs instead of LFNs, reading each file from its best ranked site (best) "
+                        "or spreading the files over the sites hosting them (balanced)")
+    parser.add_argument("--prefer",type=str,default=None,nargs='*',help="rank sites in this order (wildcards allowed); implies --pfn")
+    parser.add_argument("--latency",default=False,action="store_true",
+                        help="rank sites by the measured latency to their xrootd endpoints; implies --pfn")
+    parser.add_argument("dataset",type=str,nargs='*',help="dataset(s) to query")
     args = parser.parse_args()
 
-    main(args.dataset, args.user, outfile=args.outfile, verbose=args.verbose, allow=args.allow, block=args.block, cache=not args.no_cache)
+    if args.infile is not None:
+        with open(args.infile, 'r') as infile: # pylint: disable=unspecified-encoding
+            args.dataset.extend(line.strip() for line in infile if line.strip() and not line.startswith('#'))
+    if not args.dataset:
+        parser.error("at least one dataset is required")
+
+    main(args.dataset, args.user, outfile=args.outfile, verbose=args.verbose, allow=args.allow, block=args.block, cache=not args.no_cache,
+         workers=args.jobs, cache_ttl=0 if args.refresh else args.cache_ttl, outdir=args.outdir, jsonfile=args.json,
+         pfn=args.pfn, prefer=args.prefer, latency=args.latency)
@@ -0,0 +1,364 @@
+#!/bin/env python3
+
+"""Benchmark copyfiles.py against a local stand-in for the remote storage.
+
+The xrdfs, xrdcp, gfal-copy, gfal-ls, gfal-mkdir, and voms-proxy-info commands are replaced by stub executables.
+The stubs map the root:// URLs onto a local directory and sleep for a configurable latency before each operation
+(and, for copies, for the time needed at a configurable bandwidth). Each stub appends a line to a log file, so the
+number of subprocesses spawned by copyfiles can be counted. The site information comes from a snapshot file, so
+no network access, grid proxy, or CVMFS mount is needed.
+
+For each synthetic tree (many small files, a few large files, a deep tree), transfer direction (upload or download),
+and variant (a set of extra copyfiles options) copyfiles.py is run in a separate process. The wall time, the number
+of subprocesses per command, the number of operations from the copyfiles --report, and whether all of the files
+arrived are recorded. The results are written as JSON, along with the git commit, so that runs from different commits
+can be compared:
+
+    python3 test/bench_copyfiles.py --output before.json
+    (change copyfiles.py)
+    python3 test/bench_copyfiles.py --output after.json --compare before.json
+
+With --compare the exit code is 1 if any benchmark became slower than --threshold times the reference.
+"""
+
+from __future__ import absolute_import
+import argparse
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+SITE = "T3_US_BENCH"
+USER = "bench"
+
+# The source of the stub executables. A single script is linked under the name of each command it replaces.
+STUB = r'''
+import json, os, re, shutil, sys, time, zlib
+
+tool = os.path.basename(sys.argv[0])
+args = sys.argv[1:]
+storage = os.environ["BENCH_STORAGE"]
+with open(os.environ["BENCH_LOG"], "a", encoding = "utf-8") as log:
+    log.write(json.dumps({"tool": tool, "args": args}) + "\n")
+time.sleep(float(os.environ.get("BENCH_LATENCY", "0")))
+
+def local(url):
+    """Map a root://, gsiftp://, or file:// URL onto the local filesystem."""
+    if url.startswith("file://"):
+        return os.path.normpath("/" + url[len("file://"):].lstrip("/"))
+    match = re.match(r"^[a-z]+://[^/]+", url)
+    if match is None:
+        return url
+    return os.path.normpath(storage + "/" + url[match.end():].lstrip("/"))
+
+def fail(message):
+    print(f"[ERROR] Server responded with an error: [3011] {message}; No such file or directory")
+    sys.exit(54)
+
+def copy(source, destination):
+    if os.path.isdir(destination) or destination.endswith("/"):
+        destination = os.path.join(destination, os.path.basename(source))
+    if not os.path.isfile(source):
+        fail(f"Unable to open {source}")
+    os.makedirs(os.path.dirname(destination), exist_ok = True)
+    shutil.copyfile(source, destination)
+    time.sleep(os.path.getsize(source) / (float(os.environ.get("BENCH_BANDWIDTH", "1e9")) * 1e6))
+
+def entry_line(path):
+    stat = os.stat(path)
+    flags = "dr-x" if os.path.isdir(path) else "-r--"
+    date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(stat.st_mtime))
+    return f"{flags} {date} {stat.st_size:>12} {path[len(storage):]}"
+
+if tool == "voms-proxy-info":
+    if "-timeleft" in args:
+        print(86400)
+elif tool == "xrdfs":
+    command, path = args[1:-1], local(args[0].rstrip("/") + "/" + args[-1].lstrip("/"))
+    if command[0] == "ls":
+        if not os.path.isdir(path):
+            fail(f"Unable to open directory {path}")
+        for name in sorted(os.listdir(path)):
+            print(entry_line(os.path.join(path, name)) if "-l" in command else os.path.join(path, name)[len(storage):])
+    elif command[0] == "stat":
+        if not os.path.exists(path):
+            fail(f"Unable to stat {path}")
+        stat = os.stat(path)
+        print(f"Path:   {path[len(storage):]}\nSize:   {stat.st_size}\n"
+              f"MTime:  {time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(stat.st_mtime))}\n"
+              f"Flags:  {'51 (XBitSet|IsDir|IsReadable)' if os.path.isdir(path) else '16 (IsReadable)'}")
+    elif command[0] == "mkdir":
+        os.makedirs(path, exist_ok = True)
+    elif command[:2] == ["query", "checksum"]:
+        value = 1
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                value = zlib.adler32(chunk, value)
+        print(f"adler32 {value & 0xffffffff:08x}")
+elif tool == "xrdcp":
+    sources, positional, i = [], [], 0
+    while i < len(args):
+        if args[i] in ("--streams", "-S", "--infiles", "-I"):
+            if args[i] in ("--infiles", "-I"):
+                with open(args[i + 1], encoding = "utf-8") as infiles:
+                    sources += [line.strip() for line in infiles if line.strip()]
+            i += 2
+            continue
+        if not args[i].startswith("-"):
+            positional.append(args[i])
+        i += 1
+    sources += positional[:-1]
+    destination = local(positional[-1]) + ("/" if len(sources) > 1 else "")
+    failed = False
+    for source in sources:
+        try:
+            copy(local(source), destination)
+        except SystemExit:
+            print(f"[ERROR] {source}: No such file or directory")
+            failed = True
+    sys.exit(54 if failed else 0)
+elif tool == "gfal-copy":
+    positional = [arg for arg in args if not arg.startswith("-")]
+    source, destination = local(positional[-2]), local(positional[-1])
+    if os.path.isdir(source):
+        shutil.copytree(source, destination, dirs_exist_ok = True)
+    else:
+        copy(source, destination)
+elif tool == "gfal-ls":
+    path = local([arg for arg in args if not arg.startswith("-")][-1])
+    if not os.path.exists(path):
+        fail(f"Unable to open {path}")
+    for name in (sorted(os.listdir(path)) if os.path.isdir(path) else [os.path.basename(path)]):
+        if "-l" not in args:
+            print(name)
+            continue
+        stat = os.stat(os.path.join(path, name) if os.path.isdir(path) else path)
+        mode = "drwxr-xr-x" if os.path.isdir(os.path.join(path, name)) else "-rw-r--r--"
+        print(f"{mode} {1:3d} {0:<4d} {0:<4d} {stat.st_size:12d} {time.strftime('%b %d %H:%M', time.localtime(stat.st_mtime))} {name}")
+elif tool == "gfal-mkdir":
+    os.makedirs(local([arg for arg in args if not arg.startswith("-")][-1]), exist_ok = True)
+'''
+
+TOOLS = ["xrdfs", "xrdcp", "gfal-copy", "gfal-ls", "gfal-mkdir", "voms-proxy-info"]
+
+def make_stubs(directory):
+    """Write the stub script and link it under the name of each of the replaced commands."""
+    os.makedirs(directory, exist_ok = True)
+    stub = os.path.join(directory, "stub.py")
+    with open(stub, "w", encoding = "utf-8") as stub_file:
+        stub_file.write(f"#!{sys.executable}\n" + STUB)
+    os.chmod(stub, 0o755)
+    for tool in TOOLS:
+        os.symlink(stub, os.path.join(directory, tool))
+
+def write_snapshot(path):
+    """Write a GetSiteInfo snapshot containing the benchmark site, whose only endpoint is the stand-in storage."""
+    sys.path.insert(0, REPO)
+    import GetSiteInfo # pylint: disable=import-outside-toplevel
+    site = GetSiteInfo.Site(SITE)
+    site.name = site.rse = SITE
+    site.endpoints[GetSiteInfo.EndpointType.XROOTD].add("root://localhost/")
+    GetSiteInfo.save_snapshot([site], path)
+
+def make_tree(top, scenario, scale):
+    """Create one of the synthetic trees and return the number of files and bytes in it."""
+    files = []
+    if scenario == "small_files":
+        files = [(f"dir{i % 10}/file{i}.txt", 4096) for i in range(int(200 * scale))]
+    elif scenario == "large_files":
+        files = [(f"file{i}.root", int(16 * 1024 * 1024 * scale)) for i in range(3)]
+    elif scenario == "deep_tree":
+        depth = max(1, int(15 * scale))
+        files = [("/".join(f"level{d}" for d in range(level + 1)) + f"/file{i}.txt", 1024)
+                 for level in range(depth) for i in range(2)]
+    else:
+        raise ValueError(f"Unknown scenario {scenario}")
+    for name, size in files:
+        path = os.path.join(top, name)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, "wb") as file:
+            file.write((name.encode() * (size // len(name) + 1))[:size])
+    return len(files), sum(size for _, size in files)
+
+def count_files(top):
+    """Return the number of files below a directory."""
+    return sum(len(files) for _, _, files in os.walk(top))
+
+def git_commit():
+    """Return the current git commit of the repository, or None if it cannot be found."""
+    try:
+        return subprocess.check_output(["git", "-C", REPO, "rev-parse", "--short", "HEAD"], stderr = subprocess.DEVNULL,
+                                       encoding = "utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_one(work, scenario, direction, variant, run_id, arguments): # pylint: disable=too-many-arguments,too-many-locals
+    """Run copyfiles.py once and return the measurements."""
+    storage = os.path.join(work, "storage")
+    source_tree = os.path.join(work, "trees", scenario)
+    # copyfiles expects the paths of directories to end with a '/'
+    remote_source = f"bench_src/{scenario}/"
+    remote_destination = f"bench_dst/{scenario}/{run_id}/"
+    local_destination = os.path.join(work, "downloads", scenario, str(run_id)) + "/"
+    log = os.path.join(work, f"log_{run_id}.jsonl")
+    report = os.path.join(work, f"report_{run_id}.json")
+
+    if direction == "upload":
+        command = ["local", source_tree + "/", SITE, remote_destination]
+        destination = os.path.join(storage, "store/user", USER, remote_destination)
+    else:
+        command = [SITE, remote_source, "local", local_destination]
+        destination = local_destination
+        os.makedirs(local_destination, exist_ok = True)
+    command = [sys.executable, os.path.join(REPO, "copyfiles.py")] + command + \
+              ["-r", "-p", arguments.protocol, "--snapshot", os.path.join(work, "snapshot.json"), "--report", report,
+               "--no_probe", "-su", USER, "-eu", USER] + shlex.split(variant)
+
+    env = dict(os.environ, PATH = os.path.join(work, "bin") + os.pathsep + os.environ["PATH"], USER = USER,
+               BENCH_STORAGE = storage, BENCH_LOG = log, BENCH_LATENCY = str(arguments.latency),
+               BENCH_BANDWIDTH = str(arguments.bandwidth), X509_USER_PROXY = os.path.join(work, "proxy"),
+               XDG_CACHE_HOME = os.path.join(work, "cache"))
+    start = time.monotonic()
+    result = subprocess.run(command, env = env, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, check = False)
+    wall = time.monotonic() - start
+
+    subprocesses = {}
+    if os.path.exists(log):
+        with open(log, encoding = "utf-8") as log_file:
+            for line in log_file:
+                tool = json.loads(line)["tool"]
+                subprocesses[tool] = subprocesses.get(tool, 0) + 1
+    operations = {}
+    if os.path.exists(report):
+        with open(report, encoding = "utf-8") as report_file:
+            operations = {name: values["count"] for name, values in json.load(report_file)["operations"].items()}
+    if result.returncode != 0 and arguments.verbose:
+        print(result.stdout.decode("utf-8", errors = "replace"))
+
+    return {
+        "scenario": scenario,
+        "direction": direction,
+        "variant": variant,
+        "wall_seconds": wall,
+        "subprocesses": sum(subprocesses.values()),
+        "subprocesses_by_command": subprocesses,
+        "operations": operations,
+        "files_copied": count_files(destination) if os.path.isdir(destination) else 0,
+        "exit_code": result.returncode,
+    }
+
+def run_benchmarks(arguments):
+    """Run every combination of scenario, direction, and variant and return the results."""
+    work = tempfile.mkdtemp(prefix = "bench_copyfiles_")
+    try:
+        make_stubs(os.path.join(work, "bin"))
+        write_snapshot(os.path.join(work, "snapshot.json"))
+        with open(os.path.join(work, "proxy"), "w", encoding = "utf-8") as proxy:
+            proxy.write("stand-in proxy\n")
+
+        results = []
+        run_id = 0
+        for scenario in arguments.scenarios:
+            nfiles, nbytes = make_tree(os.path.join(work, "trees", scenario), scenario, arguments.scale)
+            shutil.copytree(os.path.join(work, "trees", scenario),
+                            os.path.join(work, "storage/store/user", USER, "bench_src", scenario))
+            for direction in arguments.directions:
+                for variant in arguments.variants:
+                    runs = []
+                    for _ in range(arguments.repeat):
+                        runs.append(run_one(work, scenario, direction, variant, run_id, arguments))
+                        run_id += 1
+                    best = min(runs, key = lambda run: run["wall_seconds"])
+                    best.update(files = nfiles, bytes = nbytes, ok = all(run["files_copied"] == nfiles for run in runs),
+                                wall_seconds_all = [run["wall_seconds"] for run in runs])
+                    results.append(best)
+                    print(f"{scenario:12s} {direction:8s} {variant or '(default)':28s} {best['wall_seconds']:8.2f} s "
+                          f"{best['subprocesses']:6d} subprocesses {'ok' if best['ok'] else 'INCOMPLETE'}")
+        return results
+    finally:
+        if not arguments.keep:
+            shutil.rmtree(work, ignore_errors = True)
+        else:
+            print(f"The benchmark files were kept in {work}")
+
+def result_key(result):
+    """The fields identifying a benchmark, used to match the results of two runs."""
+    return result["scenario"], result["direction"], result["variant"]
+
+def compare(results, reference, threshold):
+    """Print the change of each benchmark with respect to the reference results.
+    Return True if any benchmark was slower than 'threshold' times the reference or spawned more subprocesses.
+    """
+    previous = {result_key(result): result for result in reference["results"]}
+    regression = False
+    print(f"\nComparison with {reference.get('commit')}:")
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        ratio = result["wall_seconds"] / old["wall_seconds"] if old["wall_seconds"] > 0 else 1.0
+        slower = ratio > threshold or result["subprocesses"] > old["subprocesses"]
+        regression |= slower
+        print(f"{result['scenario']:12s} {result['direction']:8s} {result['variant'] or '(default)':28s} "
+              f"{old['wall_seconds']:8.2f} s -> {result['wall_seconds']:8.2f} s ({ratio:5.2f}x), "
+              f"{old['subprocesses']} -> {result['subprocesses']} subprocesses{'  REGRESSION' if slower else ''}")
+    return regression
+
+def main(arguments):
+    """Run the benchmarks, write the results, and compare them with the reference, if one is given."""
+    results = run_benchmarks(arguments)
+    output = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "settings": {key: value for key, value in vars(arguments).items() if key not in ("output", "compare", "keep")},
+        "results": results,
+    }
+    with open(arguments.output, "w", encoding = "utf-8") as output_file:
+        json.dump(output, output_file, indent = 2, sort_keys = True)
+        output_file.write("\n")
+    print(f"The results were written to {arguments.output}")
+
+    if arguments.compare:
+        with open(arguments.compare, encoding = "utf-8") as reference_file:
+            reference = json.load(reference_file)
+        if reference.get("settings") != output["settings"]:
+            print("WARNING::The reference results were produced with different settings, so they may not be comparable.")
+        return 1 if compare(results, reference, arguments.threshold) else 0
+    return 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs = "+", default = ["small_files", "large_files", "deep_tree"],
+                        choices = ["small_files", "large_files", "deep_tree"],
+                        help = "The synthetic trees to copy (default = %(default)s)")
+    parser.add_argument("--directions", nargs = "+", default = ["upload", "download"], choices = ["upload", "download"],
+                        help = "Copy from local to the stand-in storage, the reverse, or both (default = %(default)s)")
+    parser.add_argument("--variants", nargs = "+", default = ["", "-j 8", "-j 8 --batch_size 50"],
+                        help = "The sets of extra copyfiles.py options to benchmark (default = %(default)s)")
+    parser.add_argument("-p", "--protocol", choices = ["gfal", "xrootd"], default = "xrootd",
+                        help = "The protocol passed to copyfiles.py (default = %(default)s)")
+    parser.add_argument("--latency", type = float, default = 0.01,
+                        help = "The number of seconds each stub command waits, to simulate the latency of the storage "
+                               "(default = %(default)s)")
+    parser.add_argument("--bandwidth", type = float, default = 200.0,
+                        help = "The simulated bandwidth of each copy in MB/s (default = %(default)s)")
+    parser.add_argument("--scale", type = float, default = 1.0,
+                        help = "Multiplies the number of files, the file sizes, or the depth of the trees (default = %(default)s)")
+    parser.add_argument("--repeat", type = int, default = 1,
+                        help = "The number of times to run each benchmark, keeping the fastest (default = %(default)s)")
+    parser.add_argument("-o", "--output", default = "bench_output.txt",
+                        help = "The file to which the JSON results are written (default = %(default)s)")
+    parser.add_argument("--compare", default = None,
+                        help = "A results file from an earlier run to compare against (default = %(default)s)")
+    parser.add_argument("--threshold", type = float, default = 1.2,
+                        help = "The slow down, relative to the --compare results, counted as a regression (default = %(default)s)")
+    parser.add_argument("-k", "--keep", action = "store_true",
+                        help = "Keep the temporary directory with the trees, logs, and reports (default = %(default)s)")
+    parser.add_argument("-v", "--verbose", action = "store_true",
+                        help = "Print the output of the copyfiles.py runs which failed (default = %(default)s)")
+    sys.exit(main(parser.parse_args()))
@@ -1,23 +1,31 @@
 #!/usr/bin/env python3
 
 """This module contains the pytest tests for the modules:
-  1. GetPythonVersions
-  2. GetSiteInfo
-  3. RecursiveFileList
-  4. Toolgenie
+  1. get_files_on_disk
+  2. GetPythonVersions
+  3. GetSiteInfo
+  4. RecursiveFileList
+  5. Toolgenie
+  6. xrdcp_recursive
 """
 
 from __future__ import absolute_import
+from collections import defaultdict
 from io import StringIO
+import json
 import os
 import sys
+import threading
+import types
 sys.path.insert(1, os.path.dirname(os.path.realpath(__file__))+'/..')
 # pylint: disable=wrong-import-position
 import pytest # pylint: disable=import-error
+import get_files_on_disk
 import GetPythonVersions
 import GetSiteInfo
 import RecursiveFileList
 import toolgenie
+import xrdcp_recursive
 # pylint: enable=wrong-import-position
 
 class Capturing(list):
@@ -35,6 +43,217 @@ class Capturing(list):
         del self._stringio    # free up some memory
         sys.stdout = self._stdout
 
+class FakeRucio:
+    """A stand-in for the Rucio clients used by get_files_on_disk.
+    The dataset has 'nblocks' blocks of 'nfiles' files; the even numbered files are on disk at T1_US_FNAL_Disk and all of
+    the files are on tape at T1_US_FNAL_Tape and on disk at T2_CH_CERN. Requests for more than 'max_blocks' blocks fail.
+    """
+
+    def __init__(self, nblocks = 25, nfiles = 4, max_blocks = 1000):
+        self.nblocks = nblocks
+        self.nfiles = nfiles
+        self.max_blocks = max_blocks
+        self.requests = []
+        self.setups = 0
+        self.clients = defaultdict(int)
+
+    def install(self, monkeypatch):
+        """Replace the Rucio modules and the setup of the Rucio environment."""
+        fake = self
+        class Client: # pylint: disable=missing-class-docstring
+            def __init__(self):
+                fake.clients[type(self).__name__] += 1
+            def list_content(self, scope, name): # pylint: disable=missing-function-docstring
+                assert scope == 'cms'
+                return [{'name': f"{name}#{i}"} for i in range(fake.nblocks)]
+        class ReplicaClient: # pylint: disable=missing-class-docstring
+            def __init__(self):
+                fake.clients[type(self).__name__] += 1
+            def list_replicas(self, dids): # pylint: disable=missing-function-docstring
+                fake.requests.append(len(dids))
+                if len(dids) > fake.max_blocks:
+                    raise RuntimeError("Request timed out")
+                for did in dids:
+                    for i in range(fake.nfiles):
+                        states = {'T1_US_FNAL_Tape': 'AVAILABLE', 'T2_CH_CERN': 'AVAILABLE'}
+                        if i % 2 == 0:
+                            states['T1_US_FNAL_Disk'] = 'AVAILABLE'
+                        yield {'name': f"/store/{did['name'].split('#')[1]}/{i}.root", 'states': states}
+        for name in ("rucio", "rucio.client"):
+            monkeypatch.setitem(sys.modules, name, types.ModuleType(name))
+        monkeypatch.setitem(sys.modules, "rucio.client.client", types.SimpleNamespace(Client = Client))
+        monkeypatch.setitem(sys.modules, "rucio.client.replicaclient", types.SimpleNamespace(ReplicaClient = ReplicaClient))
+        def get_rucio(user): # pylint: disable=unused-argument
+            fake.setups += 1
+            sys.path.insert(0, "rucio")
+            return "rucio"
+        monkeypatch.setattr(sys, "path", list(sys.path))
+        monkeypatch.setattr(get_files_on_disk, "getRucio", get_rucio)
+        return self
+
+class TestGetFilesOnDisk:
+    """Class containing the tests for the get_files_on_disk module, using a stand-in for Rucio."""
+
+    def test_get_hosted(self, monkeypatch):
+        """Tests the getHosted function from within the get_files_on_disk module.
+        Checks that the concurrent requests find every file on disk and count the files per site.
+        """
+        fake = FakeRucio().install(monkeypatch)
+        filelist, sitelist = get_files_on_disk.getHosted("/A/B/C", "user", workers = 4)
+        assert len(filelist) == 100
+        assert dict(sitelist) == {'T2_CH_CERN': 100, 'T1_US_FNAL_Disk': 50}
+        assert sum(fake.requests) == 25
+        filelist, sitelist = get_files_on_disk.getHosted("/A/B/C", "user", block = ["T2_CH_CERN"])
+        assert len(filelist) == 50
+        assert dict(sitelist) == {'T1_US_FNAL_Disk': 50}
+
+    def test_get_hosted_adaptive(self, monkeypatch):
+        """Tests that getHosted shrinks the block groups when the requests fail and grows them when they succeed."""
+        fake = FakeRucio(nblocks = 40, max_blocks = 3).install(monkeypatch)
+        filelist, _ = get_files_on_disk.getHosted("/A/B/C", "user", workers = 2)
+        assert len(filelist) == 160
+        assert fake.requests[0] == 10
+        assert max(size for size in fake.requests if size <= 3) == 3
+
+        group_size = get_files_on_disk.GroupSize(size = 10, maximum = 20, target = 1.0)
+        assert group_size.update(0.5) == 15
+        assert group_size.update(0.5) == 20
+        assert group_size.update(0.5) == 20
+        assert group_size.update(5.0) == 10
+        assert group_size.update(None) == 5
+
+        FakeRucio(nblocks = 5, max_blocks = 0).install(monkeypatch)
+        with pytest.raises(RuntimeError):
+            get_files_on_disk.getHosted("/A/B/C", "user", retries = 1)
+
+    def test_batch(self, monkeypatch, tmp_path):
+        """Tests the getFileLists and main functions from within the get_files_on_disk module for several datasets.
+        Checks that Rucio is only set up once, that at most one client of each kind per worker is created for all of
+        the datasets, and that the per dataset and combined JSON outputs are written.
+        """
+        fake = FakeRucio().install(monkeypatch)
+        datasets = ["/A/B/C", "/D/E/F", "/G/H/I", "/A/B/C"]
+        results = get_files_on_disk.getFileLists(datasets, "user", allow = ["T1_US_FNAL_Disk"], workers = 2)
+        assert list(results) == ["/A/B/C", "/D/E/F", "/G/H/I"]
+        assert all(len(filelist) == 50 for filelist, _ in results.values())
+        assert fake.setups == 1
+        assert 1 <= fake.clients["Client"] <= 2 and 1 <= fake.clients["ReplicaClient"] <= 2
+        assert "rucio" not in sys.path
+
+        get_files_on_disk.main(datasets, "user", cache = False, jsonfile = str(tmp_path / "out.json"))
+        with open(tmp_path / "out.json", encoding = "utf-8") as json_file:
+            output = json.load(json_file)
+        assert sorted(output) == ["/A/B/C", "/D/E/F", "/G/H/I"]
+        assert output["/D/E/F"]["sites"] == {"T2_CH_CERN": 100, "T1_US_FNAL_Disk": 50}
+        assert output["/D/E/F"]["files"][0] == "/store/0/0.root"
+        assert fake.setups == 2
+
+        get_files_on_disk.main(datasets, "user", cache = False, outdir = str(tmp_path / "lists"))
+        assert sorted(os.listdir(tmp_path / "lists")) == ["A__B__C.txt", "D__E__F.txt", "G__H__I.txt"]
+        assert len((tmp_path / "lists" / "G__H__I.txt").read_text().split()) == 100
+
+    def test_rank_sites(self, monkeypatch, tmp_path):
+        """Tests the site ranking and PFN output from within the get_files_on_disk module.
+        Checks the order given by the site preference and the latency, the best and balanced choice of sites, and the PFN lists.
+        """
+        sites = ["T2_CH_CERN", "T1_US_FNAL_Disk", "T2_US_Purdue", "T2_DE_DESY"]
+        latencies = {"T2_CH_CERN": 0.1, "T1_US_FNAL_Disk": 0.3, "T2_US_Purdue": None}
+        assert get_files_on_disk.rankSites(sites) == sorted(sites)
+        assert get_files_on_disk.rankSites(sites, prefer = ["T2_US_*", "T1_*"]) == ["T2_US_Purdue", "T1_US_FNAL_Disk", "T2_CH_CERN", "T2_DE_DESY"]
+        assert get_files_on_disk.rankSites(sites, latencies = latencies) == ["T2_CH_CERN", "T1_US_FNAL_Disk", "T2_DE_DESY", "T2_US_Purdue"]
+
+        filemap = {f"/store/{i}.root": ["T1_US_FNAL_Disk", "T2_CH_CERN"] for i in range(6)}
+        filemap["/store/6.root"] = ["T2_CH_CERN"]
+        best = get_files_on_disk.chooseSites(filemap, prefer = ["T1_*"])
+        assert best["/store/0.root"] == "T1_US_FNAL_Disk"
+        assert best["/store/6.root"] == "T2_CH_CERN"
+        balanced = get_files_on_disk.chooseSites(filemap, prefer = ["T1_*"], balanced = True)
+        assert sorted(balanced.values()).count("T2_CH_CERN") in (3, 4)
+        assert balanced["/store/6.root"] == "T2_CH_CERN"
+        pfns = get_files_on_disk.makePfns(best, {"T1_US_FNAL_Disk": "root://cmsxrootd-site.fnal.gov/", "T2_CH_CERN": None})
+        assert pfns["/store/0.root"] == "root://cmsxrootd-site.fnal.gov//store/0.root"
+        assert pfns["/store/6.root"] == "root://cms-xrd-global.cern.ch//store/6.root"
+
+        FakeRucio(nblocks = 2).install(monkeypatch)
+        monkeypatch.setattr(get_files_on_disk, "getSiteEndpoints",
+                            lambda sites, latency = False: ({"T1_US_FNAL_Disk": "root://fnal/", "T2_CH_CERN": "root://cern/"},
+                                                            {"T1_US_FNAL_Disk": 0.01, "T2_CH_CERN": 0.2} if latency else {}))
+        get_files_on_disk.main("/A/B/C", "user", cache = False, latency = True, outfile = str(tmp_path / "pfns.txt"))
+        pfns = (tmp_path / "pfns.txt").read_text().split()
+        assert len(pfns) == 8
+        assert sum(pfn.startswith("root://fnal//store/") for pfn in pfns) == 4
+        get_files_on_disk.main("/A/B/C", "user", cache = False, pfn = "balanced", prefer = ["T2_*"], jsonfile = str(tmp_path / "out.json"))
+        with open(tmp_path / "out.json", encoding = "utf-8") as json_file:
+            output = json.load(json_file)["/A/B/C"]
+        assert sum(pfn.startswith("root://fnal/") for pfn in output["files"]) == 4
+        assert output["replicas"]["/store/0/0.root"] == ["T2_CH_CERN", "T1_US_FNAL_Disk"]
+
+    def test_pileup_cache(self, monkeypatch, tmp_path):
+        """Tests the getCache and main functions from within the get_files_on_disk module using a stand-in for the cvmfs area.
+        Checks that the mapping is indexed, that the index follows changes to the mapping, and that the file list is copied as is.
+        """
+        pileup_dir = tmp_path / "premixPUlist"
+        pileup_dir.mkdir()
+        (pileup_dir / "pileup_mapping.txt").write_text("/A/B/PREMIX a.txt\n/D/E/PREMIX d.txt\nbad line here\n")
+        (pileup_dir / "a.txt").write_text("/store/a/1.root\n/store/a/2.root")
+        (pileup_dir / "d.txt").write_text("/store/d/1.root\n")
+        monkeypatch.setattr(get_files_on_disk, "pileup_dir", str(pileup_dir))
+        monkeypatch.setattr(get_files_on_disk, "pileup_map", str(pileup_dir / "pileup_mapping.txt"))
+        monkeypatch.setattr(get_files_on_disk, "pileup_index", str(tmp_path / "index.json"))
+        monkeypatch.setattr(get_files_on_disk, "_pileup_maps", {})
+
+        assert get_files_on_disk.getCache("/A/B/PREMIX") == ["/store/a/1.root", "/store/a/2.root"]
+        assert get_files_on_disk.getCache("/X/Y/Z") is None
+        with open(tmp_path / "index.json", encoding = "utf-8") as index_file:
+            assert json.load(index_file)["map"] == {"/A/B/PREMIX": "a.txt", "/D/E/PREMIX": "d.txt"}
+        monkeypatch.setattr(get_files_on_disk, "_pileup_maps", {})
+        assert get_files_on_disk.getPileupMap() == {"/A/B/PREMIX": "a.txt", "/D/E/PREMIX": "d.txt"}
+
+        (pileup_dir / "pileup_mapping.txt").write_text("/A/B/PREMIX d.txt\n")
+        os.utime(pileup_dir / "pileup_mapping.txt", ns = (0, 0))
+        assert get_files_on_disk.getCache("/A/B/PREMIX") == ["/store/d/1.root"]
+
+        outfile = tmp_path / "out.txt"
+        (pileup_dir / "pileup_mapping.txt").write_text("/A/B/PREMIX a.txt\n")
+        get_files_on_disk.main("/A/B/PREMIX", "user", outfile = str(outfile))
+        assert outfile.read_text() == "/store/a/1.root\n/store/a/2.root\n"
+
+    def test_replica_cache(self, monkeypatch, tmp_path):
+        """Tests the ReplicaCache class from within the get_files_on_disk module.
+        Checks that repeated queries (including ones with an allow list) are answered from the cache and that
+        only the blocks which were added or removed are requested again once the list of blocks is out of date.
+        """
+        fake = FakeRucio().install(monkeypatch)
+        cache = get_files_on_disk.ReplicaCache(directory = str(tmp_path), ttl = 3600)
+        filelist, _ = get_files_on_disk.getHosted("/A/B/C", "user", cache = cache)
+        assert len(filelist) == 100
+        assert sum(fake.requests) == 25
+
+        fake.requests.clear()
+        filelist, sitelist = get_files_on_disk.getHosted("/A/B/C", "user", allow = ["T1_US_FNAL_Disk"], cache = cache)
+        assert len(filelist) == 50
+        assert dict(sitelist) == {'T1_US_FNAL_Disk': 50}
+        assert not fake.requests
+
+        def expire_block_list():
+            entry = cache.read("/A/B/C")
+            entry["time"] = 0
+            with open(cache.path("/A/B/C"), "w", encoding = "utf-8") as cache_file:
+                json.dump(entry, cache_file)
+
+        fake.nblocks = 27
+        expire_block_list()
+        filelist, _ = get_files_on_disk.getHosted("/A/B/C", "user", cache = cache)
+        assert len(filelist) == 108
+        assert sum(fake.requests) == 2
+
+        fake.nblocks = 24
+        fake.requests.clear()
+        expire_block_list()
+        filelist, _ = get_files_on_disk.getHosted("/A/B/C", "user", cache = cache)
+        assert len(filelist) == 96
+        assert 0 < sum(fake.requests) < 24
+
 @pytest.mark.skip(reason="taskes a long time to run")
 class TestGetPythonVersions:
     """Class containing the test(s) for the GetPythonVersions module."""
@@ -91,6 +310,143 @@ class TestGetSiteInfo:
         assert "rse=T3_US_FNALLPC" in output
         assert "pfn=gsiftp://cmseos-gridftp.fnal.gov:2811/eos/uscms" in output
 
+    def test_site_cache(self, tmp_path):
+        """Checks that the SiteCache only calls the retrieve function when the entry is missing, stale, or
+        a refresh is requested, and that a stale entry is returned while it is refreshed in a background daemon thread.
+        """
+        cache = GetSiteInfo.SiteCache(directory = str(tmp_path), ttl = 60)
+        calls = []
+        release = threading.Event()
+        release.set()
+        def retrieve():
+            release.wait()
+            calls.append(1)
+            return {"value": len(calls)}
+
+        assert cache.get("cric_site", "T3_US_FNALLPC", retrieve) == {"value": 1}
+        assert cache.get("cric_site", "T3_US_FNALLPC", retrieve) == {"value": 1}
+        assert len(calls) == 1
+
+        cache.ttl = -1
+        release.clear()
+        assert cache.get("cric_site", "T3_US_FNALLPC", retrieve) == {"value": 1}
+        threads = list(cache._revalidating.values()) # pylint: disable=protected-access
+        assert len(threads) == 1 and threads[0].daemon
+        release.set()
+        cache.wait()
+        assert len(calls) == 2
+        cache.ttl = 60
+        assert cache.get("cric_site", "T3_US_FNALLPC", retrieve) == {"value": 2}
+
+        cache.refresh = True
+        assert cache.get("cric_site", "T3_US_FNALLPC", retrieve) == {"value": 3}
+
+    def test_expand_aliases(self):
+        """Checks that the wildcards in the site aliases are expanded in order and without duplicates."""
+        names = ["T2_US_Purdue", "T2_US_MIT", "T3_US_FNALLPC", "T2_DE_DESY"]
+        output = GetSiteInfo.expand_aliases(["T2_US_*", "T3_US_FNALLPC", "T2_US_MIT", "T1_US_FNAL"], names)
+        assert output == ["T2_US_MIT", "T2_US_Purdue", "T3_US_FNALLPC", "T1_US_FNAL"]
+
+    def test_snapshot(self, tmp_path):
+        """Checks that the site information written to a snapshot is read back unchanged, without running the checks
+        or contacting any of the online sources.
+        """
+        site = GetSiteInfo.Site("T3_US_FNALLPC")
+        site.name = site.rse = "T3_US_FNALLPC"
+        site.pfn = "gsiftp://cmseos-gridftp.fnal.gov:2811/eos/uscms"
+        site.endpoints[GetSiteInfo.EndpointType.XROOTD].add("root://cmseos.fnal.gov/")
+        path = str(tmp_path / "sites.json")
+        GetSiteInfo.save_snapshot([site], path)
+
+        output = GetSiteInfo.get_site_info(site_alias = "T3_US_FNALLPC", quiet = True, snapshot = path)
+        assert output.to_dict() == site.to_dict()
+        output.fts.append("https://fts.example:8446")
+        assert GetSiteInfo.get_site_info(site_alias = "T3_US_FNALLPC", quiet = True, snapshot = path).to_dict() == site.to_dict()
+        with pytest.raises(RuntimeError):
+            GetSiteInfo.get_site_info(site_alias = "T2_US_MIT", quiet = True, snapshot = path)
+
+    def test_proxy_expiry(self, tmp_path, monkeypatch):
+        """Checks that voms-proxy-info is only run once for each version of the proxy file, even across processes,
+        by replacing it with a script which counts how many times it was called.
+        """
+        counter = tmp_path / "calls"
+        script = tmp_path / "voms-proxy-info"
+        script.write_text(f"#!/bin/sh\necho x >> {counter}\necho 7200\n")
+        script.chmod(0o755)
+        proxy = tmp_path / "x509up"
+        proxy.write_text("proxy")
+        monkeypatch.setenv("PATH", f"{tmp_path}:{os.environ['PATH']}")
+        monkeypatch.setenv("X509_USER_PROXY", str(proxy))
+        monkeypatch.setattr(GetSiteInfo, "SITE_CACHE", GetSiteInfo.SiteCache(directory = str(tmp_path / "cache")))
+        monkeypatch.setattr(GetSiteInfo, "_proxy_expiry", {})
+
+        assert GetSiteInfo.check_proxy() == str(proxy)
+        assert 7000 < GetSiteInfo.proxy_time_left() <= 7200
+        GetSiteInfo._proxy_expiry.clear() # pylint: disable=protected-access
+        assert not GetSiteInfo.warn_if_proxy_expires(3600)
+        assert GetSiteInfo.warn_if_proxy_expires(86400)
+        assert len(counter.read_text().split()) == 1
+
+        proxy.write_text("new proxy")
+        GetSiteInfo.check_proxy()
+        assert len(counter.read_text().split()) == 2
+
+    def test_endpoint_ranking(self, tmp_path, monkeypatch):
+        """Checks that the endpoints are ranked by their latency, that unreachable and excluded endpoints come last
+        or are skipped, and that the measurements are cached.
+        """
+        latencies = {"root://fast.host:1094/": 0.01, "root://slow.host:1094//store/": 0.5, "root://down.host/": None}
+        probes = []
+        def probe(endpoint, timeout): # pylint: disable=unused-argument
+            probes.append(endpoint)
+            return latencies[endpoint]
+        monkeypatch.setattr(GetSiteInfo, "SITE_CACHE", GetSiteInfo.SiteCache(directory = str(tmp_path)))
+        monkeypatch.setattr(GetSiteInfo, "ENDPOINT_RANKING", GetSiteInfo.EndpointRanking(probe = probe))
+
+        site = GetSiteInfo.Site("T2_US_Test")
+        site.endpoints[GetSiteInfo.EndpointType.XROOTD].update(latencies)
+        assert site.best_endpoint() == "root://fast.host:1094/"
+        assert GetSiteInfo.ENDPOINT_RANKING.rank(latencies) == ["root://fast.host:1094/", "root://slow.host:1094//store/",
+                                                                "root://down.host/"]
+        assert site.best_endpoint(exclude = ["root://fast.host:1094"]) == "root://slow.host:1094//store/"
+        assert len(probes) == 3
+
+        GetSiteInfo.ENDPOINT_RANKING.enabled = False
+        assert site.best_endpoint() == "root://slow.host:1094//store/"
+        assert site.best_endpoint(GetSiteInfo.EndpointType.GSIFTP) is None
+
+    def test_source_errors(self, tmp_path, monkeypatch):
+        """Checks that a source which times out or cannot be reached only leaves out its own information, both when
+        looking up a single site and when looking up many sites at once.
+        """
+        cmssst_item = {"site": "T2_US_Test", "type": "XROOTD", "endpoint": "xrootd.test.edu:1094"}
+        with Capturing() as output:
+            site = GetSiteInfo.Site("T2_US_Test")
+            site.get_info_from_all_sources(prefetched = {"cric_site": TimeoutError("took too long"),
+                                                         "cric_glidein": GetSiteInfo.request.URLError("no route to host"),
+                                                         "cmssst": cmssst_item,
+                                                         "siteconf": OSError("no cvmfs")})
+        assert site.endpoints[GetSiteInfo.EndpointType.XROOTD] == {"root://xrootd.test.edu:1094/"}
+        assert len([line for line in output if "WARNING" in line]) == 3
+
+        def unreachable(timeout):
+            raise GetSiteInfo.request.URLError(f"no route to host within {timeout} seconds")
+        monkeypatch.setattr(GetSiteInfo, "run_checks", lambda quiet: None)
+        monkeypatch.setattr(GetSiteInfo, "SITE_CACHE", GetSiteInfo.SiteCache(directory = str(tmp_path)))
+        monkeypatch.setattr(GetSiteInfo, "SOURCES", dict(GetSiteInfo.SOURCES, siteconf = lambda alias, timeout: {}))
+        monkeypatch.setattr(GetSiteInfo, "GLOBAL_SOURCES", {
+            "cric_site": lambda timeout: {"T2_US_Test": {"facility": "US_Test", "name": "T2_US_Test", "state": "ACTIVE",
+                                                         "status": "production", "vo_name": "cms"}},
+            "cric_glidein": unreachable,
+            "cmssst": lambda timeout: [cmssst_item]})
+        with Capturing() as output:
+            sites = GetSiteInfo.get_sites_info(["T2_US_T*"], quiet = True)
+        assert list(sites) == ["T2_US_Test"]
+        assert sites["T2_US_Test"].facility == "US_Test"
+        assert sites["T2_US_Test"].endpoints[GetSiteInfo.EndpointType.XROOTD] == {"root://xrootd.test.edu:1094/"}
+        assert any("cric_glidein" in line for line in output)
+        assert GetSiteInfo.SITE_CACHE.read("cric_glidein", "T2_US_Test") is None
+
 class TestRecursiveFileList:
     """Class containing the tests for the RecursiveFileList module."""
 
@@ -139,6 +495,142 @@ class TestRecursiveFileList:
         assert isinstance(output, list)
         assert len(output) == 6
 
+    def test_iter_files(self):
+        """Tests the iter_files generator from within the RecursiveFileList module.
+        Compares the output to some know values and checks that it matches the output of make_file_list.
+        """
+        path = "/eos/uscms/store/user/cmsdas/test"
+        output = list(RecursiveFileList.iter_files(path))
+        assert len(output) == 62
+        assert output == RecursiveFileList.make_file_list(path, RecursiveFileList.map_dir(path, path))
+
+    def test_iter_dirs(self):
+        """Tests the iter_dirs generator from within the RecursiveFileList module.
+        Compares the output to some know values and checks that it matches the output of make_dir_list.
+        """
+        path = "/eos/uscms/store/user/cmsdas/test"
+        output = list(RecursiveFileList.iter_dirs(path))
+        assert len(output) == 6
+        assert output == RecursiveFileList.make_dir_list(path, RecursiveFileList.map_dir(path, path))
+
+    def test_parallel_scan(self):
+        """Tests the parallel mode of get_file_list and get_dir_list from within the RecursiveFileList module.
+        Checks that the output is the sorted version of the output from the single threaded mode.
+        """
+        path = "/eos/uscms/store/user/cmsdas/test"
+        assert RecursiveFileList.get_file_list(path, workers = 4) == sorted(RecursiveFileList.get_file_list(path))
+        assert RecursiveFileList.get_dir_list(path, workers = 4) == sorted(RecursiveFileList.get_dir_list(path))
+
+    def test_walk(self):
+        """Tests the walk generator from within the RecursiveFileList module.
+        Checks that it finds the same directories and files as the other functions.
+        """
+        path = "/eos/uscms/store/user/cmsdas/test"
+        output = list(RecursiveFileList.walk(path))
+        assert len(output) == 7
+        assert sum(len(filenames) for _, _, filenames in output) == 62
+
+class TestXrdcpRecursive:
+    """Class containing the tests for the xrdcp_recursive module, which do not need access to an XRootD endpoint."""
+
+    def test_target_path(self):
+        """Tests the target_path function from within the xrdcp_recursive module.
+        Checks that the source directory name appearing more than once in the path is only replaced at the start.
+        """
+        assert xrdcp_recursive.target_path("/data/data/a/file.root", "/data", "/store/user/me") == "/store/user/me/data/a/file.root"
+        assert xrdcp_recursive.target_path("data/file.root", "data/", "/store/user/me/data") == "/store/user/me/data/file.root"
+
+    def test_manifest(self, tmp_path):
+        """Tests the Manifest class from within the xrdcp_recursive module.
+        Checks that the last record for each path is used and that a partially written line is skipped.
+        """
+        manifest = xrdcp_recursive.Manifest(str(tmp_path / "manifest.jsonl"))
+        assert not manifest.load()
+        manifest.write(path = "a.root", size = 1, status = "failed")
+        manifest.write(path = "b.root", size = 2, status = "done")
+        manifest.write(path = "a.root", size = 1, status = "done")
+        with open(manifest.path, "a", encoding = "utf-8") as manifest_file:
+            manifest_file.write('{"path": "c.root", "sta')
+        records = manifest.load()
+        assert sorted(records) == ["a.root", "b.root"]
+        assert records["a.root"]["status"] == "done"
+        empty = xrdcp_recursive.Manifest("")
+        empty.write(path = "a.root", size = 1, status = "done")
+        assert not empty.load()
+
+    def test_upload_retries(self, monkeypatch):
+        """Tests the upload function from within the xrdcp_recursive module.
+        Checks that a transient error is retried while a fatal one, like a permission problem, is not.
+        """
+        results = []
+        commands = []
+        def run(command, **kwargs): # pylint: disable=unused-argument
+            commands.append(list(command))
+            returncode, output = results.pop(0)
+            return types.SimpleNamespace(returncode = returncode, stdout = output.encode("utf-8"))
+        monkeypatch.setattr(xrdcp_recursive.subprocess, "run", run)
+        policy = xrdcp_recursive.RetryPolicy(max_attempts = 3, sleep = lambda delay: None)
+
+        results.extend([(54, "[ERROR] Operation expired"), (0, "")])
+        assert xrdcp_recursive.upload("a.root", "/store/a.root", "root://eos.example", policy)[1:] == (0, "")
+        assert not results
+        assert commands == [["xrdcp", "a.root", "root://eos.example//store/a.root"],
+                            ["xrdcp", "-f", "a.root", "root://eos.example//store/a.root"]]
+
+        results.extend([(54, "[ERROR] Server responded with an error: [3010] Permission denied"), (0, "")])
+        assert xrdcp_recursive.upload("a.root", "/store/a.root", "root://eos.example", policy)[1] == 54
+        assert len(results) == 1
+        results.clear()
+
+        results.append((0, ""))
+        command = xrdcp_recursive.upload("a.root", "/store/a.root", "root://eos.example", policy, force = True)[0]
+        assert command == "xrdcp -f a.root root://eos.example//store/a.root"
+
+    def test_resume(self, monkeypatch, tmp_path):
+        """Tests the --resume option of the xrdcp_recursive module.
+        Only the files which are not recorded as done with the same size should be uploaded again.
+        """
+        source = tmp_path / "source"
+        (source / "sub").mkdir(parents = True)
+        for name in ("a.root", "c.root", "sub/b.root"):
+            (source / name).write_text(name)
+        manifest = xrdcp_recursive.Manifest(str(tmp_path / "manifest.jsonl"))
+        manifest.write(path = str(source / "a.root"), size = 6, status = "done")
+        manifest.write(path = str(source / "c.root"), size = 1, status = "done")
+        manifest.write(path = str(source / "sub/b.root"), size = 10, status = "failed")
+
+        uploaded = []
+        def upload(source_file, target_file, redir, retry_policy, force = False): # pylint: disable=unused-argument
+            assert force
+            uploaded.append(target_file)
+            return f"xrdcp -f {source_file} {redir}/{target_file}", 0, ""
+        monkeypatch.setattr(xrdcp_recursive, "upload", upload)
+        arguments = types.SimpleNamespace(source = str(source), target = "/store/user/me", redir = "root://eos.example",
+                                          workers = 1, jobs = 2, retries = 0, retry_delay = 0.0,
+                                          manifest = manifest.path, resume = True)
+        with Capturing() as output:
+            assert not xrdcp_recursive.main(arguments)
+        assert "Resuming: 2 files left to upload" in output
+        assert sorted(uploaded) == ["/store/user/me/c.root", "/store/user/me/sub/b.root"]
+        assert {record["status"] for record in manifest.load().values()} == {"done"}
+
+    def test_unreadable_file(self, monkeypatch, tmp_path):
+        """Tests that a file which disappears after the listing is recorded as failed without stopping the other uploads."""
+        (tmp_path / "a.root").write_text("a")
+        monkeypatch.setattr(xrdcp_recursive, "get_file_list", lambda source, workers: [str(tmp_path / "a.root"),
+                                                                                        str(tmp_path / "gone.root")])
+        monkeypatch.setattr(xrdcp_recursive, "upload", lambda *args, **kwargs: ("xrdcp", 0, ""))
+        manifest = xrdcp_recursive.Manifest(str(tmp_path / "manifest.jsonl"))
+        arguments = types.SimpleNamespace(source = str(tmp_path), target = "/store/user/me", redir = "root://eos.example",
+                                          workers = 1, jobs = 2, retries = 0, retry_delay = 0.0,
+                                          manifest = manifest.path, resume = False)
+        with Capturing():
+            failures = xrdcp_recursive.main(arguments)
+        assert [failure[0] for failure in failures] == [str(tmp_path / "gone.root")]
+        records = manifest.load()
+        assert records[str(tmp_path / "gone.root")]["status"] == "failed"
+        assert records[str(tmp_path / "a.root")]["status"] == "done"
+
 class TestToolgenie:
     """Class containing the tests for the Toolgenie module."""
 
@@ -34,12 +34,22 @@
     python3 -m unittest discover [--start-directory [DIRECTORY]] [--pattern [PATTERN]] [--top-level-directory [DIRECTORY]]
 """
 
+# pylint: disable=too-many-lines
 from __future__ import absolute_import
 import unittest
+import argparse
 import os
 import shlex
 import shutil
 import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+sys.path.insert(1, os.path.dirname(os.path.realpath(__file__))+'/..')
+# pylint: disable=wrong-import-position
+import copyfiles
+# pylint: enable=wrong-import-position
 
 # pylint: disable=consider-using-with
 # pylint: disable=invalid-name
@@ -651,5 +661,457 @@ class TestCopyfilesMethods(unittest.TestCase):
         command = f"gfal-rm -r gsiftp://cmseos-gridftp.fnal.gov:2811/eos/uscms/{destination_directory}"
         process = subprocess.Popen(shlex.split(command), stdout = subprocess.PIPE, stderr = subprocess.STDOUT).communicate()[0]
 
+class TestCopyfilesHelpers(unittest.TestCase):
+    """Tests for the parts of the copyfiles module which do not need access to a grid endpoint."""
+
+    def setUp(self):
+        """Use the shell backend without any delay between the retries."""
+        copyfiles.set_backend("shell", retry_policy = copyfiles.RetryPolicy(sleep = lambda delay: None))
+
+    def test_run_transfers(self):
+        """Run a mix of successful and failing tasks through the worker pool and make sure that only the
+        failures are reported, using the (source, destination, reason) format of copyfiles.Error.
+        """
+        tasks = [copyfiles.CopyTask(f"src{i}", f"dst{i}", "true" if i % 3 else "exit 3") for i in range(9)]
+        errors = copyfiles.run_transfers(tasks, jobs = 4)
+        self.assertEqual([error[:2] for error in errors], [("src0", "dst0"), ("src3", "dst3"), ("src6", "dst6")])
+        self.assertTrue(all(error[2].startswith("exit code 3") for error in errors))
+
+    def test_run_transfers_dry_run(self):
+        """A dry run should never execute the planned commands."""
+        tasks = [copyfiles.CopyTask("src", "dst", "exit 1")]
+        self.assertEqual(copyfiles.run_transfers(tasks, jobs = 2, dry_run = True), [])
+
+    def test_transfer_stats(self):
+        """Run some tasks and make sure that the report counts the copies, the bytes of the successful copies,
+        the failures, and the MB/s per endpoint.
+        """
+        copyfiles.STATS.reset()
+        tasks = [copyfiles.CopyTask(f"src{i}", f"root://host.{i % 2}//dst{i}", "true" if i % 3 else "exit 3", 1000)
+                 for i in range(6)]
+        with copyfiles.STATS.phase("transfers"):
+            copyfiles.run_transfers(tasks, jobs = 3, progress = True)
+        report = copyfiles.STATS.report()
+        self.assertEqual(report["operations"]["copy"]["count"], 6)
+        self.assertEqual(report["operations"]["copy"]["failed"], 2)
+        self.assertEqual(report["totals"]["bytes"], 4000)
+        self.assertEqual(sorted(report["endpoints"]), ["root://host.0", "root://host.1"])
+        self.assertEqual(report["endpoints"]["root://host.1"]["bytes"], 2000)
+        self.assertEqual([failure["source"] for failure in report["failures"]], ["src0", "src3"])
+        self.assertIn("transfers", report["phases"])
+        self.assertEqual(copyfiles.percentile([4, 1, 3, 2], 50), 2)
+        self.assertEqual(copyfiles.percentile([4, 1, 3, 2], 99), 4)
+
+    def test_parse_listing(self):
+        """Parse both layouts of the 'xrdfs ls -l' output and the 'gfal-ls -l' output and make sure the type, size, and time are kept."""
+        output = ("dr-x 2021-10-01 12:00:00        4096 /store/user/cmsdas/test/testing\n"
+                  "-r-- 2021-10-01 12:00:01       12345 /store/user/cmsdas/test/file.root\n"
+                  "-rw-r--r-- cmsdas us_cms 678 2021-10-02 08:30:00 /store/user/cmsdas/test/other.root\n"
+                  "[ERROR] not a listing line\n")
+        entries = copyfiles.parse_listing(output)
+        self.assertEqual(list(entries), ["testing", "file.root", "other.root"])
+        self.assertTrue(entries["testing"].is_dir)
+        self.assertEqual(entries["file.root"], copyfiles.ListingEntry("file.root", False, 12345, 1633089601))
+        self.assertEqual(entries["other.root"].size, 678)
+
+        output = ("drwxr-xr-x   1 0     0                0 Oct 01 12:00 testing\n"
+                  "-rw-r--r--   1 0     0            12345 Oct 01  2021 file with spaces.root\n"
+                  "gfal-ls error: 2 (No such file or directory)\n")
+        entries = copyfiles.parse_listing(output)
+        self.assertEqual(list(entries), ["testing", "file with spaces.root"])
+        self.assertTrue(entries["testing"].is_dir)
+        self.assertEqual(entries["file with spaces.root"].size, 12345)
+        self.assertEqual(time.localtime(entries["file with spaces.root"].mtime)[:3], (2021, 10, 1))
+
+    def test_filter_list_of_files(self):
+        """Match the names against several patterns at once and make sure each name is only returned once."""
+        names = ["file1.root", "file2.root", "file1.txt", "dir"]
+        self.assertEqual(copyfiles.filter_list_of_files(["file1", ".root", "file1"], names), ["file1.root", "file2.root", "file1.txt"])
+        self.assertEqual(copyfiles.filter_list_of_files([], names + names), names)
+        self.assertEqual(copyfiles.filter_list_of_files(["file?.t*"], names), ["file1.txt"])
+
+    def test_batch_tasks(self):
+        """Group the tasks of a directory into batches and match the failures in the xrdcp output to the sources."""
+        tasks = [copyfiles.CopyTask(f"/src/file{i}.root", f"/dst/file{i}.root", "") for i in range(5)]
+        self.assertEqual(copyfiles.batch_tasks(tasks, "xrdcp", 0), tasks)
+        batches = copyfiles.batch_tasks(tasks, "xrdcp", 2)
+        self.assertEqual([len(batch.sources) for batch in batches], [2, 2, 1])
+        self.assertEqual(batches[0].destination, "/dst/")
+        output = "[0B/0B][100%][==================================================][0B/s]\n" \
+                 "Run: [ERROR] Server responded with an error: [3011] No such file or directory (source /src/file1.root)\n"
+        self.assertEqual(copyfiles.parse_batch_failures(batches[0], 0, output), [])
+        failures = copyfiles.parse_batch_failures(batches[0], 54, output)
+        self.assertEqual([failure[:2] for failure in failures], [("/src/file1.root", "/dst/file1.root")])
+        failures = copyfiles.parse_batch_failures(batches[1], 54, "[FATAL] Auth failed")
+        self.assertEqual(len(failures), 2)
+
+        batch = copyfiles.BatchCopyTask(("/src/file1", "/src/file10"), ("/dst/file1", "/dst/file10"), "xrdcp", (1, 1))
+        failures = copyfiles.parse_batch_failures(batch, 54, "[ERROR] Server responded with an error: [3011] No such file "
+                                                             "or directory (source /src/file10)\n")
+        self.assertEqual([failure[0] for failure in failures], ["/src/file10"])
+        failures = copyfiles.parse_batch_failures(batch, 54, "[ERROR] /src/file1: Operation expired\n")
+        self.assertEqual([failure[0] for failure in failures], ["/src/file1"])
+
+    def test_copy_batch_mixed_failures(self):
+        """A file which fails for good must still be reported when the retry of the other failed files succeeds."""
+        class StubBackend(copyfiles.Backend): # pylint: disable=abstract-method
+            """Backend where file A is missing and file B times out on the first attempt only."""
+            def __init__(self):
+                super().__init__(copyfiles.RetryPolicy(sleep = lambda delay: None))
+                self.attempts = []
+            def _copy_batch(self, task):
+                self.attempts.append(task.sources)
+                if len(self.attempts) == 1:
+                    return 54, ("[ERROR] Server responded with an error: [3011] No such file or directory (source /src/A)\n"
+                                "[ERROR] Operation expired (source /src/B)\n")
+                return 0, ""
+        backend = StubBackend()
+        task = copyfiles.BatchCopyTask(("/src/A", "/src/B"), ("/dst/A", "/dst/B"), "xrdcp", (1, 1))
+        returncode, output = backend.copy_batch(task)
+        self.assertEqual(backend.attempts, [("/src/A", "/src/B"), ("/src/B",)])
+        self.assertNotEqual(returncode, 0)
+        failures = copyfiles.parse_batch_failures(task, returncode, output)
+        self.assertEqual([failure[:2] for failure in failures], [("/src/A", "/dst/A")])
+
+    def test_destination_entry(self):
+        """The journaled relative path is used to find the destination, whatever endpoint was used to copy it."""
+        with tempfile.TemporaryDirectory() as dst:
+            with open(os.path.join(dst, "file.txt"), "w", encoding = "utf-8") as file:
+                file.write("abc")
+            task = copyfiles.CopyTask("/src/file.txt", "root://old.host//store/user/tester/file.txt", "xrdcp", 3,
+                                      path = os.path.join(dst, "file.txt"))
+            end_site = copyfiles.Location("local", "tester", dst)
+            self.assertEqual(copyfiles.destination_entry(end_site, task).size, 3)
+            self.assertIsNone(copyfiles.destination_entry(end_site, task._replace(path = os.path.join(dst, "missing.txt"))))
+
+    def test_sync_forces_overwrite(self):
+        """The files picked by --sync may already exist at the destination, so their copies must overwrite them."""
+        start_site = copyfiles.Location("local", "tester", "/src")
+        end_site = copyfiles.Location("local", "tester", "/dst")
+        for protocol, command in (("xrootd", "xrdcp -f"), ("gfal", "gfal-copy -f")):
+            arguments = argparse.Namespace(debug = False, protocol = protocol, quiet = False, streams = None, recursive = False,
+                                           dry_run = False, verbose = False, additional_arguments = "", sync = True)
+            self.assertEqual(copyfiles.init_commands(start_site, end_site, arguments)[0], command)
+            arguments.sync = False
+            self.assertNotIn("-f", copyfiles.init_commands(start_site, end_site, arguments)[0].split())
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            for directory, content in ((src, "new"), (dst, "old")):
+                with open(os.path.join(directory, "file.txt"), "w", encoding = "utf-8") as file:
+                    file.write(content)
+            arguments = argparse.Namespace(debug = False, protocol = "xrootd", quiet = False, streams = None, recursive = True,
+                                           dry_run = True, verbose = False, additional_arguments = "", sync = True,
+                                           checksum = True, diff = False, depth = 1, sample = ["*"], batch_size = 0, jobs = 1,
+                                           expected_rate = 50.0, progress = False)
+            plan = copyfiles.TransferPlan()
+            copyfiles.copytree(copyfiles.Location("local", "tester", src), src, copyfiles.Location("local", "tester", dst), dst,
+                               0, arguments = arguments, plan = plan)
+            self.assertEqual([(task.command.split()[:2], task.force) for task in plan.tasks], [(["xrdcp", "-f"], True)])
+            self.assertEqual((plan.tasks[0].size, plan.tasks[0].path), (3, os.path.join(dst, "file.txt")))
+
+    def test_xrootd_command_streams(self):
+        """The --streams option should only be passed to xrdcp when the user asks for it."""
+        start_site = copyfiles.Location("local", "tester", "/src")
+        end_site = copyfiles.Location("local", "tester", "/dst")
+        self.assertEqual(copyfiles.XRootDCommand(action = "cp", start_site = start_site, end_site = end_site).get_full_command(),
+                         "xrdcp /src /dst")
+        self.assertEqual(copyfiles.XRootDCommand(action = "cp", start_site = start_site, end_site = end_site,
+                                                 streams = 4).get_full_command(), "xrdcp --streams 4 /src /dst")
+
+    def test_set_backend_xrdcp_options(self):
+        """The XRootD bindings cannot honour --streams, -v, or -s, so 'auto' should fall back to the shell backend."""
+        with mock.patch.object(copyfiles, "xrootd_client", mock.MagicMock()):
+            self.assertIsInstance(copyfiles.set_backend("auto"), copyfiles.XRootDBackend)
+            self.assertIsInstance(copyfiles.set_backend("auto", xrdcp_options = True), copyfiles.ShellBackend)
+            with self.assertRaises(RuntimeError):
+                copyfiles.set_backend("xrootd", xrdcp_options = True)
+
+    def test_circuit_failover(self):
+        """When the circuit breaker of an endpoint opens, the tasks planned with that endpoint should continue
+        through the next endpoint of the same site instead of failing with a CircuitOpenError.
+        """
+        class StubBackend(copyfiles.Backend): # pylint: disable=abstract-method
+            """Backend where every copy through the primary endpoint is refused."""
+            def __init__(self, retry_policy):
+                super().__init__(retry_policy)
+                self.commands = []
+            def _copy(self, task):
+                self.commands.append(task.command)
+                return (1, "[ERROR] Connection refused") if "primary" in task.command else (0, "")
+            def _copy_batch(self, task):
+                return self._copy(task)
+        backend = StubBackend(copyfiles.RetryPolicy(failure_threshold = 1, sleep = lambda delay: None))
+        site = copyfiles.Location("T3_US_Test", "tester", "data")
+        site.endpoints[copyfiles.GetSiteInfo.EndpointType.XROOTD].update({"root://primary.example.org/", "root://backup.org/"})
+        with mock.patch.object(copyfiles, "_backend", backend), \
+             mock.patch.object(copyfiles.GetSiteInfo.ENDPOINT_RANKING, "enabled", False):
+            prefix = copyfiles.best_endpoint(site) + "/store/user/tester/data/"
+            self.assertEqual(prefix, "root://primary.example.org//store/user/tester/data/")
+            tasks = [copyfiles.CopyTask(prefix + "file0", "/tmp/file0", "xrdcp " + prefix + "file0 /tmp/file0"),
+                     copyfiles.BatchCopyTask((prefix + "file1", prefix + "file2"), ("/tmp/file1", "/tmp/file2"), "xrdcp", (1, 1))]
+            tasks[1] = tasks[1]._replace(command = "xrdcp " + " ".join(tasks[1].sources) + " /tmp/")
+            self.assertEqual(copyfiles.run_transfers(tasks, jobs = 1), [])
+        self.assertEqual(backend.commands[0], tasks[0].command)
+        self.assertEqual(backend.commands[1:], ["xrdcp root://backup.org//store/user/tester/data/file0 /tmp/file0",
+                                                "xrdcp root://backup.org//store/user/tester/data/file1 "
+                                                "root://backup.org//store/user/tester/data/file2 /tmp/"])
+
+    def test_do_sync(self):
+        """Compare two local directories and make sure only the files which differ are selected for copying."""
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            contents = {"same.txt" : ("abc", "abc"), "size.txt" : ("abcd", "abc"), "content.txt" : ("abc", "xyz"),
+                        "missing.txt" : ("abc", None)}
+            for name, (src_content, dst_content) in contents.items():
+                for directory, content in ((src, src_content), (dst, dst_content)):
+                    if content is not None:
+                        with open(os.path.join(directory, name), "w", encoding = "utf-8") as file:
+                            file.write(content)
+                        os.utime(os.path.join(directory, name), (1000000000, 1000000000))
+            os.mkdir(os.path.join(src, "subdir"))
+            start_site = copyfiles.Location("local", "tester", src)
+            end_site = copyfiles.Location("local", "tester", dst)
+            files = sorted(os.listdir(src))
+            self.assertEqual(copyfiles.do_sync(files, start_site, src, end_site, dst),
+                             ["missing.txt", "size.txt", "subdir"])
+            self.assertEqual(copyfiles.do_sync(files, start_site, src, end_site, dst, checksum = True),
+                             ["content.txt", "missing.txt", "size.txt", "subdir"])
+            self.assertEqual(copyfiles.file_checksum(start_site, os.path.join(src, "same.txt")), "024d0127")
+
+    def test_do_sync_listing_formats(self):
+        """The modification times from xrdfs and gfal listings, which print them differently, should be compared as times."""
+        src_listing = copyfiles.parse_listing("-r-- 2021-10-01 12:00:00 3 /store/user/tester/src/old.root\n"
+                                              "-r-- 2021-10-09 12:00:00 3 /store/user/tester/src/new.root\n")
+        dst_listing = copyfiles.parse_listing("-rw-r--r--   1 0     0       3 Oct 05  2021 old.root\n"
+                                              "-rw-r--r--   1 0     0       3 Oct 05  2021 new.root\n")
+        site = copyfiles.Location("T3_US_Test", "tester", "src")
+        with mock.patch.object(copyfiles, "list_directory", side_effect = [src_listing, dst_listing]):
+            self.assertEqual(copyfiles.do_sync(["new.root", "old.root"], site, "src", site, "dst"), ["new.root"])
+
+    def test_make_directories(self):
+        """Create a planned local directory tree, making only the deepest directories."""
+        with tempfile.TemporaryDirectory() as directory:
+            site = copyfiles.Location("local", "tester", directory)
+            planned = [directory, f"{directory}/a", f"{directory}/a/b", f"{directory}/a/b-c", f"{directory}/d/"]
+            self.assertEqual(copyfiles.make_directories(site, planned, jobs = 2, dry_run = True), [])
+            self.assertFalse(os.path.exists(f"{directory}/a"))
+            self.assertEqual(copyfiles.make_directories(site, planned, jobs = 2), [])
+            self.assertTrue(all(os.path.isdir(path) for path in planned))
+
+    def test_transfer_journal(self):
+        """Record the progress of some transfers, including an interrupted one, and check which would be resumed."""
+        with tempfile.TemporaryDirectory() as directory:
+            journal = copyfiles.TransferJournal(os.path.join(directory, "journal.jsonl"))
+            tasks = [copyfiles.CopyTask(f"src{i}", f"dst{i}", f"xrdcp src{i} dst{i}", i) for i in range(4)]
+            batch = copyfiles.BatchCopyTask(("srcA", "srcB"), ("dstA", "dstB"), "xrdcp", (1, 2))
+            for task in tasks + [batch]:
+                journal.record("planned", task)
+            self.assertEqual(copyfiles.run_transfers([tasks[0]._replace(command = "true"),
+                                                      tasks[1]._replace(command = "false")], journal = journal), [("src1", "dst1", "exit code 1: ")])
+            journal.record("in-flight", tasks[2])
+            journal.record("in-flight", tasks[3])
+            with open(journal.path, "a", encoding = "utf-8") as file:
+                file.write('{"state": "do')
+            journal = copyfiles.TransferJournal(journal.path)
+            unfinished = journal.unfinished_tasks(verify = lambda task: task.size == 3)
+            self.assertEqual([task.destination for task in unfinished], ["dst1", "dst2", "dstA", "dstB"])
+            self.assertEqual(unfinished[2].command, "xrdcp srcA dstA")
+            self.assertEqual((unfinished[1].command, unfinished[1].force), ("xrdcp -f src2 dst2", True))
+            self.assertFalse(unfinished[0].force)
+            self.assertEqual(journal.load()["dst3"]["state"], "done")
+            with mock.patch.object(copyfiles, "run_task", side_effect = copyfiles.CircuitOpenError("circuit open")):
+                self.assertEqual(copyfiles.run_transfers([batch], journal = journal),
+                                 [("srcA", "dstA", "circuit open"), ("srcB", "dstB", "circuit open")])
+            self.assertEqual({journal.load()[name]["state"] for name in ("dstA", "dstB")}, {"failed"})
+
+    def test_retry_policy(self):
+        """Retry the transient errors, but not the fatal ones, and stop contacting an endpoint after repeated failures."""
+        delays = []
+        policy = copyfiles.RetryPolicy(max_attempts = 3, base_delay = 1.0, failure_threshold = 4, sleep = delays.append)
+        self.assertTrue(policy.is_retryable(54, "[ERROR] Operation expired"))
+        self.assertTrue(policy.is_retryable(51, "[ERROR] Server responded with an error: [3012] Internal server error"))
+        self.assertFalse(policy.is_retryable(54, "[ERROR] Server responded with an error: [3011] No such file or directory"))
+        self.assertFalse(policy.is_retryable(1, "gfal-copy error: 13 (Permission denied)"))
+
+        results = iter([(1, "[ERROR] Socket timeout"), (0, "done")])
+        self.assertEqual(policy.call(["root://a/"], lambda: next(results)), (0, "done"))
+        self.assertEqual(len(delays), 1)
+        self.assertTrue(0.5 <= delays[0] <= 1.0)
+
+        calls = []
+        def not_found():
+            calls.append(1)
+            return 54, "[3011] No such file or directory"
+        self.assertEqual(policy.call(["root://a/"], not_found)[0], 54)
+        self.assertEqual(len(calls), 1)
+
+        self.assertEqual(policy.call(["root://b/"], lambda: (1, "[FATAL] Connection refused"))[0], 1)
+        with self.assertRaises(copyfiles.CircuitOpenError):
+            policy.call(["root://b/"], lambda: (1, "[FATAL] Connection refused"))
+        self.assertEqual(policy.open_endpoints(), {"root://b/"})
+        with self.assertRaises(copyfiles.CircuitOpenError):
+            policy.call(["root://b/"], lambda: (0, ""))
+        self.assertEqual(policy.call(["root://a/"], lambda: (0, "")), (0, ""))
+
+class LocalStatus:
+    """A stand-in for the XRootD.client.responses.XRootDStatus object."""
+    def __init__(self, ok, message = ""):
+        self.ok = ok
+        self.message = message
+
+class LocalStatInfo:
+    """A stand-in for the XRootD.client.responses.StatInfo object, filled from os.stat."""
+    def __init__(self, path):
+        info = os.stat(path)
+        self.size = info.st_size
+        self.flags = copyfiles.XRootDBackend.stat_is_dir if os.path.isdir(path) else 0
+        self.modtime = int(info.st_mtime)
+        self.modtimestr = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(info.st_mtime))
+
+class LocalDirListEntry:
+    """A stand-in for the XRootD.client.responses.ListEntry object, which only has the stat information when it was requested."""
+    def __init__(self, path, stat = True):
+        self.name = os.path.basename(path)
+        self.statinfo = LocalStatInfo(path) if stat else None
+
+class LocalFileSystem:
+    """A stand-in for XRootD.client.FileSystem which serves the files below a local directory, so that the
+    XRootD backend can be tested without a live server.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, path):
+        """Map a path on the fake endpoint to the local directory."""
+        return os.path.join(self.root, path.lstrip("/"))
+
+    # the XrdCl values of DirListFlags.STAT and MkDirFlags.MAKEPATH
+    dirlist_stat = 1
+    mkdir_makepath = 1
+
+    def dirlist(self, path, flags = 0):
+        """List a directory, including the stat information for each entry if the STAT flag is given."""
+        path = self.local_path(path)
+        if not os.path.isdir(path):
+            return LocalStatus(False, "[3011] No such file or directory"), None
+        return LocalStatus(True), [LocalDirListEntry(os.path.join(path, name), bool(flags & self.dirlist_stat)) \
+                                   for name in sorted(os.listdir(path))]
+
+    def stat(self, path):
+        """Stat a single path."""
+        path = self.local_path(path)
+        if not os.path.exists(path):
+            return LocalStatus(False, "[3011] No such file or directory"), None
+        return LocalStatus(True), LocalStatInfo(path)
+
+    def mkdir(self, path, flags = 0):
+        """Make a directory, and any missing parents if the MAKEPATH flag is given."""
+        try:
+            if flags & self.mkdir_makepath:
+                os.makedirs(self.local_path(path), exist_ok = True)
+            else:
+                os.mkdir(self.local_path(path))
+        except OSError as why:
+            return LocalStatus(False, str(why)), None
+        return LocalStatus(True), None
+
+class LocalCopyProcess:
+    """A stand-in for XRootD.client.CopyProcess which copies between paths on the fake endpoint."""
+    def __init__(self, root):
+        self.filesystem = LocalFileSystem(root)
+        self.jobs = []
+
+    def add_job(self, source, target, force = False):
+        """Add a copy job, removing the endpoint part of the URLs."""
+        self.jobs.append((source.replace("root://fake.host/", ""), target.replace("root://fake.host/", ""), force))
+
+    def prepare(self):
+        """Nothing to prepare for a local copy."""
+        return LocalStatus(True)
+
+    def run(self):
+        """Copy the files and report the status of each job."""
+        results = []
+        for source, target, force in self.jobs:
+            if not force and os.path.exists(self.filesystem.local_path(target)):
+                results.append({"status" : LocalStatus(False, "[3018] File exists")})
+                continue
+            try:
+                shutil.copyfile(self.filesystem.local_path(source), self.filesystem.local_path(target))
+                results.append({"status" : LocalStatus(True)})
+            except OSError as why:
+                results.append({"status" : LocalStatus(False, str(why))})
+        return LocalStatus(all(result["status"].ok for result in results)), results
+
+class TestCopyfilesXRootDBackend(unittest.TestCase):
+    """Tests for the XRootD python bindings backend of copyfiles, using a local stand-in for the XRootD client."""
+
+    def setUp(self):
+        """Create a small tree of files in a temporary directory, which acts as the storage of the fake endpoint."""
+        self.root = tempfile.mkdtemp()
+        self.connections = []
+        os.makedirs(os.path.join(self.root, "store/user/tester/data/subdir"))
+        with open(os.path.join(self.root, "store/user/tester/data/file.root"), "w", encoding = "utf-8") as file:
+            file.write("0123456789")
+        self.site = copyfiles.Location("T3_US_Test", "tester", "data")
+        self.site.endpoints[copyfiles.GetSiteInfo.EndpointType.XROOTD].add("root://fake.host/")
+        self.backend = copyfiles.XRootDBackend(filesystem_factory = self.make_filesystem,
+                                               copy_process_factory = lambda: LocalCopyProcess(self.root),
+                                               retry_policy = copyfiles.RetryPolicy(sleep = lambda delay: None))
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        shutil.rmtree(self.root)
+
+    def make_filesystem(self, endpoint):
+        """Create a stand-in FileSystem and record which endpoint it was created for."""
+        self.connections.append(endpoint)
+        return LocalFileSystem(self.root)
+
+    def test_listdir_and_stat(self):
+        """List and stat remote paths, reusing a single connection to the endpoint."""
+        entries = self.backend.listdir(self.site, "data")
+        self.assertEqual(sorted(entries), ["file.root", "subdir"])
+        self.assertTrue(entries["subdir"].is_dir)
+        self.assertEqual(entries["file.root"].size, 10)
+        self.assertIsNone(self.backend.listdir(self.site, "missing"))
+        self.assertFalse(self.backend.stat(self.site, "data/file.root").is_dir)
+        self.assertIsNone(self.backend.stat(self.site, "data/missing.root"))
+        self.assertEqual(self.connections, ["root://fake.host/"])
+
+    def test_mkdir_and_copy(self):
+        """Make a nested directory and copy a file into it."""
+        returncode, _ = self.backend.mkdir(self.site, "copy/a/b")
+        self.assertEqual(returncode, 0)
+        self.assertTrue(self.backend.stat(self.site, "copy/a/b").is_dir)
+        task = copyfiles.CopyTask("root://fake.host//store/user/tester/data/file.root",
+                                  "root://fake.host//store/user/tester/copy/a/b/file.root", "")
+        self.assertEqual(self.backend.copy(task)[0], 0)
+        self.assertEqual(self.backend.stat(self.site, "copy/a/b/file.root").size, 10)
+        self.assertNotEqual(self.backend.copy(task._replace(source = "root://fake.host//missing.root"))[0], 0)
+
+    def test_forced_copy(self):
+        """An existing destination, e.g. a stale file found by --sync, is only overwritten when the task is forced."""
+        with open(os.path.join(self.root, "store/user/tester/data/stale.root"), "w", encoding = "utf-8") as file:
+            file.write("01234")
+        task = copyfiles.CopyTask("root://fake.host//store/user/tester/data/file.root",
+                                  "root://fake.host//store/user/tester/data/stale.root", "")
+        self.assertNotEqual(self.backend.copy(task)[0], 0)
+        self.assertEqual(self.backend.copy(task._replace(force = True))[0], 0)
+        self.assertEqual(self.backend.stat(self.site, "data/stale.root").size, 10)
+        batch = copyfiles.BatchCopyTask((task.source,), (task.destination,), "xrdcp", (10,), True)
+        self.assertEqual(self.backend.copy_batch(batch)[0], 0)
+
+    def test_copy_batch(self):
+        """Copy a batch of files, one of which is missing, and make sure that only the missing file is reported."""
+        self.backend.mkdir(self.site, "copy")
+        sources = ("root://fake.host//store/user/tester/data/file.root", "root://fake.host//store/user/tester/data/missing.root")
+        task = copyfiles.BatchCopyTask(sources,
+                                       tuple(source.replace("/data/", "/copy/") for source in sources),
+                                       "xrdcp",
+                                       (10, None))
+        returncode, output = self.backend.copy_batch(task)
+        failures = copyfiles.parse_batch_failures(task, returncode, output)
+        self.assertEqual([failure[0] for failure in failures], [sources[1]])
+        self.assertIsNotNone(self.backend.stat(self.site, "copy/file.root"))
+
 if __name__ == '__main__':
     unittest.main()
@@ -6,39 +6,179 @@ Note to users: This is not to be used for xrdcp'ing files from an XRootD source
 nor from an XRootD source to an XRootD endpoint. For those kinds of transfers, XRootD already supports
 them with the command `xrdcp -r'.
 
+The files can be uploaded concurrently (-j/--jobs) and each upload which fails for a transient reason is
+retried (--retries) before it is counted as a failure, while errors such as a permission problem fail straight
+away. A failure does not stop the other uploads; a summary of the failed files is printed at the end.
+If a manifest is requested (-m/--manifest), one JSON object is written per line for each file, containing
+the path, size, adler32 checksum, and status of the upload. Running again with --resume and the same
+manifest will skip the files which were already uploaded successfully.
+
 Created by: John Hakala, 03/28/2017
 Modified by: Alexx Perloff, 10/02/2021
 """
 
 from __future__ import absolute_import
 import argparse
+import concurrent.futures
+import json
+import os
 import subprocess
 import sys
+import threading
+import zlib
+from copyfiles import CircuitOpenError, RetryPolicy, command_endpoints
 from RecursiveFileList import get_file_list
 
-parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
-parser.add_argument("-r", "--redir", metavar = "redirector", default = "root://cmseos.fnal.gov/",
-                    help = "the XRootD endpoint (default = %(default)s)")
-parser.add_argument("-s", "--source", metavar = "source",
-                    help = "the local source directory")
-parser.add_argument("-t", "--target", metavar = "target",
-                    help = "the XRootD endpoint target directory")
-args = parser.parse_args()
-
-if args.source is None or args.target is None:
-    print("Error: please define the source and target")
-    parser.print_help()
-    sys.exit(1)
-
 ## Apparently this isn't needed on EOS: xrdcp will make any enclosing directories on eos
 #from recursiveFileList import getDirList
 #for sourceDir in getDirList(args.source):
 #  targetDir = sourceDir.replace(args..source, args..target)
 #  print getoutput('eosmkdir %s' % targetDir)
 
-for sourceFile in get_file_list(args.source):
-    targetFile = sourceFile.replace(args.source, args.target)
-    command = f"xrdcp {sourceFile} {args.redir}/{targetFile}"
-    output = subprocess.check_output(command, stderr=subprocess.STDOUT, shell=True)
+def adler32(file_path, chunk_size = 1024 * 1024):
+    """Return the adler32 checksum of a local file as an eight character hexadecimal string."""
+    value = 1
+    with open(file_path, "rb") as local_file:
+        for chunk in iter(lambda: local_file.read(chunk_size), b""):
+            value = zlib.adler32(chunk, value)
+    return f"{value & 0xffffffff:08x}"
+
+def target_path(source_file, source, target):
+    """Return the path of 'source_file' below the 'target' directory.
+    The path is built from the location of the file relative to 'source', so that the source directory name
+    appearing more than once in the path does not matter.
+    """
+    return os.path.join(target, os.path.relpath(source_file, source))
+
+def upload(source_file, target_file, redir, retry_policy, force = False):
+    """Copy a single file with xrdcp. The errors are classified by the copyfiles RetryPolicy, so only the transient
+    failures are retried, with an increasing delay, and the redirector is not contacted once it keeps failing.
+    A failed attempt may leave a partial target file behind, so the retries overwrite it (xrdcp -f), as does
+    every attempt if 'force' is True.
+    Return a tuple containing the command, the return code of the last attempt, and its output.
+    """
+    commands = []
+    def attempt():
+        commands.append(["xrdcp"] + (["-f"] if force or commands else []) + [source_file, f"{redir}/{target_file}"])
+        result = subprocess.run(commands[-1], stdout = subprocess.PIPE, stderr = subprocess.STDOUT, check = False)
+        return result.returncode, result.stdout.decode('utf-8')
+    try:
+        returncode, output = retry_policy.call(command_endpoints(redir), attempt)
+    except CircuitOpenError as why:
+        returncode, output = 1, str(why)
+    return " ".join(commands[-1] if commands else ["xrdcp", source_file, f"{redir}/{target_file}"]), returncode, output
+
+class Manifest:
+    """A JSON lines record of the uploaded files.
+    Each line contains the path, size, adler32 checksum, and status of one file.
+    Later lines for the same path replace the earlier ones.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Return a dictionary mapping each path in the manifest to its last record."""
+        records = {}
+        if not self.path or not os.path.exists(self.path):
+            return records
+        with open(self.path, encoding = "utf-8") as manifest_file:
+            for line in manifest_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record["path"]] = record
+        return records
+
+    def write(self, **record):
+        """Append a record to the manifest."""
+        if not self.path:
+            return
+        with self.lock, open(self.path, "a", encoding = "utf-8") as manifest_file:
+            manifest_file.write(json.dumps(record, sort_keys = True) + "\n")
+
+def transfer(source_file, arguments, manifest, retry_policy):
+    """Upload a single file and record the result in the manifest.
+    Return a tuple of the source file and the error output, which is None if the upload succeeded.
+    A file which cannot be read (e.g. it was removed after the listing) is recorded as failed.
+    When resuming, the target may be a partial file left by the earlier run, so it is overwritten.
+    """
+    target_file = target_path(source_file, arguments.source, arguments.target)
+    try:
+        size = os.path.getsize(source_file)
+        checksum = adler32(source_file) if manifest.path else None
+    except OSError as why:
+        manifest.write(path = source_file, target = target_file, size = None, adler32 = None, status = "failed")
+        return source_file, f"unable to read the file: {why}"
+    command, returncode, output = upload(source_file, target_file, arguments.redir, retry_policy, force = arguments.resume)
     print(command)
-    print(output.decode('utf-8'))
+    print(output)
+    status = "done" if returncode == 0 else "failed"
+    manifest.write(path = source_file, target = target_file, size = size, adler32 = checksum, status = status)
+    return source_file, (None if returncode == 0 else output.strip() or f"xrdcp exited with code {returncode}")
+
+def main(arguments):
+    """Upload the files below the source directory and return the list of (file, reason) failures."""
+    manifest = Manifest(arguments.manifest)
+    retry_policy = RetryPolicy(max_attempts = arguments.retries + 1, base_delay = arguments.retry_delay)
+    files = get_file_list(arguments.source, arguments.workers)
+    if arguments.resume:
+        previous = manifest.load()
+        def uploaded(source_file):
+            try:
+                return previous[source_file]["status"] == "done" and previous[source_file]["size"] == os.path.getsize(source_file)
+            except (KeyError, OSError):
+                return False
+        files = [f for f in files if not uploaded(f)]
+        print(f"Resuming: {len(files)} files left to upload")
+
+    failures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, arguments.jobs)) as executor:
+        futures = [executor.submit(transfer, f, arguments, manifest, retry_policy) for f in files]
+        for future in concurrent.futures.as_completed(futures):
+            source_file, reason = future.result()
+            if reason is not None:
+                failures.append((source_file, reason))
+
+    print(f"Uploaded {len(files) - len(failures)} of {len(files)} files")
+    if failures:
+        print(f"{len(failures)} files failed to upload:")
+        for source_file, reason in sorted(failures):
+            print(f"\t{source_file}: {reason.splitlines()[-1] if reason else ''}")
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-r", "--redir", metavar = "redirector", default = "root://cmseos.fnal.gov/",
+                        help = "the XRootD endpoint (default = %(default)s)")
+    parser.add_argument("-s", "--source", metavar = "source",
+                        help = "the local source directory")
+    parser.add_argument("-t", "--target", metavar = "target",
+                        help = "the XRootD endpoint target directory")
+    parser.add_argument("-w", "--workers", metavar = "workers", default = 1, type = int,
+                        help = "the number of threads used to list the source directory;\n"
+                               "useful for network mounted filesystems (default = %(default)s)")
+    parser.add_argument("-j", "--jobs", metavar = "jobs", default = 1, type = int,
+                        help = "the number of files to upload concurrently (default = %(default)s)")
+    parser.add_argument("--retries", metavar = "retries", default = 3, type = int,
+                        help = "the number of times an upload which failed for a transient reason is retried (default = %(default)s)")
+    parser.add_argument("--retry_delay", metavar = "seconds", default = 2.0, type = float,
+                        help = "the delay before the first retry, doubled for each retry after that (default = %(default)s)")
+    parser.add_argument("-m", "--manifest", metavar = "manifest", default = "",
+                        help = "write a JSON lines manifest with the path, size, adler32, and status of each file")
+    parser.add_argument("--resume", action = "store_true",
+                        help = "skip the files recorded as uploaded in the manifest (default = %(default)s)")
+    args = parser.parse_args()
+
+    if args.source is None or args.target is None:
+        print("Error: please define the source and target")
+        parser.print_help()
+        sys.exit(1)
+    if args.resume and not args.manifest:
+        print("Error: --resume requires a manifest")
+        parser.print_help()
+        sys.exit(1)
+
+    sys.exit(1 if main(args) else 0)